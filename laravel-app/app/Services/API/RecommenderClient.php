@@ -26,8 +26,8 @@ class RecommenderClient
         $endpoint = "{\->fastApiUrl}/recommendations/recalculate/{\}";
 
         try {
-            // 使用 timeout(2) 確保不會長時間阻塞 Laravel 請求
-            // 如果希望更徹底的「非同步」，則需要結合 Laravel Queue Job
+            // FastAPI 只將用戶排入重算佇列並回應 202，實際計算由其背景 worker 批次完成；
+            // 仍使用 timeout(2) 確保不會長時間阻塞 Laravel 請求
             $response = Http::timeout(2)->post($endpoint);
 
             if ($response->successful()) {
@@ -74,4 +74,36 @@ class RecommenderClient
             return null;
         }
     }
+
+    /**
+     * 一次取得多個用戶的推薦結果（例如電子報或首頁預熱等批次工作）。
+     *
+     * @param array<int> $userIds
+     * @param int $numRecommendations
+     * @return array<int, array<int>>|null 以 user_id 為 key 的商品 ID 列表
+     */
+    public function getBatchRecommendations(array $userIds, int $numRecommendations = 5): ?array
+    {
+        $endpoint = "{$this->fastApiUrl}/recommendations/batch";
+
+        try {
+            $response = Http::timeout(30)->post($endpoint, [
+                'user_ids' => array_values($userIds),
+                'num_recommendations' => $numRecommendations,
+            ]);
+
+            if ($response->successful()) {
+                return $response->json('recommendations');
+            } else {
+                Log::error("RecommenderClient: Failed to get batch recommendations for " . count($userIds) . " users. Status: {$response->status()} Body: {$response->body()}");
+                return null;
+            }
+        } catch (\Illuminate\Http\Client\ConnectionException $e) {
+            Log::error("RecommenderClient: Connection error trying to get batch recommendations: {$e->getMessage()}");
+            return null;
+        } catch (\Exception $e) {
+            Log::error("RecommenderClient: Unexpected error calling FastAPI batch recommendation API: {$e->getMessage()}");
+            return null;
+        }
+    }
 }
@@ -30,15 +30,15 @@ class RecommendationService
      */
     public function getRecommendations(int $userId, int $numRecommendations = 5): Collection
     {
-        $cacheKey = "user:{\}:recommendations";
+        $cacheKey = "user:{$userId}:recommendations";
         $fallbackCacheKey = "user:{\}:recommendations_fallback"; // For file cache
 
         // 1. 嘗試從 Redis 快取中獲取
         try {
-            $cachedProductIdsJson = $this->redis->get($cacheKey);
-            if ($cachedProductIdsJson) {
+            $cachedRankedList = $this->redis->get($cacheKey);
+            $recommendedProductIds = $cachedRankedList ? $this->decodeRankedList($cachedRankedList, $numRecommendations) : null;
+            if ($recommendedProductIds !== null) {
                 Log::info("RecommendationService: Fetched recommendations for user {$userId} from Redis cache.");
-                $recommendedProductIds = json_decode($cachedProductIdsJson, true);
                 return Product::whereIn('id', $recommendedProductIds)->get();
             }
         } catch (\Exception $e) {
@@ -81,6 +81,37 @@ class RecommendationService
         return $this->getPopularProducts($numRecommendations);
     }
 
+    /**
+     * 解析 FastAPI 寫入的排序推薦（二進位格式，見 recommender-service 的 ranked_list.py），
+     * 並取前 $numRecommendations 名。
+     * 格式不符、或快取的深度不足 $numRecommendations 時回傳 null，視為快取未命中。
+     *
+     * @param string $payload
+     * @param int $numRecommendations
+     * @return array|null
+     */
+    protected function decodeRankedList(string $payload, int $numRecommendations): ?array
+    {
+        // 標頭 24 bytes："RL"、格式版本、保留 1 byte、模型版本、計算時間、計算深度、筆數（little-endian）
+        if (strlen($payload) < 24) {
+            return null;
+        }
+        $header = unpack('a2magic/Cformat/x/Vmodel_version/ecomputed_at/Vdepth/Vcount', $payload);
+        if ($header['magic'] !== 'RL' || $header['format'] !== 2 || strlen($payload) !== 24 + $header['count'] * 12) {
+            return null;
+        }
+        if ($numRecommendations > $header['depth']) {
+            return null;
+        }
+
+        $count = min($numRecommendations, $header['count']);
+        if ($count <= 0) {
+            return [];
+        }
+        // 商品 ID 為 int64（對應 products.id 的 unsigned bigint），緊接在標頭之後；只解析需要的前 $count 筆
+        return array_values(unpack("P{$count}", $payload, 24));
+    }
+
     /**
      * 從資料庫獲取熱門商品作為冷啟動或 fallback 推薦。
      * @param int $numRecommendations
@@ -1,87 +1,264 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from typing import List
-import json
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from pydantic import BaseModel, Field
+from typing import Dict, List, Optional
+from redis.asyncio import Redis
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
 import logging
 import time
 
-from ...dependencies import get_db, get_redis_client
-from ...services.recommender_logic import Recommender
+from ...core.config import settings
+from ...dependencies import (get_db, get_async_db, get_async_redis_client, get_model_store, get_single_flight,
+                              get_recommendation_cache, get_recalculation_queue)
+from ...services.model_store import ModelStore
+from ...services.executor import run_in_scoring_executor
+from ...services.singleflight import SingleFlight
+from ...services.recommendation_cache import RecommendationCache, recommendation_cache_key
+from ...services.recalculation_queue import RecalculationQueue, RecalculationQueueFull
+from ...services.eligibility import ProductFilter
+from ...services.ranked_list import RankedList
 from ...models.user import User
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+class BatchRecommendationRequest(BaseModel):
+    user_ids: List[int] = Field(..., min_length=1)
+    num_recommendations: int = 5
+    # 只推薦指定分類的商品，以及要排除的商品（例如購物車內的商品）；有這些條件時結果不寫入快取
+    category_id: Optional[int] = None
+    exclude_product_ids: List[int] = []
+
+class BatchRecommendationResponse(BaseModel):
+    recommendations: Dict[int, List[int]]
+    not_found: List[int] = []
+
+async def _user_exists(async_db: AsyncSession, user_id: int) -> bool:
+    result = await async_db.execute(select(User.id).where(User.id == user_id))
+    return result.first() is not None
+
+def _product_filter(category_id: Optional[int], exclude_product_ids: Optional[List[int]]) -> ProductFilter:
+    exclude_product_ids = exclude_product_ids or []
+    if len(exclude_product_ids) > settings.MAX_EXCLUDED_PRODUCTS:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"At most {settings.MAX_EXCLUDED_PRODUCTS} product IDs can be excluded per request."
+        )
+    return ProductFilter(category_id=category_id, exclude_product_ids=tuple(dict.fromkeys(exclude_product_ids)),
+                         in_stock_only=settings.RECOMMEND_IN_STOCK_ONLY)
+
+def _ensure_owned(model_store: ModelStore, user_ids: List[int]) -> None:
+    # 分片部署時每個 worker 只持有雜湊到自己的用戶，送錯分片的請求直接拒絕，由路由前端轉送到正確的分片
+    misdirected = [user_id for user_id in user_ids if not model_store.owns_user(user_id)]
+    if misdirected:
+        raise HTTPException(
+            status_code=status.HTTP_421_MISDIRECTED_REQUEST,
+            detail=f"Users {misdirected} are not served by shard {settings.SHARD_INDEX}/{settings.NUM_SHARDS}."
+        )
+
+def _cache_depth(num_recommendations: int) -> int:
+    # 快取的排序推薦至少計算 RECOMMENDATION_CACHE_DEPTH 名，不同 num_recommendations 的請求共用同一份
+    return max(num_recommendations, settings.RECOMMENDATION_CACHE_DEPTH)
+
+def _rank_for_user(model_store: ModelStore, db: Optional[Session], user_id: int, depth: int,
+                   product_filter: Optional[ProductFilter] = None) -> RankedList:
+    # 在計分執行緒池中執行：可能需要建立快照或查詢熱門商品，皆為同步且 CPU / I/O 密集的工作
+    if db is None:
+        # 背景更新在請求結束後才執行，請求的 session 已關閉，需自行開啟
+        db = model_store.open_session()
+        try:
+            return model_store.create_recommender(db).rank_for_user(user_id, depth, product_filter)
+        finally:
+            db.close()
+    return model_store.create_recommender(db).rank_for_user(user_id, depth, product_filter)
+
+async def _compute_and_cache(model_store: ModelStore, db: Optional[Session], redis_client: Redis,
+                             single_flight: SingleFlight, cache: RecommendationCache,
+                             user_id: int, num_recommendations: int, wait_for_other_workers: bool = True):
+    """
+    計算並寫回單一用戶的排序推薦（進程內快取與 Redis），回傳 (RankedList, 是否成功寫入 Redis)。
+    以 _cache_depth 計算，呼叫端再依 num_recommendations 切片。
+    同一用戶的並發計算會經由 single-flight 合併：同進程內共用一次計算，
+    跨 worker 則由 Redis 短期鎖決定由誰計算，其他 worker 等待其寫回的結果。
+    db 為 None 時（背景更新）由計分執行緒自行開啟 session。
+    """
+    redis_key = recommendation_cache_key(user_id)
+    depth = _cache_depth(num_recommendations)
+
+    async def compute():
+        logger.info(f"Calculating recommendations for user {user_id}...")
+        start_time = time.time()
+        # 使用進程內共享的模型快照，僅需針對單一用戶計分；計分移到執行緒池，不阻塞 event loop
+        ranked = await run_in_scoring_executor(_rank_for_user, model_store, db, user_id, depth)
+        logger.info(f"Recommendation calculation for user {user_id} took {time.time() - start_time:.4f} seconds. "
+                    f"Result: {ranked.top(num_recommendations)}")
+
+        cached = False
+        if ranked.size:
+            cached = await cache.set(redis_client, user_id, ranked)
+            if cached:
+                logger.info(f"Recommendations for user {user_id} cached in Redis.")
+        return ranked, cached
+
+    async def read_cached():
+        cached_recommendations = await cache.get_remote(redis_client, user_id)
+        if cached_recommendations is None or not cached_recommendations.covers(depth):
+            return None
+        return cached_recommendations, True
+
+    return await single_flight.do(
+        f"{redis_key}:{depth}",
+        compute,
+        redis_client=redis_client,
+        read_cached=read_cached if wait_for_other_workers and redis_client else None
+    )
+
+def _rank_for_users(model_store: ModelStore, db: Session, user_ids: List[int],
+                    depth: int, product_filter: Optional[ProductFilter] = None) -> Dict[int, RankedList]:
+    return model_store.create_recommender(db).rank_for_users(user_ids, depth, product_filter)
+
 @router.get("/recommendations/{user_id}", response_model=List[int])
 async def get_recommendations_for_user(
     user_id: int,
     num_recommendations: int = 5,
-    db: Depends(get_db),
-    redis_client: Depends(get_redis_client)
+    category_id: Optional[int] = None,
+    exclude: Optional[List[int]] = Query(None, description="Product IDs to leave out, e.g. ?exclude=3&exclude=7."),
+    async_db: AsyncSession = Depends(get_async_db),
+    db: Session = Depends(get_db),
+    redis_client: Redis = Depends(get_async_redis_client),
+    model_store: ModelStore = Depends(get_model_store),
+    single_flight: SingleFlight = Depends(get_single_flight),
+    cache: RecommendationCache = Depends(get_recommendation_cache)
 ):
     logger.info(f"Received recommendation request for user_id: {user_id}")
+    _ensure_owned(model_store, [user_id])
+    product_filter = _product_filter(category_id, exclude)
 
-    user_exists = db.query(User).filter(User.id == user_id).first()
-    if not user_exists:
+    if not await _user_exists(async_db, user_id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"User with ID {user_id} not found."
         )
 
-    redis_key = f"user:{user_id}:recommendations"
-    if redis_client:
-        try:
-            cached_recommendations = redis_client.get(redis_key)
-            if cached_recommendations:
-                logger.info(f"Returning cached recommendations for user {user_id}")
-                return json.loads(cached_recommendations)
-        except Exception as e:
-            logger.error(f"Error accessing Redis for user {user_id}: {e}")
-            # 如果 Redis 讀取失敗，繼續計算推薦
+    if product_filter.is_request_specific:
+        # 分類與排除條件在計分時以預先計算的遮罩套用（top-k 之前），成本與快取未命中的一般請求相同；
+        # 結果只適用於這組條件，不讀寫用戶的推薦快取
+        ranked = await run_in_scoring_executor(_rank_for_user, model_store, db, user_id, num_recommendations,
+                                               product_filter)
+        return ranked.top(num_recommendations)
+
+    # 先查進程內快取，再查 Redis；Redis 讀取失敗、或快取的深度不足 num_recommendations 時視為未命中，繼續計算推薦
+    cached_recommendations, stale = await cache.get(redis_client, user_id)
+    if cached_recommendations is not None and cached_recommendations.covers(num_recommendations):
+        if stale:
+            # stale-while-revalidate：先回傳舊值，背景重新計算並寫回兩層快取
+            logger.info(f"Returning stale recommendations for user {user_id}, refreshing in background.")
+            cache.schedule_refresh(user_id, lambda: _compute_and_cache(
+                model_store, None, redis_client, single_flight, cache, user_id, num_recommendations,
+                wait_for_other_workers=False))
+        else:
+            logger.info(f"Returning cached recommendations for user {user_id}")
+        return cached_recommendations.top(num_recommendations)
 
     logger.info(f"Cache miss for user {user_id} or Redis error. Calculating recommendations...")
-    start_time = time.time()
-    
-    recommender = Recommender(db)
-    recommended_product_ids = recommender.recommend_for_user(user_id, num_recommendations)
-    
-    end_time = time.time()
-    logger.info(f"Recommendation calculation for user {user_id} took {end_time - start_time:.4f} seconds. Result: {recommended_product_ids}")
-
-    if redis_client and recommended_product_ids:
-        try:
-            redis_client.setex(redis_key, 3600, json.dumps(recommended_product_ids))
-            logger.info(f"Recommendations for user {user_id} cached in Redis.")
-        except Exception as e:
-            logger.error(f"Error writing recommendations to Redis for user {user_id}: {e}")
+    ranked, _ = await _compute_and_cache(model_store, db, redis_client, single_flight, cache,
+                                         user_id, num_recommendations)
+    return ranked.top(num_recommendations)
+
+@router.post("/recommendations/batch", response_model=BatchRecommendationResponse)
+async def get_recommendations_for_users(
+    request: BatchRecommendationRequest,
+    async_db: AsyncSession = Depends(get_async_db),
+    db: Session = Depends(get_db),
+    redis_client: Redis = Depends(get_async_redis_client),
+    model_store: ModelStore = Depends(get_model_store),
+    cache: RecommendationCache = Depends(get_recommendation_cache)
+):
+    """
+    批次取得多個用戶的推薦：一次 IN 查詢確認用戶存在、進程內快取未命中的部分一次 Redis MGET、
+    對所有快取未命中（或快取深度不足）的用戶做一次向量化計分，最後以 pipeline 一次寫回 Redis。
+    """
+    user_ids = list(dict.fromkeys(request.user_ids))
+    if len(user_ids) > settings.BATCH_MAX_USERS:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"At most {settings.BATCH_MAX_USERS} user IDs are allowed per batch request."
+        )
+    logger.info(f"Received batch recommendation request for {len(user_ids)} users.")
+    _ensure_owned(model_store, user_ids)
+
+    result = await async_db.execute(select(User.id).where(User.id.in_(user_ids)))
+    existing_user_ids = set(result.scalars().all())
+    found_user_ids = [user_id for user_id in user_ids if user_id in existing_user_ids]
+    not_found = [user_id for user_id in user_ids if user_id not in existing_user_ids]
 
-    return recommended_product_ids
+    product_filter = _product_filter(request.category_id, request.exclude_product_ids)
+    # 有分類或排除條件時整批重新計分，結果不讀寫快取
+    cacheable = not product_filter.is_request_specific
+    num_recommendations = request.num_recommendations
+    recommendations: Dict[int, RankedList] = {}
+    if cacheable:
+        cached = await cache.get_many(redis_client, found_user_ids)
+        recommendations = {user_id: ranked for user_id, ranked in cached.items() if ranked.covers(num_recommendations)}
 
-@router.post("/recommendations/recalculate/{user_id}")
+    missed_user_ids = [user_id for user_id in found_user_ids if user_id not in recommendations]
+    if missed_user_ids:
+        start_time = time.time()
+        depth = _cache_depth(num_recommendations) if cacheable else num_recommendations
+        computed = await run_in_scoring_executor(_rank_for_users, model_store, db, missed_user_ids,
+                                                 depth, product_filter)
+        logger.info(f"Batch recommendation calculation for {len(missed_user_ids)} users took {time.time() - start_time:.4f} seconds.")
+        recommendations.update(computed)
+
+        if cacheable:
+            await cache.set_many(redis_client, {user_id: computed[user_id] for user_id in missed_user_ids
+                                                if user_id in computed and computed[user_id].size})
+
+    return BatchRecommendationResponse(
+        recommendations={user_id: recommendations[user_id].top(num_recommendations) for user_id in found_user_ids},
+        not_found=not_found
+    )
+
+@router.post("/recommendations/recalculate/{user_id}", status_code=status.HTTP_202_ACCEPTED)
 async def recalculate_user_recommendations(
     user_id: int,
-    db: Depends(get_db),
-    redis_client: Depends(get_redis_client)
+    async_db: AsyncSession = Depends(get_async_db),
+    model_store: ModelStore = Depends(get_model_store),
+    queue: RecalculationQueue = Depends(get_recalculation_queue)
 ):
-    logger.info(f"Forcing recalculation for user_id: {user_id}")
-    
-    user_exists = db.query(User).filter(User.id == user_id).first()
-    if not user_exists:
+    """
+    將用戶排入重算佇列後立即回應 202，由背景 worker 批次計分並寫回快取。
+    同一用戶已在佇列中時不會重複排入。
+    """
+    logger.info(f"Queueing recalculation for user_id: {user_id}")
+    _ensure_owned(model_store, [user_id])
+
+    if not await _user_exists(async_db, user_id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"User with ID {user_id} not found."
         )
 
-    recommender = Recommender(db)
-    recommended_product_ids = recommender.recommend_for_user(user_id, 5) # 可以傳遞數量參數，或使用默認值
-    
-    if redis_client and recommended_product_ids:
-        try:
-            redis_key = f"user:{user_id}:recommendations"
-            redis_client.setex(redis_key, 3600, json.dumps(recommended_product_ids))
-            logger.info(f"Recommendations for user {user_id} re-calculated and updated in Redis.")
-        except Exception as e:
-            logger.error(f"Error writing re-calculated recommendations to Redis for user {user_id}: {e}")
-            return {"message": f"Recommendations calculated for user {user_id} but failed to cache.", "status": "error"}
-
-    return {"message": f"Recommendations for user {user_id} re-calculated and cached."}
+    try:
+        queued = queue.enqueue(user_id)
+    except RecalculationQueueFull as e:
+        logger.warning(f"Rejected recalculation for user {user_id}: {e}")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+
+    return {
+        "message": f"Recalculation for user {user_id} queued.",
+        "queued": queued,
+        "queue_depth": len(queue)
+    }
+
+@router.get("/recalculation/stats")
+async def get_recalculation_stats(queue: RecalculationQueue = Depends(get_recalculation_queue)):
+    """重算佇列的深度、延遲與處理統計（僅限本 worker）。"""
+    return queue.stats()
+
+@router.get("/cache/stats")
+async def get_cache_stats(cache: RecommendationCache = Depends(get_recommendation_cache)):
+    """進程內快取與 Redis 的命中 / 未命中統計（僅限本 worker）。"""
+    return cache.stats()
@@ -0,0 +1,97 @@
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from typing import Dict, List
+import httpx
+import logging
+
+from ...core.config import settings
+from ...dependencies import get_shard_router
+from ...services.sharding import ShardRouter, ShardUnavailable
+from .routes import BatchRecommendationRequest, BatchRecommendationResponse
+
+logger = logging.getLogger(__name__)
+
+# 路由前端（設定 SHARD_URLS 時）的端點：路徑與 scoring worker 相同，Laravel 端不需修改
+router = APIRouter()
+
+def _relay(response: httpx.Response) -> Response:
+    # 分片的狀態碼與內容原樣回傳（包含 404 / 422 / 503）
+    return Response(content=response.content, status_code=response.status_code,
+                    media_type=response.headers.get("content-type"))
+
+def _bad_gateway(e: ShardUnavailable) -> HTTPException:
+    return HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=str(e))
+
+@router.get("/recommendations/{user_id}", response_model=List[int])
+async def get_recommendations_for_user(user_id: int, request: Request,
+                                       shard_router: ShardRouter = Depends(get_shard_router)):
+    try:
+        response = await shard_router.forward(user_id, "GET", request.url.path, params=request.query_params.multi_items())
+    except ShardUnavailable as e:
+        raise _bad_gateway(e)
+    return _relay(response)
+
+@router.post("/recommendations/batch", response_model=BatchRecommendationResponse)
+async def get_recommendations_for_users(batch: BatchRecommendationRequest, request: Request,
+                                        shard_router: ShardRouter = Depends(get_shard_router)):
+    """
+    依分片拆開批次請求，並行送到各分片後依原本的用戶順序合併結果。
+    任一分片回應錯誤時整批以該錯誤回應；無法連線時回應 502。
+    """
+    user_ids = list(dict.fromkeys(batch.user_ids))
+    if len(user_ids) > settings.BATCH_MAX_USERS:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"At most {settings.BATCH_MAX_USERS} user IDs are allowed per batch request."
+        )
+
+    partitions = shard_router.partition(user_ids)
+    logger.info(f"Fanning out batch recommendation request for {len(user_ids)} users to {len(partitions)} shards.")
+    payload = batch.model_dump()
+    try:
+        responses = await shard_router.fan_out(
+            {shard: {"json": {**payload, "user_ids": shard_user_ids}} for shard, shard_user_ids in partitions.items()},
+            "POST", request.url.path
+        )
+    except ShardUnavailable as e:
+        raise _bad_gateway(e)
+
+    recommendations: Dict[int, List[int]] = {}
+    not_found = set()
+    for shard, response in responses.items():
+        if response.status_code != status.HTTP_200_OK:
+            logger.warning(f"Shard {shard} answered the batch request with HTTP {response.status_code}.")
+            return _relay(response)
+        shard_result = BatchRecommendationResponse.model_validate(response.json())
+        recommendations.update(shard_result.recommendations)
+        not_found.update(shard_result.not_found)
+
+    return BatchRecommendationResponse(
+        recommendations={user_id: recommendations[user_id] for user_id in user_ids if user_id in recommendations},
+        not_found=[user_id for user_id in user_ids if user_id in not_found]
+    )
+
+@router.post("/recommendations/recalculate/{user_id}", status_code=status.HTTP_202_ACCEPTED)
+async def recalculate_user_recommendations(user_id: int, request: Request,
+                                           shard_router: ShardRouter = Depends(get_shard_router)):
+    try:
+        response = await shard_router.forward(user_id, "POST", request.url.path)
+    except ShardUnavailable as e:
+        raise _bad_gateway(e)
+    return _relay(response)
+
+async def _stats_from_all_shards(shard_router: ShardRouter, path: str) -> Dict[int, dict]:
+    try:
+        responses = await shard_router.fan_out({shard: {} for shard in range(shard_router.num_shards)}, "GET", path)
+    except ShardUnavailable as e:
+        raise _bad_gateway(e)
+    return {shard: response.json() for shard, response in sorted(responses.items())}
+
+@router.get("/recalculation/stats")
+async def get_recalculation_stats(request: Request, shard_router: ShardRouter = Depends(get_shard_router)):
+    """各分片的重算佇列統計，以分片編號為鍵。"""
+    return await _stats_from_all_shards(shard_router, request.url.path)
+
+@router.get("/cache/stats")
+async def get_cache_stats(request: Request, shard_router: ShardRouter = Depends(get_shard_router)):
+    """各分片的快取命中統計，以分片編號為鍵。"""
+    return await _stats_from_all_shards(shard_router, request.url.path)
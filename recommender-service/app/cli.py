@@ -0,0 +1,227 @@
+"""
+推薦服務的離線批次工作入口。
+
+用法：
+    python -m app.cli build-item-index [--output DIR] [--neighbours N]
+    python -m app.cli train-als [--output DIR] [--factors F] [--iterations N] [--threads T]
+    python -m app.cli export-model [--root DIR] [--with-item-index] [--with-als] [--with-user-ann]
+    python -m app.cli precompute [--workers W] [--block-size B] [--shard I --num-shards N] [--checkpoint PATH]
+    python -m app.cli serve-shards [--num-shards N] [--port P] [--worker-port P]
+"""
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import time
+
+from .core.config import settings
+from .models.db import SessionLocal
+from .services.recommender_logic import Recommender
+from .services.item_similarity import ItemSimilarityIndex
+from .services.als import ALSModel
+from .services.ann import RandomProjectionLSH
+from .services.artifacts import ModelArtifactStore
+from .services.model_store import ModelStore, SHARDABLE_MODES
+from .services.precompute import precompute_recommendations
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def build_item_index(args: argparse.Namespace) -> int:
+    start_time = time.time()
+    db = SessionLocal()
+    try:
+        interaction_matrix, _, all_product_ids = Recommender(db).get_interaction_matrix_and_mappings()
+    finally:
+        db.close()
+
+    if len(all_product_ids) == 0:
+        logger.warning("No interaction data found. Item index not built.")
+        return 1
+
+    item_index = ItemSimilarityIndex.build(interaction_matrix, all_product_ids, num_neighbours=args.neighbours)
+    item_index.save(args.output)
+    logger.info(f"build-item-index finished in {time.time() - start_time:.2f} seconds.")
+    return 0
+
+
+def train_als(args: argparse.Namespace) -> int:
+    start_time = time.time()
+    db = SessionLocal()
+    try:
+        interaction_matrix, all_user_ids, all_product_ids = Recommender(db).get_interaction_matrix_and_mappings()
+    finally:
+        db.close()
+
+    if len(all_user_ids) == 0:
+        logger.warning("No interaction data found. ALS model not trained.")
+        return 1
+
+    als_model = ALSModel.train(interaction_matrix, all_user_ids, all_product_ids, factors=args.factors,
+                               regularization=args.regularization, alpha=args.alpha,
+                               iterations=args.iterations, num_threads=args.threads)
+    als_model.save(args.output)
+    logger.info(f"train-als finished in {time.time() - start_time:.2f} seconds.")
+    return 0
+
+
+def export_model(args: argparse.Namespace) -> int:
+    start_time = time.time()
+    db = SessionLocal()
+    try:
+        snapshot = Recommender(db).build_snapshot()
+    finally:
+        db.close()
+
+    if snapshot.is_empty:
+        logger.warning("No interaction data found. Model artifact not exported.")
+        return 1
+
+    item_index = None
+    if args.with_item_index:
+        item_index = ItemSimilarityIndex.build(snapshot.interaction_matrix, snapshot.all_product_ids,
+                                               num_neighbours=settings.ITEM_NEIGHBOURS)
+    als_model = None
+    if args.with_als:
+        als_model = ALSModel.train(snapshot.interaction_matrix, snapshot.all_user_ids, snapshot.all_product_ids,
+                                   factors=settings.ALS_FACTORS, regularization=settings.ALS_REGULARIZATION,
+                                   alpha=settings.ALS_ALPHA, iterations=settings.ALS_ITERATIONS,
+                                   num_threads=settings.ALS_TRAINING_THREADS)
+    if args.with_user_ann:
+        # 快照尚未發佈，直接掛上索引，與快照一起寫入同一個版本
+        snapshot.user_ann_index = RandomProjectionLSH.build(snapshot.normalized_matrix,
+                                                            num_tables=settings.ANN_NUM_TABLES,
+                                                            num_bits=settings.ANN_NUM_BITS)
+
+    artifact_store = ModelArtifactStore(args.root, keep_versions=args.keep)
+    name = artifact_store.publish(snapshot, item_index=item_index, als_model=als_model)
+    logger.info(f"export-model published {name} in {time.time() - start_time:.2f} seconds.")
+    return 0
+
+
+def precompute(args: argparse.Namespace) -> int:
+    if not 0 <= args.shard < args.num_shards:
+        logger.error("--shard must be between 0 and --num-shards - 1.")
+        return 2
+
+    artifact_store = None
+    if settings.MODEL_ARTIFACT_DIR:
+        artifact_store = ModelArtifactStore(settings.MODEL_ARTIFACT_DIR, keep_versions=settings.MODEL_ARTIFACT_KEEP_VERSIONS)
+    # 與線上服務使用相同的模型來源：有已發佈的模型檔時直接載入，否則由資料庫建立
+    # 批次工作以 --shard / --num-shards 自行切分，模型本身保留所有用戶
+    model_store = ModelStore(refresh_interval_seconds=0, incremental_interval_seconds=0, artifact_store=artifact_store,
+                             num_shards=1)
+    if model_store.get_snapshot().is_empty:
+        logger.warning("No interaction data found. Nothing to precompute.")
+        return 1
+
+    precompute_recommendations(
+        model_store,
+        num_recommendations=args.num_recommendations,
+        block_size=args.block_size,
+        num_workers=args.workers,
+        shard=args.shard,
+        num_shards=args.num_shards,
+        ttl_seconds=args.ttl,
+        checkpoint_path=args.checkpoint,
+    )
+    return 0
+
+
+def _uvicorn_command(host: str, port: int):
+    return [sys.executable, "-m", "uvicorn", "app.main:app", "--host", host, "--port", str(port)]
+
+
+def serve_shards(args: argparse.Namespace) -> int:
+    """
+    在本機啟動 num_shards 個 scoring worker（連續埠號）與一個路由前端，方便開發時驗證分片部署。
+    正式環境中各分片通常是獨立的容器，路由前端只需要以 SHARD_URLS 指向它們。
+    """
+    if args.num_shards < 1:
+        logger.error("--num-shards must be at least 1.")
+        return 2
+    if args.num_shards > 1 and settings.RECOMMENDER_MODE not in SHARDABLE_MODES:
+        logger.error(f"RECOMMENDER_MODE={settings.RECOMMENDER_MODE} cannot be sharded (the default user_based mode "
+                     f"never can); set it to one of {', '.join(SHARDABLE_MODES)}.")
+        return 2
+
+    shard_urls = []
+    processes = []
+    for shard in range(args.num_shards):
+        port = args.worker_port + shard
+        shard_urls.append(f"http://{args.host}:{port}")
+        env = {**os.environ, "NUM_SHARDS": str(args.num_shards), "SHARD_INDEX": str(shard), "SHARD_URLS": ""}
+        processes.append(subprocess.Popen(_uvicorn_command(args.host, port), env=env))
+    router_env = {**os.environ, "SHARD_URLS": ",".join(shard_urls)}
+    processes.append(subprocess.Popen(_uvicorn_command(args.host, args.port), env=router_env))
+    logger.info(f"Router on port {args.port} forwarding to {', '.join(shard_urls)}.")
+
+    try:
+        # 任一進程結束時停止全部，避免路由前端轉發到不存在的分片
+        while all(process.poll() is None for process in processes):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+        for process in processes:
+            process.wait(timeout=10)
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="Recommender service batch jobs.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    item_index_parser = subparsers.add_parser("build-item-index", help="Precompute the item-item neighbour table.")
+    item_index_parser.add_argument("--output", default=settings.ITEM_INDEX_DIR)
+    item_index_parser.add_argument("--neighbours", type=int, default=settings.ITEM_NEIGHBOURS)
+    item_index_parser.set_defaults(func=build_item_index)
+
+    als_parser = subparsers.add_parser("train-als", help="Train the implicit-feedback ALS matrix factorization model.")
+    als_parser.add_argument("--output", default=settings.ALS_MODEL_DIR)
+    als_parser.add_argument("--factors", type=int, default=settings.ALS_FACTORS)
+    als_parser.add_argument("--regularization", type=float, default=settings.ALS_REGULARIZATION)
+    als_parser.add_argument("--alpha", type=float, default=settings.ALS_ALPHA)
+    als_parser.add_argument("--iterations", type=int, default=settings.ALS_ITERATIONS)
+    als_parser.add_argument("--threads", type=int, default=settings.ALS_TRAINING_THREADS)
+    als_parser.set_defaults(func=train_als)
+
+    export_parser = subparsers.add_parser("export-model", help="Publish a versioned, memory-mappable model artifact.")
+    export_parser.add_argument("--root", default=settings.MODEL_ARTIFACT_DIR)
+    export_parser.add_argument("--keep", type=int, default=settings.MODEL_ARTIFACT_KEEP_VERSIONS)
+    export_parser.add_argument("--with-item-index", action="store_true")
+    export_parser.add_argument("--with-als", action="store_true")
+    export_parser.add_argument("--with-user-ann", action="store_true",
+                               help="Also publish the user LSH index used by user_based mode with ANN_ENABLED.")
+    export_parser.set_defaults(func=export_model)
+
+    precompute_parser = subparsers.add_parser("precompute", help="Score all active users and cache the results in Redis.")
+    precompute_parser.add_argument("--num-recommendations", type=int, default=5)
+    precompute_parser.add_argument("--block-size", type=int, default=settings.PRECOMPUTE_BLOCK_SIZE)
+    precompute_parser.add_argument("--workers", type=int, default=settings.PRECOMPUTE_WORKERS)
+    precompute_parser.add_argument("--shard", type=int, default=0,
+                                   help="Only precompute users that the serving router sends to this shard.")
+    precompute_parser.add_argument("--num-shards", type=int, default=1)
+    precompute_parser.add_argument("--ttl", type=int, default=settings.PRECOMPUTE_CACHE_TTL_SECONDS)
+    precompute_parser.add_argument("--checkpoint", default=None,
+                                   help="Progress file; rerunning with the same file resumes after a crash.")
+    precompute_parser.set_defaults(func=precompute)
+
+    serve_parser = subparsers.add_parser("serve-shards", help="Run user-sharded scoring workers behind a local router.")
+    serve_parser.add_argument("--num-shards", type=int, default=2)
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8000)
+    serve_parser.add_argument("--worker-port", type=int, default=8101)
+    serve_parser.set_defaults(func=serve_shards)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
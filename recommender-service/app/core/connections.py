@@ -0,0 +1,51 @@
+"""
+資料庫與 Redis 連線池的共用設定，數值皆來自 Settings。
+"""
+from typing import Any, Dict
+from redis.backoff import ExponentialBackoff
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
+from redis.retry import Retry
+from redis.asyncio.retry import Retry as AsyncRetry
+
+from .config import settings
+
+
+def sql_engine_options(database_url: str) -> Dict[str, Any]:
+    """create_engine / create_async_engine 的連線池參數。"""
+    options: Dict[str, Any] = {
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+        "pool_recycle": settings.DB_POOL_RECYCLE_SECONDS,
+    }
+    # SQLite 使用單一檔案或記憶體連線，預設的連線池不接受大小設定
+    if not database_url.startswith("sqlite"):
+        options.update(
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT_SECONDS,
+        )
+    return options
+
+
+def redis_pool_options(asynchronous: bool = False) -> Dict[str, Any]:
+    """
+    redis / redis.asyncio BlockingConnectionPool 的參數。
+
+    連線錯誤與逾時會以指數退避重試；連線池在取用時才建立新連線，
+    因此 Redis 短暫中斷後下一次指令即會重新連線，不需重啟進程。
+    """
+    retry_class = AsyncRetry if asynchronous else Retry
+    return {
+        "host": settings.REDIS_HOST,
+        "port": settings.REDIS_PORT,
+        "db": settings.REDIS_DB,
+        # 推薦快取的值為二進位格式（RankedList），不可解碼為字串
+        "decode_responses": False,
+        "max_connections": settings.REDIS_MAX_CONNECTIONS,
+        "timeout": settings.REDIS_POOL_TIMEOUT_SECONDS,
+        "socket_connect_timeout": settings.REDIS_CONNECT_TIMEOUT_SECONDS,
+        "socket_timeout": settings.REDIS_SOCKET_TIMEOUT_SECONDS,
+        "socket_keepalive": True,
+        "retry": retry_class(ExponentialBackoff(cap=1.0, base=0.05), settings.REDIS_RETRY_ATTEMPTS),
+        "retry_on_error": [RedisConnectionError, RedisTimeoutError],
+        "health_check_interval": settings.REDIS_HEALTH_CHECK_INTERVAL_SECONDS,
+    }
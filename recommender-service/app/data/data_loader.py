@@ -1,19 +1,146 @@
 from sqlalchemy.orm import Session
-from ..models.order import OrderItem
+from ..models.order import Order, OrderItem
 from ..models.interaction import UserInteraction
 from ..models.user import User
 from ..models.product import Product
 import pandas as pd
 import numpy as np
-from typing import Tuple, List
-from sqlalchemy import func
+from datetime import timedelta
+from typing import Tuple, List, Iterator, NamedTuple, Optional, Sequence
+from sqlalchemy import case, func, literal, or_, select, union_all
+from ..core.config import settings
+from ..services.sharding import shard_of_users
 import logging
 
 logger = logging.getLogger(__name__)
 
+# 互動類型對應的分數；未列出的類型（例如 view）以 DEFAULT_INTERACTION_SCORE 計
+INTERACTION_SCORES = {
+    'favorite': 4,
+    'add_to_cart': 3,
+    'click': 2,
+    'purchase': 5,
+}
+DEFAULT_INTERACTION_SCORE = 1
+PURCHASE_SCORE = 5
+
+InteractionTriples = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+class InteractionWatermark(NamedTuple):
+    """已載入資料的高水位：order_items 與 user_interactions 已處理到的最大 id。"""
+    order_item_id: int = 0
+    interaction_id: int = 0
+
+    def rewind(self, rows: int) -> "InteractionWatermark":
+        """往回退 rows 個 id 的水位，用於重讀可能較晚才提交的資料。"""
+        return InteractionWatermark(max(self.order_item_id - rows, 0), max(self.interaction_id - rows, 0))
+
+
+def _empty_triples() -> InteractionTriples:
+    return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+
+def _id_range(column, low: Optional[int], high: Optional[int]) -> list:
+    conditions = []
+    if low is not None:
+        conditions.append(column > low)
+    if high is not None:
+        conditions.append(column <= high)
+    return conditions
+
+
+def _max_reduce(user_ids: np.ndarray, product_ids: np.ndarray,
+                values: np.ndarray) -> InteractionTriples:
+    """對相同 (user_id, product_id) 取最大值，回傳依 (user_id, product_id) 排序的三個陣列。"""
+    if user_ids.size == 0:
+        return user_ids, product_ids, values
+    order = np.lexsort((-values, product_ids, user_ids))
+    user_ids, product_ids, values = user_ids[order], product_ids[order], values[order]
+    first = np.empty(user_ids.size, dtype=bool)
+    first[0] = True
+    np.not_equal(user_ids[1:], user_ids[:-1], out=first[1:])
+    first[1:] |= product_ids[1:] != product_ids[:-1]
+    return user_ids[first], product_ids[first], values[first]
+
+
+class _RunningMaxReducer:
+    """
+    逐批累加 (user_id, product_id, value) 並對相同 (user_id, product_id) 取最大值。
+    新批次先各自去重後暫存，暫存量超過已合併的資料量時才整體合併一次（攤銷後近似線性），
+    因此記憶體只與不重複的 (user, product) 數量成正比，與原始資料列數無關。
+    兩個 ID 欄位各自以 int64 保存，不壓成單一 key，完整支援 BIGINT 的 ID。
+    """
+
+    def __init__(self):
+        self._merged = _empty_triples()
+        self._pending: List[InteractionTriples] = []
+        self._pending_size = 0
+
+    def add(self, user_ids: Sequence, product_ids: Sequence, values: np.ndarray) -> None:
+        reduced = _max_reduce(np.asarray(user_ids, dtype=np.int64), np.asarray(product_ids, dtype=np.int64),
+                              np.asarray(values, dtype=np.float32))
+        self._pending.append(reduced)
+        self._pending_size += reduced[0].size
+        if self._pending_size > max(self._merged[0].size, settings.LOADER_CHUNK_SIZE):
+            self._merge()
+
+    def _merge(self) -> None:
+        if not self._pending:
+            return
+        parts = [self._merged] + self._pending
+        self._merged = _max_reduce(*(np.concatenate(columns) for columns in zip(*parts)))
+        self._pending, self._pending_size = [], 0
+
+    def result(self) -> InteractionTriples:
+        self._merge()
+        return self._merged
+
 class DataLoader:
-    def __init__(self, db: Session):
+    """
+    互動資料載入。half_life_days > 0 時依互動時間做指數衰減（half_life_days 天前的互動分數為一半），
+    max_age_days > 0 時早於期限的互動直接在查詢中排除，不會被讀取。
+    年齡以整天計算（相對於 now 的日期），同一天內的完整重建與增量更新得到相同的分數；
+    沒有時間的互動視為當天。
+    num_shards > 1 時只保留雜湊到第 shard_index 個分片的用戶：每批資料先過濾再合併，
+    分片的峰值記憶體只與本分片的 (user, product) 數量有關。
+    """
+
+    def __init__(self, db: Session, half_life_days: Optional[float] = None, max_age_days: Optional[int] = None,
+                 now: Optional[pd.Timestamp] = None, num_shards: int = 1, shard_index: int = 0):
         self.db = db
+        self.num_shards = num_shards
+        self.shard_index = shard_index
+        self.half_life_days = settings.INTERACTION_HALF_LIFE_DAYS if half_life_days is None else half_life_days
+        self.max_age_days = settings.INTERACTION_MAX_AGE_DAYS if max_age_days is None else max_age_days
+        self.today = (now if now is not None else pd.Timestamp.now()).normalize()
+
+    @property
+    def decays(self) -> bool:
+        return self.half_life_days > 0
+
+    def _recent(self, column) -> list:
+        """早於 max_age_days 的互動不載入；沒有時間的互動保留。"""
+        if self.max_age_days <= 0:
+            return []
+        cutoff = (self.today - timedelta(days=self.max_age_days)).to_pydatetime()
+        return [or_(column.is_(None), column >= cutoff)]
+
+    def _owned(self, user_ids: Sequence, product_ids: Sequence, values: Sequence) -> InteractionTriples:
+        """轉成 int64 / float32 陣列，分片時只保留本分片用戶的資料列。"""
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float32)
+        if self.num_shards <= 1:
+            return user_ids, product_ids, values
+        owned = shard_of_users(user_ids, self.num_shards) == self.shard_index
+        return user_ids[owned], product_ids[owned], values[owned]
+
+    def _decay(self, timestamps: Sequence) -> np.ndarray:
+        """向量化計算一批互動時間的衰減係數 0.5 ** (年齡天數 / half_life_days)。"""
+        days = pd.to_datetime(pd.Series(timestamps), errors='coerce').dt.normalize()
+        age_days = (self.today - days).dt.days.fillna(0).clip(lower=0).to_numpy(dtype=np.float64)
+        return np.power(0.5, age_days / self.half_life_days).astype(np.float32)
 
     def load_interaction_data(self) -> Tuple[pd.DataFrame, dict, dict]:
         """
@@ -21,18 +148,26 @@ class DataLoader:
         同時返回 ID 到索引的映射，便於矩陣操作。
         """
         try:
-            order_items_data = self.db.query(OrderItem.user_id, OrderItem.product_id).all()
-            user_interactions_data = self.db.query(UserInteraction.user_id, UserInteraction.product_id, UserInteraction.interaction_type).all()
+            # order_items 本身沒有 user_id，需經由 orders 取得下單用戶
+            order_items_data = self.db.query(Order.user_id, OrderItem.product_id, OrderItem.created_at) \
+                                      .join(Order, OrderItem.order_id == Order.id) \
+                                      .filter(*self._recent(OrderItem.created_at)) \
+                                      .all()
+            user_interactions_data = self.db.query(UserInteraction.user_id, UserInteraction.product_id, UserInteraction.interaction_type,
+                                                   UserInteraction.timestamp) \
+                                            .filter(*self._recent(UserInteraction.timestamp)) \
+                                            .all()
         except Exception as e:
             logger.error(f"Error loading interaction data from DB: {e}")
             return pd.DataFrame(columns=['user_id', 'product_id', 'value']), {}, {}
 
 
         all_interactions = []
-        for user_id, product_id in order_items_data:
-            all_interactions.append({'user_id': user_id, 'product_id': product_id, 'interaction_type': 'purchase', 'value': 5})
+        for user_id, product_id, created_at in order_items_data:
+            all_interactions.append({'user_id': user_id, 'product_id': product_id, 'interaction_type': 'purchase', 'value': 5,
+                                     'timestamp': created_at})
 
-        for user_id, product_id, interaction_type in user_interactions_data:
+        for user_id, product_id, interaction_type, timestamp in user_interactions_data:
             score = 1
             if interaction_type == 'favorite':
                 score = 4
@@ -42,13 +177,16 @@ class DataLoader:
                 score = 2
             elif interaction_type == 'purchase': # 如果同時有購買和 view 這種，以最高分算
                 score = 5
-            all_interactions.append({'user_id': user_id, 'product_id': product_id, 'interaction_type': interaction_type, 'value': score})
+            all_interactions.append({'user_id': user_id, 'product_id': product_id, 'interaction_type': interaction_type, 'value': score,
+                                     'timestamp': timestamp})
 
         if not all_interactions:
             logger.info("No interaction data found in database.")
             return pd.DataFrame(columns=['user_id', 'product_id', 'value']), {}, {}
 
         df = pd.DataFrame(all_interactions)
+        if self.decays:
+            df['value'] = df['value'] * self._decay(df['timestamp'])
         # 對相同的 user_id, product_id，取最高的互動分數
         df = df.groupby(['user_id', 'product_id'])['value'].max().reset_index()
 
@@ -61,6 +199,152 @@ class DataLoader:
         logger.info(f"Loaded {len(df)} unique interactions for {len(unique_users)} users and {len(unique_products)} products.")
         return df, user_to_idx, product_to_idx
 
+    def get_watermark(self) -> InteractionWatermark:
+        """讀取兩張互動來源表目前的最大 id，作為本次載入的上界與下次增量更新的起點。"""
+        order_item_id = self.db.execute(select(func.max(OrderItem.id))).scalar() or 0
+        interaction_id = self.db.execute(select(func.max(UserInteraction.id))).scalar() or 0
+        return InteractionWatermark(int(order_item_id), int(interaction_id))
+
+    def load_interaction_triples(self, since: Optional[InteractionWatermark] = None,
+                                 until: Optional[InteractionWatermark] = None) -> InteractionTriples:
+        """
+        依 INTERACTION_LOADER 設定載入去重後的 (user_ids, product_ids, values) 陣列，
+        每個 (user, product) 只保留最高的互動分數。
+        指定 since 時只載入 id 大於水位的新資料（增量更新），此時錯誤會往上拋出，避免水位被錯誤推進。
+        """
+        if since is not None:
+            if settings.INTERACTION_LOADER == "sql":
+                return self.load_interaction_data_aggregated(since=since, until=until)
+            return self.load_interaction_data_streaming(since=since, until=until)
+
+        try:
+            if settings.INTERACTION_LOADER == "sql":
+                return self.load_interaction_data_aggregated(until=until)
+            if settings.INTERACTION_LOADER == "orm":
+                df, _, _ = self.load_interaction_data()
+                return self._owned(df['user_id'].to_numpy(dtype=np.int64),
+                                   df['product_id'].to_numpy(dtype=np.int64),
+                                   df['value'].to_numpy(dtype=np.float32))
+            return self.load_interaction_data_streaming(until=until)
+        except Exception as e:
+            logger.error(f"Error streaming interaction data from DB: {e}")
+            return _empty_triples()
+
+    def load_interaction_data_streaming(self, chunk_size: int = None,
+                                        since: Optional[InteractionWatermark] = None,
+                                        until: Optional[InteractionWatermark] = None) -> InteractionTriples:
+        """
+        以伺服器端 cursor 分批讀取互動資料（yield_per / stream_results），
+        每批以向量化方式換算分數（含時間衰減）後，直接合併進以整數編碼的 COO 陣列並持續取最大值。
+        峰值記憶體與資料表大小無關，只與不重複的 (user, product) 數量有關。
+        since / until 以 id 限定讀取範圍 (since, until]。
+        """
+        chunk_size = chunk_size or settings.LOADER_CHUNK_SIZE
+        reducer = _RunningMaxReducer()
+        num_rows = 0
+
+        # 不衰減時只讀取 ID 欄位，時間欄位固定為 NULL
+        order_items_query = select(Order.user_id, OrderItem.product_id,
+                                   OrderItem.created_at if self.decays else literal(None)) \
+            .join(Order, OrderItem.order_id == Order.id) \
+            .where(Order.user_id.isnot(None), OrderItem.product_id.isnot(None),
+                   *_id_range(OrderItem.id, since and since.order_item_id, until and until.order_item_id),
+                   *self._recent(OrderItem.created_at))
+        for rows in self._iter_chunks(order_items_query, chunk_size):
+            user_ids, product_ids, timestamps = zip(*rows)
+            values = np.full(len(rows), PURCHASE_SCORE, dtype=np.float32)
+            if self.decays:
+                values *= self._decay(timestamps)
+            reducer.add(*self._owned(user_ids, product_ids, values))
+            num_rows += len(rows)
+
+        interactions_query = select(UserInteraction.user_id, UserInteraction.product_id, UserInteraction.interaction_type,
+                                    UserInteraction.timestamp if self.decays else literal(None)) \
+            .where(UserInteraction.user_id.isnot(None), UserInteraction.product_id.isnot(None),
+                   *_id_range(UserInteraction.id, since and since.interaction_id, until and until.interaction_id),
+                   *self._recent(UserInteraction.timestamp))
+        for rows in self._iter_chunks(interactions_query, chunk_size):
+            user_ids, product_ids, interaction_types, timestamps = zip(*rows)
+            values = pd.Series(interaction_types).map(INTERACTION_SCORES) \
+                .fillna(DEFAULT_INTERACTION_SCORE).to_numpy(dtype=np.float32)
+            if self.decays:
+                values *= self._decay(timestamps)
+            reducer.add(*self._owned(user_ids, product_ids, values))
+            num_rows += len(rows)
+
+        user_ids, product_ids, values = reducer.result()
+        logger.info(f"Streamed {num_rows} interaction rows into {user_ids.size} unique (user, product) pairs.")
+        return user_ids, product_ids, values
+
+    def load_interaction_data_aggregated(self, chunk_size: int = None,
+                                         since: Optional[InteractionWatermark] = None,
+                                         until: Optional[InteractionWatermark] = None) -> InteractionTriples:
+        """
+        將分數換算與取最大值交給資料庫：以 CASE 換算 user_interactions 的分數，
+        與 order_items（購買）UNION ALL 後依 (user_id, product_id) GROUP BY 取 MAX，
+        服務端只接收去重後的資料列，結果依 (user_id, product_id) 排序。
+        有時間衰減時改依 (user_id, product_id, 分數) 取最近一次的時間：同一分數以最近的互動衰減最少，
+        服務端衰減後再取最大值，結果與逐列衰減相同，每個 (user, product) 最多只多出幾種分數的資料列。
+        since / until 以 id 限定讀取範圍 (since, until]。
+        """
+        chunk_size = chunk_size or settings.LOADER_CHUNK_SIZE
+
+        purchases = select(Order.user_id.label('user_id'), OrderItem.product_id.label('product_id'),
+                           literal(PURCHASE_SCORE).label('value'), OrderItem.created_at.label('timestamp')) \
+            .join(Order, OrderItem.order_id == Order.id) \
+            .where(Order.user_id.isnot(None), OrderItem.product_id.isnot(None),
+                   *_id_range(OrderItem.id, since and since.order_item_id, until and until.order_item_id),
+                   *self._recent(OrderItem.created_at))
+        interactions = select(UserInteraction.user_id.label('user_id'), UserInteraction.product_id.label('product_id'),
+                              case(INTERACTION_SCORES, value=UserInteraction.interaction_type,
+                                   else_=DEFAULT_INTERACTION_SCORE).label('value'),
+                              UserInteraction.timestamp.label('timestamp')) \
+            .where(UserInteraction.user_id.isnot(None), UserInteraction.product_id.isnot(None),
+                   *_id_range(UserInteraction.id, since and since.interaction_id, until and until.interaction_id),
+                   *self._recent(UserInteraction.timestamp))
+        scored = union_all(purchases, interactions).subquery()
+        if self.decays:
+            return self._load_decayed_aggregates(scored, chunk_size)
+
+        statement = select(scored.c.user_id, scored.c.product_id, func.max(scored.c.value)) \
+            .group_by(scored.c.user_id, scored.c.product_id) \
+            .order_by(scored.c.user_id, scored.c.product_id)
+
+        # ID 欄位各自轉成 int64，不經過 float64，避免超過 2^53 的 BIGINT ID 失真
+        chunks = [self._owned(user_ids, product_ids, values)
+                  for user_ids, product_ids, values in (zip(*rows) for rows in self._iter_chunks(statement, chunk_size))]
+        if not chunks:
+            logger.info("No interaction data found in database.")
+            return _empty_triples()
+
+        user_ids, product_ids, values = (np.concatenate(columns) for columns in zip(*chunks))
+        logger.info(f"Loaded {user_ids.size} pre-aggregated (user, product) pairs.")
+        return user_ids, product_ids, values
+
+    def _load_decayed_aggregates(self, scored, chunk_size: int) -> InteractionTriples:
+        # MAX 會略過 NULL；其他載入方式將沒有時間的互動視為當天（不衰減），先以今天補上再取最近的時間
+        latest = func.max(func.coalesce(scored.c.timestamp, self.today.to_pydatetime()))
+        statement = select(scored.c.user_id, scored.c.product_id, scored.c.value, latest) \
+            .group_by(scored.c.user_id, scored.c.product_id, scored.c.value)
+
+        reducer = _RunningMaxReducer()
+        num_rows = 0
+        for rows in self._iter_chunks(statement, chunk_size):
+            user_ids, product_ids, values, timestamps = zip(*rows)
+            values = np.asarray(values, dtype=np.float32) * self._decay(timestamps)
+            reducer.add(*self._owned(user_ids, product_ids, values))
+            num_rows += len(rows)
+
+        user_ids, product_ids, values = reducer.result()
+        logger.info(f"Loaded {num_rows} pre-aggregated (user, product, score) rows into {user_ids.size} unique pairs.")
+        return user_ids, product_ids, values
+
+    def _iter_chunks(self, statement, chunk_size: int) -> Iterator[list]:
+        result = self.db.execute(statement.execution_options(yield_per=chunk_size))
+        for partition in result.partitions():
+            if partition:
+                yield partition
+
     def get_all_products(self) -> List[Product]:
         try:
             return self.db.query(Product).all()
@@ -1,9 +1,21 @@
-from redis import Redis
+from redis import Redis, BlockingConnectionPool
+from redis.asyncio import Redis as AsyncRedis, BlockingConnectionPool as AsyncBlockingConnectionPool
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
 import logging
 
 from .core.config import settings
-from .models.db import SessionLocal
+from .core.connections import redis_pool_options
+from .models.db import SessionLocal, AsyncSessionLocal
+from .services.model_store import ModelStore
+from .services.artifacts import ModelArtifactStore
+from .services.singleflight import SingleFlight
+from .services.recommendation_cache import LocalTTLCache, RecommendationCache
+from .services.recalculation_queue import RecalculationQueue
+from .services.profiler import SlowRequestProfiler
+from .services.health import HealthMonitor, database_check, redis_check
+from .services.sharding import ShardRouter, shard_urls, shard_health_check
 
 logger = logging.getLogger(__name__)
 
@@ -14,21 +26,127 @@ def get_db():
     finally:
         db.close()
 
-_redis_client: Redis = None
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+_redis_pool: BlockingConnectionPool = None
 
 def get_redis_client() -> Redis:
-    global _redis_client
-    if _redis_client is None:
-        try:
-            _redis_client = Redis(
-                host=settings.REDIS_HOST,
-                port=settings.REDIS_PORT,
-                db=settings.REDIS_DB,
-                decode_responses=True
-            )
-            _redis_client.ping()
-            logger.info("Successfully connected to Redis via dependency.")
-        except Exception as e:
-            logger.error(f"Could not connect to Redis via dependency: {e}")
-            _redis_client = None
-    return _redis_client
+    """
+    背景工作（快取失效等）使用的同步 client，共用同一個連線池。
+    建立時不連線，Redis 暫時無法連線時由各呼叫端的錯誤處理略過，恢復後下一次指令即重新連線。
+    """
+    global _redis_pool
+    if _redis_pool is None:
+        _redis_pool = BlockingConnectionPool(**redis_pool_options())
+    return Redis(connection_pool=_redis_pool)
+
+_async_redis_pool: AsyncBlockingConnectionPool = None
+
+def get_async_redis_client() -> AsyncRedis:
+    """請求路徑使用的 redis.asyncio client，所有請求共用同一個連線池。"""
+    global _async_redis_pool
+    if _async_redis_pool is None:
+        _async_redis_pool = AsyncBlockingConnectionPool(**redis_pool_options(asynchronous=True))
+    return AsyncRedis(connection_pool=_async_redis_pool)
+
+_model_store: ModelStore = None
+
+def get_model_store() -> ModelStore:
+    global _model_store
+    if _model_store is None:
+        artifact_store = None
+        if settings.MODEL_ARTIFACT_DIR:
+            artifact_store = ModelArtifactStore(settings.MODEL_ARTIFACT_DIR,
+                                                keep_versions=settings.MODEL_ARTIFACT_KEEP_VERSIONS)
+        _model_store = ModelStore(artifact_store=artifact_store)
+    return _model_store
+
+_single_flight: SingleFlight = None
+
+def get_single_flight() -> SingleFlight:
+    global _single_flight
+    if _single_flight is None:
+        _single_flight = SingleFlight(
+            lock_ttl_ms=settings.SINGLE_FLIGHT_LOCK_TTL_MS,
+            wait_timeout_seconds=settings.SINGLE_FLIGHT_WAIT_TIMEOUT_SECONDS,
+            poll_interval_seconds=settings.SINGLE_FLIGHT_POLL_INTERVAL_SECONDS
+        )
+    return _single_flight
+
+_recommendation_cache: RecommendationCache = None
+
+def get_recommendation_cache() -> RecommendationCache:
+    global _recommendation_cache
+    if _recommendation_cache is None:
+        _recommendation_cache = RecommendationCache(
+            LocalTTLCache(
+                max_entries=settings.LOCAL_CACHE_MAX_ENTRIES,
+                ttl_seconds=settings.LOCAL_CACHE_TTL_SECONDS,
+                stale_ttl_seconds=settings.LOCAL_CACHE_STALE_SECONDS
+            ),
+            ttl_seconds=settings.RECOMMENDATION_CACHE_TTL_SECONDS
+        )
+    return _recommendation_cache
+
+_recalculation_queue: RecalculationQueue = None
+
+def get_recalculation_queue() -> RecalculationQueue:
+    global _recalculation_queue
+    if _recalculation_queue is None:
+        _recalculation_queue = RecalculationQueue(
+            batch_size=settings.RECALC_BATCH_SIZE,
+            batch_window_seconds=settings.RECALC_BATCH_WINDOW_SECONDS,
+            num_workers=settings.RECALC_WORKERS,
+            max_pending=settings.RECALC_MAX_PENDING
+        )
+    return _recalculation_queue
+
+_slow_request_profiler: SlowRequestProfiler = None
+
+def get_slow_request_profiler() -> Optional[SlowRequestProfiler]:
+    """PROFILE_SLOW_REQUEST_MS 為 0 時停用，回傳 None。"""
+    global _slow_request_profiler
+    if _slow_request_profiler is None and settings.PROFILE_SLOW_REQUEST_MS > 0:
+        _slow_request_profiler = SlowRequestProfiler(
+            threshold_seconds=settings.PROFILE_SLOW_REQUEST_MS / 1000,
+            interval_seconds=settings.PROFILE_SAMPLE_INTERVAL_MS / 1000
+        )
+    return _slow_request_profiler
+
+_shard_router: ShardRouter = None
+
+def get_shard_router() -> ShardRouter:
+    """路由前端轉發到各分片所用的 HTTP client，所有請求共用同一個連線池。"""
+    global _shard_router
+    if _shard_router is None:
+        _shard_router = ShardRouter(
+            shard_urls(),
+            timeout_seconds=settings.SHARD_REQUEST_TIMEOUT_SECONDS,
+            max_connections=settings.SHARD_MAX_CONNECTIONS
+        )
+    return _shard_router
+
+_health_monitor: HealthMonitor = None
+
+def get_health_monitor() -> HealthMonitor:
+    """scoring worker 檢查資料庫與 Redis；路由前端不直接連線資料庫，改為檢查各分片的 /health。"""
+    global _health_monitor
+    if _health_monitor is None:
+        if shard_urls():
+            shard_router = get_shard_router()
+            checks = {f"shard_{shard}": shard_health_check(shard_router, shard)
+                      for shard in range(shard_router.num_shards)}
+        else:
+            checks = {
+                "database": database_check(AsyncSessionLocal),
+                "redis": redis_check(get_async_redis_client),
+            }
+        _health_monitor = HealthMonitor(
+            checks=checks,
+            interval_seconds=settings.HEALTH_CHECK_INTERVAL_SECONDS,
+            timeout_seconds=settings.HEALTH_CHECK_TIMEOUT_SECONDS,
+            max_age_seconds=settings.HEALTH_CHECK_MAX_AGE_SECONDS
+        )
+    return _health_monitor
@@ -1,8 +1,21 @@
-from fastapi import FastAPI, HTTPException, status
+import asyncio
+import time
+from fastapi import FastAPI, HTTPException, Request, status, Depends
+from fastapi.responses import PlainTextResponse
 import logging
 from .api.v1.routes import router as v1_router
+from .api.v1.shard_routes import router as shard_router
 from .core.config import settings
-from .dependencies import get_db, get_redis_client
+from .dependencies import (get_redis_client, get_async_redis_client, get_model_store, get_recommendation_cache,
+                           get_recalculation_queue, get_single_flight, get_slow_request_profiler,
+                           get_health_monitor, get_shard_router)
+from .services.executor import shutdown_scoring_executor
+from .services.recommendation_cache import invalidate_cached_recommendations
+from .services.recalculation_queue import recalculate_recommendations
+from .services.metrics import REGISTRY, HTTP_REQUEST_DURATION
+from .services.health import HealthMonitor
+from .services.sharding import is_router
+from .models.db import engine, async_engine
 
 # 配置日誌
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -14,34 +27,163 @@ app = FastAPI(
     version=settings.PROJECT_VERSION
 )
 
-app.include_router(v1_router, prefix=settings.API_V1_STR)
+# 設定 SHARD_URLS 時本進程只是路由前端：依 user_id 轉發到持有該用戶的 scoring worker，不載入模型也不連線資料庫
+ROUTER_MODE = is_router()
+
+# 訂閱其他 worker 重算後發布的本地快取失效通知
+_invalidation_listener: asyncio.Task = None
+
+app.include_router(shard_router if ROUTER_MODE else v1_router, prefix=settings.API_V1_STR)
+
+def _route_template(request: Request) -> str:
+    route = request.scope.get("route")
+    # include_router(prefix=...) 的路由 route.path 已包含前綴（例如 /api/v1/recommendations/{user_id}），不需再補
+    return getattr(route, "path", None) or "unmatched"
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    # 以路由樣板（例如 /api/v1/recommendations/{user_id}）作為標籤，避免每個用戶 ID 各成一個時間序列
+    profiler = get_slow_request_profiler()
+    profile_started_at = profiler.start() if profiler is not None else None
+    start_time = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        route_path = _route_template(request)
+        HTTP_REQUEST_DURATION.observe(time.perf_counter() - start_time, method=request.method,
+                                      route=route_path, status=str(status_code))
+        if profiler is not None:
+            profiler.finish(profile_started_at, f"{request.method} {route_path}")
+
+def _register_state_gauges() -> None:
+    # 這些數值在抓取 /metrics 時才讀取，不需要在各處更新
+    model_store = get_model_store()
+    recalculation_queue = get_recalculation_queue()
+
+    def snapshot_attribute(name: str):
+        def read():
+            snapshot = model_store.snapshot
+            return getattr(snapshot, name) if snapshot is not None else None
+        return read
+
+    def popularity_age():
+        popularity = model_store.popularity
+        return popularity.age_seconds if popularity is not None else None
+
+    REGISTRY.gauge("recommender_model_snapshot_age_seconds", "Seconds since the serving model snapshot was built.",
+                   callback=snapshot_attribute("age_seconds"))
+    REGISTRY.gauge("recommender_model_snapshot_version", "Version of the serving model snapshot.",
+                   callback=snapshot_attribute("version"))
+    REGISTRY.gauge("recommender_popularity_age_seconds", "Seconds since the popularity ranking was built.",
+                   callback=popularity_age)
+    REGISTRY.gauge("recalculation_queue_depth", "Users waiting in the recalculation queue.",
+                   callback=lambda: recalculation_queue.stats()["depth"])
+    REGISTRY.gauge("recalculation_queue_oldest_pending_seconds", "Age of the oldest queued recalculation request.",
+                   callback=lambda: recalculation_queue.stats()["oldest_pending_seconds"])
+    REGISTRY.gauge("recommendation_local_cache_entries", "Entries in the in-process recommendation cache.",
+                   callback=lambda: len(get_recommendation_cache().local))
+    REGISTRY.gauge("single_flight_inflight", "Recommendation computations currently in flight in this worker.",
+                   callback=lambda: get_single_flight().inflight_count)
+
+    def pool_checked_out(pool_engine):
+        # SQLite 的 StaticPool / NullPool 沒有借出計數
+        checkedout = getattr(getattr(pool_engine, "pool", None), "checkedout", None)
+        return checkedout if checkedout is not None else lambda: None
+
+    REGISTRY.gauge("db_pool_checked_out", "Connections checked out of the background (sync) database pool.",
+                   callback=pool_checked_out(engine))
+    REGISTRY.gauge("db_async_pool_checked_out", "Connections checked out of the request-path (async) database pool.",
+                   callback=pool_checked_out(async_engine))
+
+@app.on_event("startup")
+async def start_model_refresher():
+    if ROUTER_MODE:
+        return
+    # 背景建立並定期更新共享模型快照，請求端只讀取最新版本
+    model_store = get_model_store()
+    # 增量更新後讓資料有變動的用戶的推薦快取（進程內與 Redis）失效
+    model_store.add_update_listener(get_recommendation_cache().invalidate_local)
+    model_store.add_update_listener(lambda user_ids: invalidate_cached_recommendations(get_redis_client(), user_ids))
+    model_store.start_background_refresh()
+
+@app.on_event("startup")
+async def register_metrics():
+    if not ROUTER_MODE:
+        _register_state_gauges()
+
+@app.on_event("startup")
+async def validate_shards():
+    if ROUTER_MODE:
+        # 分片設定與 SHARD_URLS 不一致時用戶會被轉發到錯誤的分片，直接中止啟動
+        await get_shard_router().validate_shards(timeout_seconds=settings.SHARD_VALIDATION_TIMEOUT_SECONDS)
+
+@app.on_event("startup")
+async def start_health_monitor():
+    get_health_monitor().start()
+
+@app.on_event("startup")
+async def start_recalculation_workers():
+    if ROUTER_MODE:
+        return
+    # 重算端點只排入佇列，由背景 worker 批次計分並寫回快取
+    get_recalculation_queue().start(lambda user_ids: recalculate_recommendations(
+        get_model_store(), get_async_redis_client(), get_recommendation_cache(), user_ids))
+
+@app.on_event("startup")
+async def start_local_cache_invalidation_listener():
+    global _invalidation_listener
+    if ROUTER_MODE:
+        return
+    # 其他 worker 重算用戶後，刪除本 worker 本地快取中的舊推薦
+    _invalidation_listener = asyncio.get_running_loop().create_task(
+        get_recommendation_cache().listen_for_invalidations(get_async_redis_client()))
+
+@app.on_event("shutdown")
+async def stop_model_refresher():
+    if ROUTER_MODE:
+        await get_health_monitor().stop()
+        await get_shard_router().close()
+        return
+    if _invalidation_listener is not None:
+        _invalidation_listener.cancel()
+    await get_recalculation_queue().stop()
+    await get_health_monitor().stop()
+    get_model_store().stop_background_refresh()
+    shutdown_scoring_executor()
+    profiler = get_slow_request_profiler()
+    if profiler is not None:
+        profiler.stop()
 
 @app.get("/")
 async def root():
     logger.info("Root endpoint accessed.") # 添加日誌
     return {"message": "Welcome to FastAPI Recommender Service!"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Prometheus 抓取端點：各階段耗時、快取命中率、備援次數、HTTP 延遲分布與模型 / 佇列狀態。
+    """
+    return PlainTextResponse(REGISTRY.render(), media_type=REGISTRY.CONTENT_TYPE)
+
 @app.get("/health")
-async def health_check():
+async def health_check(health_monitor: HealthMonitor = Depends(get_health_monitor)):
     """
-    健康檢查端點，檢查資料庫和 Redis 連接狀態。
+    健康檢查端點，回傳背景定期檢查的資料庫和 Redis 連接狀態，探測本身不會連線。
+    scoring worker 另外回報分片設定，供路由前端核對 SHARD_URLS。
     """
-    logger.info("Health check requested.") # 添加日誌
-    try:
-        with get_db() as db:
-            db.execute("SELECT 1")
-
-        redis_client_instance = get_redis_client()
-        if redis_client_instance:
-            redis_client_instance.ping()
-        else:
-            raise Exception("Redis client not initialized or connection failed.")
-
-        logger.info("Health check successful: Database and Redis connected.")
-        return {"status": "ok", "database": "connected", "redis": "connected"}
-    except Exception as e:
-        logger.error(f"Health check failed: {e}")
+    health = await health_monitor.status()
+    if health["status"] != "ok":
+        failures = ", ".join(f"{name} {result}" for name, result in health.items() if name != "status"
+                             and result != "connected")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Service unhealthy: {e}"
+            detail=f"Service unhealthy: {failures}"
         )
+    if not ROUTER_MODE:
+        model_store = get_model_store()
+        health = {**health, "num_shards": model_store.num_shards, "shard_index": model_store.shard_index}
+    return health
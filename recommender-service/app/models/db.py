@@ -1,23 +1,44 @@
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from ..core.config import settings
+from ..core.connections import sql_engine_options
 import logging
 
 logger = logging.getLogger(__name__)
 
+# 建立 engine 不會連線：匯入時不測試連線，資料庫狀態由 /health 的背景檢查回報，
+# 資料庫暫時無法連線也不影響進程啟動；連線池在借出連線前 ping，自動汰換已斷線的連線
 try:
-    engine = create_engine(settings.DATABASE_URL)
-    # 測試資料庫連接
-    with engine.connect() as connection:
-        connection.execute("SELECT 1")
-    logger.info("Database engine created and connected successfully.")
+    engine = create_engine(settings.DATABASE_URL, **sql_engine_options(settings.DATABASE_URL))
 except Exception as e:
-    logger.critical(f"Failed to create database engine or connect: {e}")
-    # 在實際應用中，這裡可能需要更優雅的處理，例如應用程式啟動失敗
+    engine = None
+    logger.critical(f"Failed to create database engine: {e}")
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# 請求路徑使用的非同步 engine，避免資料庫 I/O 阻塞 event loop；
+# 背景重建與批次工作仍使用上面的同步 engine
+ASYNC_DRIVERS = {
+    "mysql+pymysql": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+def get_async_database_url(database_url: str) -> str:
+    scheme, _, rest = database_url.partition("://")
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}://{rest}"
+
+try:
+    async_database_url = settings.ASYNC_DATABASE_URL or get_async_database_url(settings.DATABASE_URL)
+    async_engine = create_async_engine(async_database_url, **sql_engine_options(async_database_url))
+except Exception as e:
+    async_engine = None
+    logger.critical(f"Failed to create async database engine: {e}")
+
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 # Helper to create tables for testing/initial setup
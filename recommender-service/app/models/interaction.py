@@ -17,3 +17,6 @@ class UserInteraction(Base):
     timestamp = Column(DateTime, default=func.now()) # This will be automatically set by SQLAlchemy on insert
     # created_at and updated_at might also exist in the table if Laravel added them
     # but for FastAPI's read-only purpose, 'timestamp' might be the relevant one for interaction time.
+
+    user = relationship("User", back_populates="interactions")
+    product = relationship("Product", back_populates="user_interactions")
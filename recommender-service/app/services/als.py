@@ -0,0 +1,246 @@
+import os
+import json
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from scipy import sparse
+from typing import Dict, List, Optional, Tuple
+import logging
+
+from .id_encoder import IdArray, IdEncoder
+from .atomic_directory import atomic_directory, resolve
+from .scoring import top_k
+from .sharding import shard_of_users
+
+logger = logging.getLogger(__name__)
+
+# 每個求解區塊最多展開的 (互動筆數 × factors × factors) 元素數，控制訓練時的暫存記憶體
+_BLOCK_ELEMENT_BUDGET = 1 << 24
+
+
+def _solve_block(matrix: sparse.csr_matrix, fixed_factors: np.ndarray, gram: np.ndarray,
+                 regularization: float, alpha: float, row_start: int, row_end: int) -> np.ndarray:
+    """
+    求解 matrix[row_start:row_end] 每一列的最小平方解（implicit ALS）：
+        (YᵀY + Yᵤᵀ(Cᵤ - I)Yᵤ + λI) xᵤ = Yᵤᵀ Cᵤ pᵤ，其中 c = 1 + alpha × r、p = 1。
+    區塊內各列的 Yᵤᵀ(Cᵤ - I)Yᵤ 以一次 einsum 加 reduceat 求得，再以批次的 np.linalg.solve 求解。
+    """
+    num_factors = fixed_factors.shape[1]
+    block = matrix[row_start:row_end]
+    solutions = np.zeros((row_end - row_start, num_factors), dtype=np.float64)
+    row_lengths = np.diff(block.indptr)
+    rows = np.flatnonzero(row_lengths)
+    if rows.size == 0:
+        return solutions
+
+    confidence = alpha * block.data.astype(np.float64)
+    gathered = fixed_factors[block.indices]
+    outer = np.einsum('nf,ng->nfg', gathered * confidence[:, None], gathered)
+    lhs = np.add.reduceat(outer, block.indptr[rows], axis=0)
+    lhs += gram + regularization * np.eye(num_factors)
+    rhs = np.add.reduceat(gathered * (1.0 + confidence)[:, None], block.indptr[rows], axis=0)
+    solutions[rows] = np.linalg.solve(lhs, rhs[:, :, None])[:, :, 0]
+    return solutions
+
+
+def _solve_rows(matrix: sparse.csr_matrix, fixed_factors: np.ndarray, regularization: float,
+                alpha: float, executor: ThreadPoolExecutor) -> np.ndarray:
+    """固定另一側的因子，求解 matrix 每一列的因子；依互動筆數切成區塊後分給執行緒池平行計算。"""
+    fixed_factors = fixed_factors.astype(np.float64)
+    gram = fixed_factors.T @ fixed_factors
+    num_factors = fixed_factors.shape[1]
+    max_block_nnz = max(1, _BLOCK_ELEMENT_BUDGET // (num_factors * num_factors))
+
+    num_rows = matrix.shape[0]
+    split_points = np.searchsorted(matrix.indptr, np.arange(max_block_nnz, matrix.nnz, max_block_nnz), side='right')
+    boundaries = np.unique(np.concatenate([[0], np.clip(split_points, 1, num_rows), [num_rows]]))
+
+    futures = [
+        executor.submit(_solve_block, matrix, fixed_factors, gram, regularization, alpha, start, end)
+        for start, end in zip(boundaries[:-1], boundaries[1:])
+    ]
+    if not futures:
+        return np.zeros((matrix.shape[0], num_factors), dtype=np.float64)
+    return np.vstack([future.result() for future in futures])
+
+
+class ALSModel:
+    """
+    Implicit-feedback 矩陣分解（Hu, Koren & Volinsky 的 ALS）。
+
+    以互動分數作為信心權重 c = 1 + alpha × r，交替求解用戶與商品的潛在因子。
+    線上計分為一次「用戶因子 · 商品因子矩陣」的內積加 argpartition，
+    成本為 O(商品數 × factors)，與用戶總數無關。
+    因子以 float32 連續陣列存成 .npy，載入時使用 memory mapping。
+    """
+
+    USER_IDS_FILE = "user_ids.npy"
+    PRODUCT_IDS_FILE = "product_ids.npy"
+    USER_FACTORS_FILE = "user_factors.npy"
+    ITEM_FACTORS_FILE = "item_factors.npy"
+    META_FILE = "meta.json"
+
+    def __init__(self, user_ids: np.ndarray, product_ids: np.ndarray, user_factors: np.ndarray,
+                 item_factors: np.ndarray, meta: Dict = None, item_gram: Optional[np.ndarray] = None):
+        self.user_ids = user_ids
+        self.product_ids = product_ids
+        self.user_factors = user_factors
+        self.item_factors = item_factors
+        self.meta = meta or {}
+        self.users = IdEncoder(user_ids)
+        self.products = IdEncoder(product_ids)
+        # YᵀY 只與商品因子有關，訓練或載入時算一次，新用戶 fold-in 時不必每次重新計算 O(商品數 × factors²)
+        if item_gram is None:
+            item_factors64 = np.asarray(item_factors, dtype=np.float64)
+            item_gram = item_factors64.T @ item_factors64
+        self.item_gram = item_gram
+
+    @property
+    def num_factors(self) -> int:
+        return self.item_factors.shape[1]
+
+    def for_shard(self, shard_index: int, num_shards: int) -> "ALSModel":
+        """
+        只保留雜湊到指定分片的用戶因子，與 ModelSnapshot.for_shard 切分互動列的方式相同；
+        商品因子不變（仍可為同機各分片共用的 memory map）。其他分片的用戶不會被送到本分片計分。
+        """
+        if num_shards <= 1:
+            return self
+        rows = np.flatnonzero(shard_of_users(self.user_ids, num_shards) == shard_index)
+        return ALSModel(np.asarray(self.user_ids[rows]), self.product_ids, np.ascontiguousarray(self.user_factors[rows]),
+                        self.item_factors, self.meta, item_gram=self.item_gram)
+
+    @classmethod
+    def train(cls, interaction_matrix: sparse.csr_matrix, user_ids: IdArray, product_ids: IdArray,
+              factors: int = 64, regularization: float = 0.1, alpha: float = 40.0, iterations: int = 15,
+              num_threads: int = 0, random_state: int = 0) -> "ALSModel":
+        """離線訓練；num_threads <= 0 時使用所有 CPU。"""
+        start_time = time.time()
+        user_items = sparse.csr_matrix(interaction_matrix, dtype=np.float32)
+        item_users = user_items.T.tocsr()
+        num_users, num_products = user_items.shape
+
+        rng = np.random.default_rng(random_state)
+        user_factors = rng.normal(scale=0.01, size=(num_users, factors))
+        item_factors = rng.normal(scale=0.01, size=(num_products, factors))
+
+        num_threads = num_threads if num_threads > 0 else (os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=num_threads, thread_name_prefix="als") as executor:
+            for iteration in range(iterations):
+                user_factors = _solve_rows(user_items, item_factors, regularization, alpha, executor)
+                item_factors = _solve_rows(item_users, user_factors, regularization, alpha, executor)
+                logger.info(f"ALS iteration {iteration + 1}/{iterations} finished.")
+
+        meta = {
+            "num_users": int(num_users),
+            "num_products": int(num_products),
+            "factors": int(factors),
+            "regularization": float(regularization),
+            "alpha": float(alpha),
+            "iterations": int(iterations),
+            "built_at": time.time(),
+        }
+        logger.info(f"Trained ALS model ({num_users} users × {num_products} products, {factors} factors) "
+                    f"in {time.time() - start_time:.2f} seconds with {num_threads} threads.")
+        return cls(np.asarray(user_ids, dtype=np.int64), np.asarray(product_ids, dtype=np.int64),
+                   np.ascontiguousarray(user_factors, dtype=np.float32),
+                   np.ascontiguousarray(item_factors, dtype=np.float32), meta)
+
+    def save(self, directory: str) -> None:
+        """將 ID 映射、用戶與商品因子寫成 directory 的新版本。"""
+        with atomic_directory(directory) as version_directory:
+            np.save(os.path.join(version_directory, self.USER_IDS_FILE), self.user_ids)
+            np.save(os.path.join(version_directory, self.PRODUCT_IDS_FILE), self.product_ids)
+            np.save(os.path.join(version_directory, self.USER_FACTORS_FILE), self.user_factors)
+            np.save(os.path.join(version_directory, self.ITEM_FACTORS_FILE), self.item_factors)
+            with open(os.path.join(version_directory, self.META_FILE), "w") as f:
+                json.dump(self.meta, f)
+        logger.info(f"ALS model saved to {directory}.")
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "ALSModel":
+        directory = resolve(directory)
+        mmap_mode = 'r' if mmap else None
+        user_ids = np.load(os.path.join(directory, cls.USER_IDS_FILE), mmap_mode=mmap_mode)
+        product_ids = np.load(os.path.join(directory, cls.PRODUCT_IDS_FILE), mmap_mode=mmap_mode)
+        user_factors = np.load(os.path.join(directory, cls.USER_FACTORS_FILE), mmap_mode=mmap_mode)
+        item_factors = np.load(os.path.join(directory, cls.ITEM_FACTORS_FILE), mmap_mode=mmap_mode)
+        meta = {}
+        meta_path = os.path.join(directory, cls.META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+        logger.info(f"Loaded ALS model from {directory} ({len(user_ids)} users, {len(product_ids)} products).")
+        return cls(user_ids, product_ids, user_factors, item_factors, meta)
+
+    def user_vector(self, user_id: int, history_product_ids: IdArray = (),
+                    history_weights: Optional[np.ndarray] = None) -> Optional[np.ndarray]:
+        """
+        取得用戶因子；訓練後才出現的用戶以其互動歷史 fold-in 求解一次（固定商品因子），
+        成本只與其歷史長度及 factors 有關。沒有可用資料時回傳 None。
+        """
+        user_idx = self.users.encode_one(user_id)
+        if user_idx is not None:
+            return np.asarray(self.user_factors[user_idx])
+
+        positions = self.products.encode(history_product_ids)
+        known = positions >= 0
+        if not known.any():
+            return None
+        weights = np.ones(positions.size, dtype=np.float32) if history_weights is None \
+            else np.asarray(history_weights, dtype=np.float32)
+        history = sparse.csr_matrix(
+            (weights[known], (np.zeros(int(known.sum()), dtype=np.int64), positions[known])),
+            shape=(1, self.product_ids.size)
+        )
+        # _solve_block 只取用歷史中的商品因子列，不需轉換整個因子矩陣
+        solution = _solve_block(history, self.item_factors, self.item_gram,
+                                self.meta.get("regularization", 0.1), self.meta.get("alpha", 40.0), 0, 1)
+        return solution[0].astype(np.float32)
+
+    def recommend(self, user_vector: np.ndarray, exclude_product_ids: IdArray,
+                  num_recommendations: int, ann_index=None, ann_num_probes: int = 0,
+                  ann_max_candidates: Optional[int] = None,
+                  eligible: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        回傳 (product ids, scores)，由高到低排序，並排除指定的商品。
+        提供 ann_index（建立在商品因子上）時只對其取回的候選計分，否則對所有商品計分。
+        eligible 為對齊本模型商品位置的布林遮罩，遮罩為 False 的商品不會被推薦。
+        """
+        exclude = self.products.encode(exclude_product_ids)
+        exclude = exclude[exclude >= 0]
+        if ann_index is not None:
+            candidates = ann_index.candidates(user_vector, num_probes=ann_num_probes, max_candidates=ann_max_candidates)
+            candidates = candidates[~np.isin(candidates, exclude)]
+            if eligible is not None:
+                candidates = candidates[eligible[candidates]]
+            scores = np.asarray(self.item_factors[candidates] @ user_vector)
+            top_positions, top_scores = top_k(candidates, scores, num_recommendations)
+            return np.asarray(self.product_ids)[top_positions], top_scores
+
+        scores = self.item_factors @ user_vector
+        scores[exclude] = -np.inf
+        if eligible is not None:
+            scores[~eligible] = -np.inf
+        candidates = np.flatnonzero(np.isfinite(scores))
+        top_positions, top_scores = top_k(candidates, scores[candidates], num_recommendations)
+        return np.asarray(self.product_ids)[top_positions], top_scores
+
+    def recommend_batch(self, user_vectors: np.ndarray, exclude_product_ids: List[IdArray],
+                        num_recommendations: int,
+                        eligible: Optional[np.ndarray] = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """一次矩陣乘法為多個用戶計分，只有最後的遮蔽與 top-k 逐列處理。"""
+        if len(user_vectors) == 0:
+            return []
+        all_scores = np.asarray(user_vectors, dtype=np.float32) @ np.asarray(self.item_factors).T
+        if eligible is not None:
+            all_scores[:, ~eligible] = -np.inf
+        product_ids = np.asarray(self.product_ids)
+        results = []
+        for scores, excluded in zip(all_scores, exclude_product_ids):
+            exclude = self.products.encode(excluded)
+            scores[exclude[exclude >= 0]] = -np.inf
+            candidates = np.flatnonzero(np.isfinite(scores))
+            top_positions, top_scores = top_k(candidates, scores[candidates], num_recommendations)
+            results.append((product_ids[top_positions], top_scores))
+        return results
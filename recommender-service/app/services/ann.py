@@ -0,0 +1,191 @@
+import os
+import json
+import time
+import numpy as np
+from scipy import sparse
+from typing import Dict, Optional, Tuple, Union
+import logging
+
+from .atomic_directory import atomic_directory, resolve
+from .scoring import top_k
+from .sharding import mix64
+
+logger = logging.getLogger(__name__)
+
+Vectors = Union[np.ndarray, sparse.csr_matrix]
+
+
+# splitmix64 的遞增常數，用來把 (欄位, 字組) 與亂數種子組合成互不相關的狀態
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+
+
+class RandomProjectionLSH:
+    """
+    以隨機投影（SimHash）實作的近似最近鄰索引，用於 cosine similarity。
+
+    每張雜湊表以 num_bits 個隨機超平面將向量編碼為一個整數，相同編碼的向量落在同一個桶。
+    超平面的元素為 ±1，由 (欄位, 超平面) 的雜湊值決定（sign-hashed random projection），不需保存：
+    以用戶互動列建立索引時維度等於商品數，稠密的 (num_tables × num_bits, dim) 超平面矩陣
+    可達數百 MB；改為投影時只對向量實際用到的欄位、分批產生符號，記憶體與維度無關。
+    索引只保存各表排序後的編碼與對應位置，查詢時以 searchsorted 找出桶內的候選，
+    再由呼叫端以目前的向量做精確重排。向量可以是稀疏的互動列，也可以是稠密的因子嵌入。
+
+    召回率與延遲的取捨：
+    - num_tables 越多、num_bits 越少，候選越多、召回越高；
+    - 查詢時 num_probes 額外探查每張表中最接近超平面的幾個位元翻轉後的桶（multi-probe）；
+    - max_candidates 限制重排的候選數，超過時保留在最多張表中碰撞的向量。
+    """
+
+    CODES_FILE = "codes.npy"
+    ORDER_FILE = "order.npy"
+    META_FILE = "meta.json"
+    # 投影時每批產生符號的欄位數，暫存的符號矩陣為 (COLUMN_BLOCK, num_tables × num_bits) float32
+    COLUMN_BLOCK = 16384
+
+    def __init__(self, dim: int, num_bits: int, seed: int, codes: np.ndarray, order: np.ndarray, meta: Dict = None):
+        # codes / order: (num_tables, n)，codes 已依表排序
+        self.dim = dim
+        self.num_bits = num_bits
+        self.seed = seed
+        self.codes = codes
+        self.order = order
+        self.meta = meta or {}
+        self.num_tables, self.size = codes.shape
+        self.num_planes = self.num_tables * num_bits
+        self._bit_weights = np.left_shift(np.uint64(1), np.arange(self.num_bits, dtype=np.uint64))
+
+    def __repr__(self) -> str:
+        return f"RandomProjectionLSH(size={self.size}, tables={self.num_tables}, bits={self.num_bits})"
+
+    @classmethod
+    def build(cls, vectors: Vectors, num_tables: int = 8, num_bits: int = 16, random_state: int = 0,
+              block_size: int = 65536) -> "RandomProjectionLSH":
+        if not 0 < num_bits <= 64:
+            raise ValueError("num_bits must be between 1 and 64.")
+        start_time = time.time()
+        num_vectors, dim = vectors.shape
+        index = cls(dim, num_bits, random_state, np.zeros((num_tables, 0), dtype=np.uint64),
+                    np.zeros((num_tables, 0), dtype=np.int64))
+        codes = np.empty((num_vectors, num_tables), dtype=np.uint64)
+        for block_start in range(0, num_vectors, block_size):
+            block_end = min(block_start + block_size, num_vectors)
+            codes[block_start:block_end], _ = index.hash(vectors[block_start:block_end])
+
+        codes = np.ascontiguousarray(codes.T)
+        order = np.argsort(codes, axis=1, kind='stable')
+        meta = {
+            "size": int(num_vectors),
+            "dim": int(dim),
+            "num_tables": int(num_tables),
+            "num_bits": int(num_bits),
+            "seed": int(random_state),
+            "projection": "sign_hash",
+            "built_at": time.time(),
+        }
+        index = cls(dim, num_bits, random_state, np.take_along_axis(codes, order, axis=1), order, meta)
+        logger.info(f"Built {index} in {time.time() - start_time:.2f} seconds.")
+        return index
+
+    def signs(self, columns: np.ndarray) -> np.ndarray:
+        """指定欄位在各超平面上的 ±1 元素 (len(columns), num_tables × num_bits)。"""
+        words = (self.num_planes + 63) // 64
+        keys = np.asarray(columns).astype(np.uint64)[:, None] * np.uint64(words) + np.arange(words, dtype=np.uint64)
+        with np.errstate(over='ignore'):
+            states = np.uint64(self.seed) + (keys + np.uint64(1)) * _GOLDEN
+        hashed = mix64(states)
+        bits = (hashed[:, :, None] >> np.arange(64, dtype=np.uint64)) & np.uint64(1)
+        bits = bits.reshape(len(keys), words * 64)[:, :self.num_planes]
+        return 1 - 2 * bits.astype(np.float32)
+
+    def project(self, vectors: Vectors) -> np.ndarray:
+        """向量在所有超平面上的投影值 (n, num_tables × num_bits)。"""
+        if vectors.shape[1] > self.dim:
+            # 索引建立後才出現的維度（例如新商品）不參與雜湊，但仍會在重排時計分
+            vectors = vectors[:, :self.dim]
+        if sparse.issparse(vectors):
+            vectors = sparse.csr_matrix(vectors)
+            columns = np.unique(vectors.indices)
+        else:
+            vectors = np.asarray(vectors)
+            columns = np.arange(vectors.shape[1])
+        projections = np.zeros((vectors.shape[0], self.num_planes), dtype=np.float32)
+        for block_start in range(0, columns.size, self.COLUMN_BLOCK):
+            block = columns[block_start:block_start + self.COLUMN_BLOCK]
+            projections += np.asarray(vectors[:, block] @ self.signs(block), dtype=np.float32)
+        return projections
+
+    def hash(self, vectors: Vectors) -> Tuple[np.ndarray, np.ndarray]:
+        """回傳每個向量在各表的編碼 (n, num_tables) 與投影值 (n, num_tables, num_bits)。"""
+        projections = self.project(vectors).reshape(-1, self.num_tables, self.num_bits)
+        bits = (projections > 0).astype(np.uint64)
+        return (bits * self._bit_weights).sum(axis=2, dtype=np.uint64), projections
+
+    def candidates(self, query: Vectors, num_probes: int = 0, max_candidates: Optional[int] = None) -> np.ndarray:
+        """回傳查詢向量的候選位置（未排序）。"""
+        if self.size == 0:
+            return np.empty(0, dtype=np.int64)
+        if isinstance(query, np.ndarray) and query.ndim == 1:
+            query = query[None, :]
+        query_codes, projections = self.hash(query)
+        query_codes, projections = query_codes[0], projections[0]
+
+        num_probes = min(num_probes, self.num_bits)
+        found = []
+        for table in range(self.num_tables):
+            probe_codes = [query_codes[table]]
+            if num_probes > 0:
+                # 最接近超平面的位元最可能在相似向量上翻轉，優先探查
+                flip_bits = np.argsort(np.abs(projections[table]))[:num_probes]
+                probe_codes.extend(query_codes[table] ^ self._bit_weights[flip_bits])
+            probe_codes = np.asarray(probe_codes, dtype=np.uint64)
+            table_codes = self.codes[table]
+            lows = np.searchsorted(table_codes, probe_codes, side='left')
+            highs = np.searchsorted(table_codes, probe_codes, side='right')
+            for low, high in zip(lows, highs):
+                if high > low:
+                    found.append(np.asarray(self.order[table, low:high]))
+
+        if not found:
+            return np.empty(0, dtype=np.int64)
+        positions, counts = np.unique(np.concatenate(found), return_counts=True)
+        if max_candidates is not None and positions.size > max_candidates:
+            positions, _ = top_k(positions, counts.astype(np.float32), max_candidates)
+        return positions
+
+    def query(self, query: Vectors, vectors: Vectors, k: int, num_probes: int = 0,
+              max_candidates: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """取得候選後以 vectors 做精確內積重排，回傳前 k 個 (positions, scores)。"""
+        positions = self.candidates(query, num_probes=num_probes, max_candidates=max_candidates)
+        positions = positions[positions < vectors.shape[0]]
+        if positions.size == 0:
+            return positions, np.empty(0, dtype=np.float32)
+        if sparse.issparse(query):
+            scores = vectors[positions] @ query.T
+            scores = scores.toarray().ravel() if sparse.issparse(scores) else np.asarray(scores).ravel()
+        else:
+            scores = np.asarray(vectors[positions] @ np.asarray(query).ravel()).ravel()
+        return top_k(positions, scores.astype(np.float32), k)
+
+    def save(self, directory: str) -> None:
+        """將各表的雜湊碼、排序與投影參數寫成 directory 的新版本；超平面由種子重現，不需寫入。"""
+        with atomic_directory(directory) as version_directory:
+            np.save(os.path.join(version_directory, self.CODES_FILE), self.codes)
+            np.save(os.path.join(version_directory, self.ORDER_FILE), self.order)
+            with open(os.path.join(version_directory, self.META_FILE), "w") as f:
+                json.dump(self.meta, f)
+        logger.info(f"ANN index saved to {directory}.")
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "RandomProjectionLSH":
+        directory = resolve(directory)
+        mmap_mode = 'r' if mmap else None
+        with open(os.path.join(directory, cls.META_FILE)) as f:
+            meta = json.load(f)
+        if meta.get("projection") != "sign_hash":
+            # 舊版以稠密超平面編碼，無法以雜湊符號重現
+            raise ValueError(f"ANN index in {directory} was built with dense hyperplanes and must be rebuilt.")
+        codes = np.load(os.path.join(directory, cls.CODES_FILE), mmap_mode=mmap_mode)
+        order = np.load(os.path.join(directory, cls.ORDER_FILE), mmap_mode=mmap_mode)
+        index = cls(meta["dim"], meta["num_bits"], meta["seed"], codes, order, meta)
+        logger.info(f"Loaded {index} from {directory}.")
+        return index
@@ -0,0 +1,187 @@
+import os
+import json
+import shutil
+import time
+import numpy as np
+from scipy import sparse
+from typing import Dict, List, Optional
+import logging
+
+from ..data.data_loader import InteractionWatermark
+from .model_snapshot import ModelSnapshot
+from .item_similarity import ItemSimilarityIndex
+from .als import ALSModel
+from .ann import RandomProjectionLSH
+
+logger = logging.getLogger(__name__)
+
+
+def _save_csr(directory: str, prefix: str, matrix: sparse.csr_matrix) -> None:
+    np.save(os.path.join(directory, f"{prefix}_data.npy"), matrix.data)
+    np.save(os.path.join(directory, f"{prefix}_indices.npy"), matrix.indices)
+    np.save(os.path.join(directory, f"{prefix}_indptr.npy"), matrix.indptr)
+
+
+def _load_csr(directory: str, prefix: str, shape, mmap_mode: Optional[str]) -> sparse.csr_matrix:
+    # copy=False 讓 CSR 直接參照 memory-mapped 陣列，多個 worker 共用 page cache 中的同一份資料
+    return sparse.csr_matrix(
+        (np.load(os.path.join(directory, f"{prefix}_data.npy"), mmap_mode=mmap_mode),
+         np.load(os.path.join(directory, f"{prefix}_indices.npy"), mmap_mode=mmap_mode),
+         np.load(os.path.join(directory, f"{prefix}_indptr.npy"), mmap_mode=mmap_mode)),
+        shape=shape, copy=False
+    )
+
+
+class ModelArtifact:
+    """從版本目錄載入的模型：共享快照，以及一併發佈的 item-item 鄰居表與 ALS 因子（若有）。"""
+
+    def __init__(self, name: str, snapshot: ModelSnapshot, meta: Dict,
+                 item_index: Optional[ItemSimilarityIndex] = None, als_model: Optional[ALSModel] = None):
+        self.name = name
+        self.snapshot = snapshot
+        self.meta = meta
+        self.item_index = item_index
+        self.als_model = als_model
+
+
+class ModelArtifactStore:
+    """
+    版本化的模型檔目錄：
+
+        root/
+            CURRENT                 目前版本的名稱
+            versions/<name>/
+                meta.json           版本、水位、矩陣形狀等中繼資料
+                user_ids.npy        ID 映射（位置 → 用戶 / 商品 ID）
+                product_ids.npy
+                matrix_*.npy        互動矩陣的 CSR 元件（data / indices / indptr）
+                normalized_*.npy    列正規化矩陣的 CSR 元件
+                item_index/         （選用）ItemSimilarityIndex
+                als/                （選用）ALSModel
+                user_ann/           （選用）快照的用戶 ANN 索引（RandomProjectionLSH）
+
+    所有陣列皆為原始 .npy，worker 以 np.load(mmap_mode='r') 開啟，啟動時不需掃描資料庫，
+    同一台機器上的多個 worker 共用 page cache 中的同一份資料。
+    發佈時先寫入暫存目錄再改名，最後以 os.replace 原子更新 CURRENT，讀取端不會看到寫到一半的版本。
+    """
+
+    CURRENT_FILE = "CURRENT"
+    VERSIONS_DIR = "versions"
+    META_FILE = "meta.json"
+    ITEM_INDEX_DIR = "item_index"
+    ALS_DIR = "als"
+    USER_ANN_DIR = "user_ann"
+
+    def __init__(self, root: str, keep_versions: int = 3):
+        self.root = root
+        self.keep_versions = keep_versions
+
+    def version_path(self, name: str) -> str:
+        return os.path.join(self.root, self.VERSIONS_DIR, name)
+
+    def current_version(self) -> Optional[str]:
+        try:
+            with open(os.path.join(self.root, self.CURRENT_FILE)) as f:
+                name = f.read().strip()
+        except FileNotFoundError:
+            return None
+        return name if name and os.path.isdir(self.version_path(name)) else None
+
+    def list_versions(self) -> List[str]:
+        versions_dir = os.path.join(self.root, self.VERSIONS_DIR)
+        if not os.path.isdir(versions_dir):
+            return []
+        return sorted(name for name in os.listdir(versions_dir)
+                      if not name.endswith(".tmp") and os.path.isdir(os.path.join(versions_dir, name)))
+
+    def publish(self, snapshot: ModelSnapshot, item_index: Optional[ItemSimilarityIndex] = None,
+                als_model: Optional[ALSModel] = None) -> str:
+        """寫入新版本並設為 CURRENT，回傳版本名稱。"""
+        name = time.strftime("%Y%m%dT%H%M%S") + f"-{time.time_ns() % 1_000_000_000:09d}"
+        tmp_directory = self.version_path(name) + ".tmp"
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+        os.makedirs(tmp_directory)
+
+        np.save(os.path.join(tmp_directory, "user_ids.npy"), snapshot.all_user_ids)
+        np.save(os.path.join(tmp_directory, "product_ids.npy"), snapshot.all_product_ids)
+        _save_csr(tmp_directory, "matrix", snapshot.interaction_matrix)
+        _save_csr(tmp_directory, "normalized", snapshot.normalized_matrix)
+        if item_index is not None:
+            item_index.save(os.path.join(tmp_directory, self.ITEM_INDEX_DIR))
+        if als_model is not None:
+            als_model.save(os.path.join(tmp_directory, self.ALS_DIR))
+        if snapshot.user_ann_index is not None:
+            snapshot.user_ann_index.save(os.path.join(tmp_directory, self.USER_ANN_DIR))
+
+        meta = {
+            "name": name,
+            "snapshot_version": snapshot.version,
+            "built_at": snapshot.built_at,
+            "published_at": time.time(),
+            "shape": list(snapshot.interaction_matrix.shape),
+            "watermark": list(snapshot.watermark),
+        }
+        with open(os.path.join(tmp_directory, self.META_FILE), "w") as f:
+            json.dump(meta, f)
+        os.rename(tmp_directory, self.version_path(name))
+
+        current_tmp = os.path.join(self.root, self.CURRENT_FILE + ".tmp")
+        with open(current_tmp, "w") as f:
+            f.write(name)
+        os.replace(current_tmp, os.path.join(self.root, self.CURRENT_FILE))
+        logger.info(f"Published model artifact {name} ({snapshot}).")
+
+        self.prune()
+        return name
+
+    def read_meta(self, name: str) -> Dict:
+        with open(os.path.join(self.version_path(name), self.META_FILE)) as f:
+            return json.load(f)
+
+    def prune(self) -> None:
+        """只保留最新的 keep_versions 個版本；CURRENT 指向的版本一律保留。"""
+        current = self.current_version()
+        for name in self.list_versions()[:-self.keep_versions or None]:
+            if name != current:
+                shutil.rmtree(self.version_path(name), ignore_errors=True)
+                logger.info(f"Removed old model artifact {name}.")
+
+    def load(self, name: Optional[str] = None, version: int = 0, mmap: bool = True) -> Optional[ModelArtifact]:
+        """載入指定版本（預設為 CURRENT）；沒有任何已發佈版本時回傳 None。"""
+        name = name or self.current_version()
+        if name is None:
+            return None
+        start_time = time.time()
+        directory = self.version_path(name)
+        mmap_mode = 'r' if mmap else None
+        meta = self.read_meta(name)
+
+        shape = tuple(meta["shape"])
+        user_ids = np.load(os.path.join(directory, "user_ids.npy"), mmap_mode=mmap_mode)
+        product_ids = np.load(os.path.join(directory, "product_ids.npy"), mmap_mode=mmap_mode)
+        user_ann_path = os.path.join(directory, self.USER_ANN_DIR)
+        user_ann_index = None
+        if os.path.isdir(user_ann_path):
+            try:
+                user_ann_index = RandomProjectionLSH.load(user_ann_path, mmap=mmap)
+            except ValueError as e:
+                # 舊格式的索引略過，ANN_ENABLED 時由 ModelStore 重新建立
+                logger.warning(f"Ignoring user ANN index of {name}: {e}")
+        snapshot = ModelSnapshot(
+            version,
+            _load_csr(directory, "matrix", shape, mmap_mode),
+            user_ids,
+            product_ids,
+            _load_csr(directory, "normalized", shape, mmap_mode),
+            built_at=meta.get("built_at"),
+            watermark=InteractionWatermark(*meta.get("watermark", [0, 0])),
+            user_ann_index=user_ann_index
+        )
+
+        item_index_path = os.path.join(directory, self.ITEM_INDEX_DIR)
+        item_index = ItemSimilarityIndex.load(item_index_path, mmap=mmap) if os.path.isdir(item_index_path) else None
+        als_path = os.path.join(directory, self.ALS_DIR)
+        als_model = ALSModel.load(als_path, mmap=mmap) if os.path.isdir(als_path) else None
+
+        logger.info(f"Loaded model artifact {name} ({snapshot}) in {time.time() - start_time:.3f} seconds.")
+        return ModelArtifact(name, snapshot, meta, item_index=item_index, als_model=als_model)
@@ -0,0 +1,67 @@
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+VERSIONS_SUFFIX = ".versions"
+# 舊版以實體目錄存放的資料移入版本目錄時使用的名稱，排序在所有時間戳記版本之前
+LEGACY_VERSION = "00000000T000000-legacy"
+
+
+def _remove(path: str) -> None:
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def _prune(versions_directory: str, current: str, keep_versions: int) -> None:
+    """只保留最新的 keep_versions 個版本；directory 目前指向的版本一律保留。"""
+    names = sorted(os.listdir(versions_directory))
+    for name in names[:-keep_versions or None]:
+        if name != current:
+            shutil.rmtree(os.path.join(versions_directory, name), ignore_errors=True)
+
+
+def resolve(directory: str) -> str:
+    """
+    將 directory（atomic_directory 寫入的 symbolic link，或舊版的實體目錄）解析成目前的版本目錄。
+    讀取端只解析一次、之後的檔案都從回傳的目錄開啟，即使讀到一半時切換了版本，也不會混用兩個版本的檔案。
+    """
+    return os.path.realpath(directory)
+
+
+@contextmanager
+def atomic_directory(directory: str, keep_versions: int = 2) -> Iterator[str]:
+    """
+    每次寫入產生一個新的版本目錄 <directory>.versions/<name>，區塊正常結束後才以 os.replace 將 directory
+    這個 symbolic link 原子地指向新版本，與 ModelArtifactStore 更新 CURRENT 的方式相同：
+    任何時間點 directory 都存在且指向一份完整的資料，讀取端（例如以 memory mapping 載入的 worker）
+    不會看到寫到一半的檔案，也不會遇到目錄暫時不存在；寫入失敗時保留原版本。
+    讀取端以 resolve 解析一次後從同一個版本讀取所有檔案；舊版本保留到超過 keep_versions 個為止，
+    讓剛解析到舊版本的讀取端仍能完成載入。
+
+        with atomic_directory(path) as version_directory:
+            np.save(os.path.join(version_directory, "data.npy"), data)
+    """
+    parent, base = os.path.split(os.path.abspath(directory))
+    versions_directory = os.path.join(parent, base + VERSIONS_SUFFIX)
+    name = time.strftime("%Y%m%dT%H%M%S") + f"-{time.time_ns() % 1_000_000_000:09d}"
+    version_directory = os.path.join(versions_directory, name)
+    os.makedirs(version_directory)
+    try:
+        yield version_directory
+    except BaseException:
+        shutil.rmtree(version_directory, ignore_errors=True)
+        raise
+
+    if os.path.isdir(directory) and not os.path.islink(directory):
+        # 由舊版的實體目錄轉換為 symbolic link：只有這一次轉換有短暫的空窗
+        os.rename(directory, os.path.join(versions_directory, LEGACY_VERSION))
+    link_tmp = f"{directory}.tmp"
+    _remove(link_tmp)
+    # 相對路徑的連結，整個上層目錄被搬移（例如發佈模型檔時改名暫存目錄）後仍然有效
+    os.symlink(os.path.join(base + VERSIONS_SUFFIX, name), link_tmp)
+    os.replace(link_tmp, directory)
+    _prune(versions_directory, name, keep_versions)
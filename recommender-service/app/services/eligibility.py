@@ -0,0 +1,167 @@
+import threading
+import time
+import weakref
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from typing import Callable, Dict, Hashable, NamedTuple, Optional, Tuple
+import logging
+
+from ..models.product import Product
+from .id_encoder import IdArray, IdEncoder
+
+logger = logging.getLogger(__name__)
+
+
+class ProductFilter(NamedTuple):
+    """單次請求的商品篩選條件：只推薦有庫存的商品、限定分類、排除指定商品。"""
+    category_id: Optional[int] = None
+    exclude_product_ids: Tuple[int, ...] = ()
+    in_stock_only: bool = True
+
+    @property
+    def is_request_specific(self) -> bool:
+        """有分類或排除條件時，結果只適用於這次請求，不寫入用戶的推薦快取。"""
+        return self.category_id is not None or bool(self.exclude_product_ids)
+
+    @property
+    def is_active(self) -> bool:
+        """是否有任何條件需要套用；沒有時不必建立遮罩。"""
+        return self.in_stock_only or self.is_request_specific
+
+
+class EligibilityMasks:
+    """
+    對齊某個商品索引（IdEncoder 的位置）的布林遮罩：有庫存、各分類。
+
+    計分時以 mask[candidate positions] 一次向量化篩選候選商品，再做 top-k，
+    篩選的成本只有一次布林索引，與未篩選的請求相同數量級。
+    """
+
+    def __init__(self, known: np.ndarray, in_stock: np.ndarray, categories: Dict[int, np.ndarray]):
+        self.known = known
+        self.in_stock = in_stock
+        self.categories = categories
+
+    def mask(self, product_filter: ProductFilter, encoder: IdEncoder) -> np.ndarray:
+        """回傳符合條件的位置遮罩；沒有額外條件時直接回傳共用的遮罩（唯讀，不可修改）。"""
+        eligible = self.in_stock if product_filter.in_stock_only else self.known
+        if product_filter.category_id is not None:
+            category_mask = self.categories.get(product_filter.category_id)
+            if category_mask is None:
+                return np.zeros_like(eligible)
+            eligible = eligible & category_mask
+        if product_filter.exclude_product_ids:
+            positions = encoder.encode(np.asarray(product_filter.exclude_product_ids, dtype=np.int64))
+            positions = positions[positions >= 0]
+            if positions.size:
+                eligible = eligible.copy() if eligible is self.in_stock or eligible is self.known else eligible
+                eligible[positions] = False
+        return eligible
+
+
+class ProductCatalog:
+    """
+    商品的庫存與分類，依 ID 排序的欄式陣列，由背景工作定期重新載入。
+
+    各推薦模型的商品索引不同（快照、item-item 鄰居表、ALS 因子），
+    masks_for 為每個索引建立一次對齊的 EligibilityMasks 並快取，直到該索引被替換。
+    """
+
+    def __init__(self, product_ids: np.ndarray, in_stock: np.ndarray, category_ids: np.ndarray,
+                 built_at: Optional[float] = None):
+        self.product_ids = product_ids
+        self.in_stock = in_stock
+        self.category_ids = category_ids
+        self.built_at = built_at if built_at is not None else time.time()
+        self._init_cache()
+
+    def _init_cache(self) -> None:
+        self._masks: "weakref.WeakKeyDictionary[IdEncoder, EligibilityMasks]" = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # 傳給批次工作進程時不帶快取與鎖，由各進程自行建立
+        return {"product_ids": self.product_ids, "in_stock": self.in_stock, "category_ids": self.category_ids,
+                "built_at": self.built_at}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_cache()
+
+    def __repr__(self) -> str:
+        return f"ProductCatalog(products={self.product_ids.size}, in_stock={int(self.in_stock.sum())})"
+
+    @property
+    def age_seconds(self) -> float:
+        return time.time() - self.built_at
+
+    @classmethod
+    def build(cls, db: Session) -> "ProductCatalog":
+        rows = db.execute(select(Product.id, Product.stock, Product.category_id).order_by(Product.id)).all()
+        product_ids = np.array([row[0] for row in rows], dtype=np.int64)
+        in_stock = np.array([(row[1] or 0) > 0 for row in rows], dtype=bool)
+        category_ids = np.array([row[2] if row[2] is not None else -1 for row in rows], dtype=np.int64)
+        catalog = cls(product_ids, in_stock, category_ids)
+        logger.info(f"Built {catalog}.")
+        return catalog
+
+    def _lookup(self, product_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        回傳各商品的 (是否存在, 是否有庫存, 分類 ID)；
+        不在 catalog 中（已刪除或 catalog 為空）的商品視為無庫存、無分類。
+        """
+        if self.product_ids.size == 0:
+            missing = np.zeros(product_ids.size, dtype=bool)
+            return missing, missing, np.full(product_ids.size, -1, dtype=np.int64)
+        rows = np.minimum(np.searchsorted(self.product_ids, product_ids), self.product_ids.size - 1)
+        known = self.product_ids[rows] == product_ids
+        return known, known & self.in_stock[rows], np.where(known, self.category_ids[rows], -1)
+
+    def masks_for(self, encoder: IdEncoder) -> EligibilityMasks:
+        masks = self._masks.get(encoder)
+        if masks is not None:
+            return masks
+        with self._lock:
+            masks = self._masks.get(encoder)
+            if masks is None:
+                known, in_stock, category_ids = self._lookup(encoder.ids)
+                categories = {int(category_id): category_ids == category_id
+                              for category_id in np.unique(category_ids) if category_id >= 0}
+                masks = EligibilityMasks(known, in_stock, categories)
+                self._masks[encoder] = masks
+        return masks
+
+    def eligible(self, product_ids: IdArray, product_filter: ProductFilter) -> np.ndarray:
+        """任意一組商品 ID 是否符合條件（例如熱門排行的一段），不需對齊的索引。"""
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        known, in_stock, category_ids = self._lookup(product_ids)
+        eligible = in_stock if product_filter.in_stock_only else known
+        if product_filter.category_id is not None:
+            eligible &= category_ids == product_filter.category_id
+        if product_filter.exclude_product_ids:
+            eligible &= ~np.isin(product_ids, np.asarray(product_filter.exclude_product_ids, dtype=np.int64))
+        return eligible
+
+
+class FallbackProductSets:
+    """
+    共享 catalog 無法載入時的備援篩選資料：缺貨商品、各分類中的商品等 ID 集合。
+    第一個需要的請求查詢資料庫一次，之後 ttl_seconds 內的請求（同一進程）直接共用結果，
+    不在每個請求上重複查詢。catalog 恢復後即不再使用。
+    """
+
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self._entries: Dict[Hashable, Tuple[float, np.ndarray]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, load: Callable[[], np.ndarray]) -> np.ndarray:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+        # 同時過期的請求可能各查詢一次，結果相同，不需互斥
+        product_ids = load()
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, product_ids)
+        return product_ids
@@ -0,0 +1,36 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+import logging
+
+from ..core.config import settings
+
+logger = logging.getLogger(__name__)
+
+_scoring_executor: ThreadPoolExecutor = None
+
+
+def get_scoring_executor() -> ThreadPoolExecutor:
+    """
+    CPU 密集計分專用的有界執行緒池。NumPy / SciPy 的矩陣運算大多會釋放 GIL，
+    因此以執行緒即可並行，也不必在進程之間複製模型快照。
+    """
+    global _scoring_executor
+    if _scoring_executor is None:
+        _scoring_executor = ThreadPoolExecutor(max_workers=settings.SCORING_EXECUTOR_WORKERS,
+                                               thread_name_prefix="scoring")
+    return _scoring_executor
+
+
+async def run_in_scoring_executor(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """在計分執行緒池中執行同步函式，event loop 在等待期間可繼續處理其他請求。"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_scoring_executor(), functools.partial(func, *args, **kwargs))
+
+
+def shutdown_scoring_executor() -> None:
+    global _scoring_executor
+    if _scoring_executor is not None:
+        _scoring_executor.shutdown(wait=False)
+        _scoring_executor = None
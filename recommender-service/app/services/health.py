@@ -0,0 +1,109 @@
+import asyncio
+import time
+from sqlalchemy import text
+from typing import Any, Awaitable, Callable, Dict, Optional
+import logging
+
+from .metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+DEPENDENCY_UP = REGISTRY.gauge(
+    "dependency_up",
+    "Result of the latest background health check per dependency (1 = reachable).",
+    ["dependency"]
+)
+
+HealthCheck = Callable[[], Awaitable[Any]]
+
+
+def database_check(session_factory) -> HealthCheck:
+    async def check():
+        async with session_factory() as db:
+            await db.execute(text("SELECT 1"))
+    return check
+
+
+def redis_check(client_factory) -> HealthCheck:
+    async def check():
+        client = client_factory()
+        if client is None:
+            raise RuntimeError("Redis client not configured.")
+        await client.ping()
+    return check
+
+
+class HealthMonitor:
+    """
+    依賴服務（資料庫、Redis）的健康狀態，由背景 task 定期檢查並快取結果。
+
+    /health 只讀取最近一次的結果，高頻率的探測不會每次都借用資料庫連線與 Redis 連線；
+    結果超過 max_age_seconds 未更新時（例如背景 task 未啟動）才在請求中重新檢查，並發的檢查共用同一次執行。
+    """
+
+    def __init__(self, checks: Dict[str, HealthCheck], interval_seconds: float = 5.0,
+                 timeout_seconds: float = 1.0, max_age_seconds: float = 15.0):
+        self.checks = checks
+        self.interval_seconds = interval_seconds
+        self.timeout_seconds = timeout_seconds
+        self.max_age_seconds = max_age_seconds
+        self._status: Optional[Dict[str, Any]] = None
+        self._checked_at: Optional[float] = None
+        self._refreshing: Optional[asyncio.Task] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run_check(self, name: str, check: HealthCheck) -> str:
+        try:
+            await asyncio.wait_for(check(), timeout=self.timeout_seconds)
+            DEPENDENCY_UP.set(1, dependency=name)
+            return "connected"
+        except Exception as e:
+            DEPENDENCY_UP.set(0, dependency=name)
+            reason = str(e) or type(e).__name__
+            logger.error(f"Health check for {name} failed: {reason}")
+            return f"error: {reason}"
+
+    async def _refresh(self) -> Dict[str, Any]:
+        names = list(self.checks)
+        results = await asyncio.gather(*(self._run_check(name, self.checks[name]) for name in names))
+        status = {"status": "ok" if all(result == "connected" for result in results) else "error"}
+        status.update(zip(names, results))
+        self._status, self._checked_at = status, time.monotonic()
+        return status
+
+    async def refresh(self) -> Dict[str, Any]:
+        """執行一次檢查；已有檢查進行中時等待同一次的結果。"""
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.get_running_loop().create_task(self._refresh())
+        return await asyncio.shield(self._refreshing)
+
+    @property
+    def age_seconds(self) -> Optional[float]:
+        return time.monotonic() - self._checked_at if self._checked_at is not None else None
+
+    async def status(self) -> Dict[str, Any]:
+        age = self.age_seconds
+        if self._status is None or age > self.max_age_seconds:
+            return await self.refresh()
+        return self._status
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Background health check failed: {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,69 @@
+import numpy as np
+from typing import Iterable, Iterator, Optional, Union
+
+IdArray = Union[np.ndarray, Iterable[int]]
+
+
+class IdEncoder:
+    """
+    外部 ID（用戶 / 商品）與矩陣位置之間的雙向映射，以 int64 陣列取代 Python dict / list。
+
+    ids[position] 即為位置對應的 ID（decode 只是索引）；encode 以 searchsorted 在排序後的 ID 上查找，
+    整欄 ID 一次向量化完成。ID 本身已排序時（np.unique 的結果，以及只附加較大新 ID 的增量更新）
+    不需額外的排序索引，記憶體只有一個 int64 陣列，也可以直接使用 memory-mapped 陣列。
+    """
+
+    def __init__(self, ids: IdArray):
+        if not isinstance(ids, np.ndarray):
+            ids = np.fromiter(ids, dtype=np.int64)
+        # 已是 int64 時保留原陣列（包含 memory-mapped 陣列），不複製
+        self.ids = ids if ids.dtype == np.int64 else ids.astype(np.int64)
+        if self.ids.size > 1 and not bool(np.all(self.ids[1:] > self.ids[:-1])):
+            # 非遞增時另存排序後的 ID 與其原始位置
+            self._order = np.argsort(self.ids, kind='stable')
+            self._sorted_ids = self.ids[self._order]
+        else:
+            self._order = None
+            self._sorted_ids = self.ids
+
+    def __len__(self) -> int:
+        return int(self.ids.size)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.ids.tolist())
+
+    def __contains__(self, id_value: int) -> bool:
+        return self.encode_one(id_value) is not None
+
+    def __repr__(self) -> str:
+        return f"IdEncoder(size={len(self)})"
+
+    def encode(self, ids: IdArray) -> np.ndarray:
+        """將整欄 ID 換成位置（int64），不存在的 ID 為 -1。"""
+        ids = np.asarray(ids, dtype=np.int64)
+        if self._sorted_ids.size == 0 or ids.size == 0:
+            return np.full(ids.shape, -1, dtype=np.int64)
+        slots = np.searchsorted(self._sorted_ids, ids)
+        slots = np.minimum(slots, self._sorted_ids.size - 1)
+        found = self._sorted_ids[slots] == ids
+        positions = slots if self._order is None else self._order[slots]
+        return np.where(found, positions, -1).astype(np.int64, copy=False)
+
+    def encode_one(self, id_value: int) -> Optional[int]:
+        """單一 ID 的位置；不存在時回傳 None。"""
+        position = int(self.encode(np.array([id_value], dtype=np.int64))[0])
+        return position if position >= 0 else None
+
+    def decode(self, positions: IdArray) -> np.ndarray:
+        return self.ids[np.asarray(positions, dtype=np.int64)]
+
+    def tolist(self):
+        return self.ids.tolist()
+
+    def extend(self, ids: IdArray) -> "IdEncoder":
+        """回傳附加了尚未出現的 ID 的新映射（依 ID 排序附加在尾端），既有位置不變。"""
+        unique_ids = np.unique(np.asarray(ids, dtype=np.int64))
+        new_ids = unique_ids[self.encode(unique_ids) < 0]
+        if new_ids.size == 0:
+            return self
+        return IdEncoder(np.concatenate([np.asarray(self.ids), new_ids]))
@@ -0,0 +1,129 @@
+import os
+import json
+import time
+import numpy as np
+from scipy import sparse
+from typing import Dict, List, Optional, Tuple
+import logging
+
+from .id_encoder import IdArray, IdEncoder
+from .atomic_directory import atomic_directory, resolve
+from .scoring import normalize_rows, top_k
+
+logger = logging.getLogger(__name__)
+
+
+class ItemSimilarityIndex:
+    """
+    預先計算好的 item-item 鄰居表：每個商品保留前 N 個最相似的商品。
+
+    以 .npy 檔存放在一個目錄中，載入時使用 memory mapping，
+    同一台機器上的多個 worker 可共用 page cache 中的同一份資料。
+    線上計分只需合併用戶互動過的商品的鄰居列表，成本取決於用戶歷史長度，而非用戶總數。
+    """
+
+    PRODUCT_IDS_FILE = "product_ids.npy"
+    NEIGHBOURS_FILE = "neighbours.npy"
+    SCORES_FILE = "scores.npy"
+    META_FILE = "meta.json"
+
+    def __init__(self, product_ids: np.ndarray, neighbours: np.ndarray, scores: np.ndarray, meta: Dict = None):
+        # neighbours[i] 為商品 i 的鄰居在 product_ids 中的位置，不足 N 個時以 -1 補齊
+        self.product_ids = product_ids
+        self.neighbours = neighbours
+        self.scores = scores
+        self.meta = meta or {}
+        self.products = IdEncoder(product_ids)
+
+    @property
+    def num_neighbours(self) -> int:
+        return self.neighbours.shape[1] if self.neighbours.ndim == 2 else 0
+
+    @classmethod
+    def build(cls, interaction_matrix: sparse.csr_matrix, product_ids: IdArray,
+              num_neighbours: int = 50, block_size: int = 512) -> "ItemSimilarityIndex":
+        """由 users × products 互動矩陣計算每個商品的 top-N 相似商品（cosine）。"""
+        start_time = time.time()
+        num_products = interaction_matrix.shape[1]
+        item_vectors = normalize_rows(interaction_matrix.T.tocsr())
+        item_vectors_t = item_vectors.T.tocsr()
+
+        neighbours = np.full((num_products, num_neighbours), -1, dtype=np.int32)
+        scores = np.zeros((num_products, num_neighbours), dtype=np.float32)
+
+        # 分批計算，每批只產生 block_size × products 的稀疏相似度區塊
+        for block_start in range(0, num_products, block_size):
+            block_end = min(block_start + block_size, num_products)
+            block = (item_vectors[block_start:block_end] @ item_vectors_t).tocsr()
+            for offset in range(block_end - block_start):
+                item_idx = block_start + offset
+                row_start, row_end = block.indptr[offset], block.indptr[offset + 1]
+                candidate_indices = block.indices[row_start:row_end]
+                candidate_scores = block.data[row_start:row_end]
+                keep = (candidate_indices != item_idx) & (candidate_scores > 0.0)
+                top_indices, top_scores = top_k(candidate_indices[keep], candidate_scores[keep], num_neighbours)
+                neighbours[item_idx, :top_indices.size] = top_indices
+                scores[item_idx, :top_scores.size] = top_scores
+
+        meta = {
+            "num_products": int(num_products),
+            "num_neighbours": int(num_neighbours),
+            "built_at": time.time(),
+        }
+        logger.info(f"Built item similarity index for {num_products} products in {time.time() - start_time:.2f} seconds.")
+        return cls(np.asarray(product_ids, dtype=np.int64), neighbours, scores, meta)
+
+    def save(self, directory: str) -> None:
+        """將鄰居與分數寫成 directory 的新版本。"""
+        with atomic_directory(directory) as version_directory:
+            np.save(os.path.join(version_directory, self.PRODUCT_IDS_FILE), self.product_ids)
+            np.save(os.path.join(version_directory, self.NEIGHBOURS_FILE), self.neighbours)
+            np.save(os.path.join(version_directory, self.SCORES_FILE), self.scores)
+            with open(os.path.join(version_directory, self.META_FILE), "w") as f:
+                json.dump(self.meta, f)
+        logger.info(f"Item similarity index saved to {directory}.")
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "ItemSimilarityIndex":
+        directory = resolve(directory)
+        mmap_mode = 'r' if mmap else None
+        product_ids = np.load(os.path.join(directory, cls.PRODUCT_IDS_FILE), mmap_mode=mmap_mode)
+        neighbours = np.load(os.path.join(directory, cls.NEIGHBOURS_FILE), mmap_mode=mmap_mode)
+        scores = np.load(os.path.join(directory, cls.SCORES_FILE), mmap_mode=mmap_mode)
+        meta = {}
+        meta_path = os.path.join(directory, cls.META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+        logger.info(f"Loaded item similarity index from {directory} ({len(product_ids)} products).")
+        return cls(product_ids, neighbours, scores, meta)
+
+    def recommend(self, history_product_ids: IdArray, history_weights: np.ndarray,
+                  num_recommendations: int, eligible: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        合併用戶互動過的商品的鄰居列表，回傳 (product ids, scores)，由高到低排序。
+        score(j) = Σ_i weight(i) × sim(i, j)，並排除用戶已互動過的商品；
+        eligible 為對齊本索引商品位置的布林遮罩，只保留遮罩為 True 的候選。
+        """
+        positions = self.products.encode(history_product_ids)
+        known = positions >= 0
+        positions = positions[known]
+        if positions.size == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        weights = np.asarray(history_weights, dtype=np.float32)[known]
+        candidates = np.asarray(self.neighbours[positions]).ravel()
+        candidate_scores = (np.asarray(self.scores[positions]) * weights[:, None]).ravel()
+
+        valid = (candidates >= 0) & ~np.isin(candidates, positions)
+        candidates, candidate_scores = candidates[valid], candidate_scores[valid]
+        if eligible is not None:
+            valid = eligible[candidates]
+            candidates, candidate_scores = candidates[valid], candidate_scores[valid]
+        if candidates.size == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        unique_candidates, inverse = np.unique(candidates, return_inverse=True)
+        aggregated = np.bincount(inverse, weights=candidate_scores).astype(np.float32)
+        top_positions, top_scores = top_k(unique_candidates, aggregated, num_recommendations)
+        return np.asarray(self.product_ids)[top_positions], top_scores
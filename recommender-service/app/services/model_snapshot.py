@@ -0,0 +1,149 @@
+import time
+import numpy as np
+from scipy import sparse
+from typing import List, Optional, Tuple, Union
+
+from ..data.data_loader import InteractionWatermark
+from .ann import RandomProjectionLSH
+from .id_encoder import IdArray, IdEncoder
+from .scoring import normalize_rows
+from .sharding import shard_of_users
+
+
+def _splice_rows(matrix: sparse.csr_matrix, rows: np.ndarray, replacement: sparse.csr_matrix,
+                 shape: Tuple[int, int]) -> sparse.csr_matrix:
+    """
+    回傳將 matrix 的第 rows 列（已排序、不重複，可超出原本的列數）換成 replacement 各列的新矩陣，形狀擴充為 shape。
+    其餘列以連續區段整段複製 indices / data，不重新計算；原矩陣（可能是 memory map）不變。
+    """
+    num_rows = matrix.shape[0]
+    counts = np.zeros(shape[0], dtype=np.int64)
+    counts[:num_rows] = np.diff(matrix.indptr)
+    counts[rows] = np.diff(replacement.indptr)
+    indptr = np.zeros(shape[0] + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    indices = np.empty(indptr[-1], dtype=np.int64 if shape[1] > np.iinfo(np.int32).max else np.int32)
+    data = np.empty(indptr[-1], dtype=np.float32)
+
+    def copy(start: int, end: int) -> None:
+        # 未變動的第 start..end-1 列，位移後整段複製
+        if end > start:
+            indices[indptr[start]:indptr[end]] = matrix.indices[matrix.indptr[start]:matrix.indptr[end]]
+            data[indptr[start]:indptr[end]] = matrix.data[matrix.indptr[start]:matrix.indptr[end]]
+
+    previous = 0
+    for position, row in enumerate(rows.tolist()):
+        copy(previous, min(row, num_rows))
+        indices[indptr[row]:indptr[row + 1]] = replacement.indices[replacement.indptr[position]:replacement.indptr[position + 1]]
+        data[indptr[row]:indptr[row + 1]] = replacement.data[replacement.indptr[position]:replacement.indptr[position + 1]]
+        previous = row + 1
+    copy(previous, num_rows)
+    return sparse.csr_matrix((data, indices, indptr), shape=shape, copy=False)
+
+
+class ModelSnapshot:
+    """
+    某一時間點的推薦模型快照，建立後即視為唯讀，由所有請求共享。
+    包含 ID 映射、互動矩陣以及由矩陣衍生的相似度資料（列正規化後的矩陣，
+    用於在請求時只計算目標用戶那一列的 cosine similarity）。
+    user_ann_index 為建立在正規化矩陣列上的用戶 ANN 索引（選用），與快照一起建立、一起替換，
+    請求路徑只讀取，不建立。
+    """
+
+    def __init__(
+        self,
+        version: int,
+        interaction_matrix: sparse.csr_matrix,
+        all_user_ids: Union[IdEncoder, IdArray],
+        all_product_ids: Union[IdEncoder, IdArray],
+        normalized_matrix: sparse.csr_matrix,
+        built_at: Optional[float] = None,
+        watermark: InteractionWatermark = InteractionWatermark(),
+        user_ann_index: Optional[RandomProjectionLSH] = None,
+    ):
+        self.version = version
+        self.interaction_matrix = interaction_matrix
+        # 列 / 欄位置與用戶 / 商品 ID 的映射
+        self.users = all_user_ids if isinstance(all_user_ids, IdEncoder) else IdEncoder(all_user_ids)
+        self.products = all_product_ids if isinstance(all_product_ids, IdEncoder) else IdEncoder(all_product_ids)
+        self.normalized_matrix = normalized_matrix
+        self.built_at = built_at if built_at is not None else time.time()
+        # 此快照已包含的資料水位，增量更新只需讀取水位之後的新資料
+        self.watermark = watermark
+        self.user_ann_index = user_ann_index
+
+    @property
+    def all_user_ids(self) -> np.ndarray:
+        return self.users.ids
+
+    @property
+    def all_product_ids(self) -> np.ndarray:
+        return self.products.ids
+
+    @property
+    def is_empty(self) -> bool:
+        return len(self.users) == 0 or len(self.products) == 0
+
+    @property
+    def age_seconds(self) -> float:
+        return time.time() - self.built_at
+
+    def with_watermark(self, watermark: InteractionWatermark) -> "ModelSnapshot":
+        """資料沒有變動、只推進水位的快照，共用同一份矩陣與版本。"""
+        return ModelSnapshot(self.version, self.interaction_matrix, self.users, self.products, self.normalized_matrix,
+                             built_at=self.built_at, watermark=watermark, user_ann_index=self.user_ann_index)
+
+    def with_interactions(self, user_ids: np.ndarray, product_ids: np.ndarray, values: np.ndarray,
+                          version: int, watermark: InteractionWatermark) -> Tuple["ModelSnapshot", List[int]]:
+        """
+        將新的互動資料合併進一份新的快照（原快照不變），回傳 (新快照, 受影響的用戶 ID)。
+        新出現的用戶與商品附加在 ID 映射尾端；相同 (user, product) 取最高分數，與完整重建的結果一致。
+        只對出現在新資料中的用戶列取最大值並重新正規化，再將分數有變動的列接回矩陣，
+        其餘列只做整段複製，成本與新資料量成正比，不再對整個矩陣做 maximum 與正規化。
+        重複讀到已套用的資料時沒有任何列變動，回傳只推進水位的快照與空的用戶列表。
+        既有用戶的位置不變，因此沿用同一份用戶 ANN 索引直到下次完整重建；
+        期間新用戶暫時不會被當成鄰居，但仍可查詢自己的鄰居。
+        """
+        users = self.users.extend(user_ids)
+        products = self.products.extend(product_ids)
+        shape = (len(users), len(products))
+
+        user_indices = users.encode(user_ids)
+        rows = np.unique(user_indices)
+        # rows 已排序，既有用戶（位置小於原本的列數）在前，新用戶在後
+        existing_rows = rows[rows < self.interaction_matrix.shape[0]]
+        current = sparse.csr_matrix(self.interaction_matrix[existing_rows], dtype=np.float32)
+        current.resize((rows.size, shape[1]))
+        delta = sparse.csr_matrix((np.asarray(values, dtype=np.float32),
+                                   (np.searchsorted(rows, user_indices), products.encode(product_ids))),
+                                  shape=(rows.size, shape[1]), dtype=np.float32)
+        updated = current.maximum(delta).tocsr()
+        updated.sort_indices()
+
+        changed = np.flatnonzero((updated != current).getnnz(axis=1) > 0)
+        if changed.size == 0:
+            return self.with_watermark(watermark), []
+        updated = updated[changed]
+        changed_rows = rows[changed]
+
+        snapshot = ModelSnapshot(version, _splice_rows(self.interaction_matrix, changed_rows, updated, shape),
+                                 users, products,
+                                 _splice_rows(self.normalized_matrix, changed_rows, normalize_rows(updated), shape),
+                                 watermark=watermark, user_ann_index=self.user_ann_index)
+        return snapshot, users.decode(changed_rows).tolist()
+
+    def for_shard(self, shard_index: int, num_shards: int) -> "ModelSnapshot":
+        """
+        只保留屬於指定分片的用戶列的快照（商品映射與欄位不變），供分片的 scoring worker 使用。
+        item-based / ALS 模式計分只需要目標用戶自己的那一列，不需要其他分片的用戶。
+        """
+        if num_shards <= 1:
+            return self
+        rows = np.flatnonzero(shard_of_users(self.all_user_ids, num_shards) == shard_index)
+        return ModelSnapshot(self.version, self.interaction_matrix[rows], IdEncoder(self.all_user_ids[rows]),
+                             self.products, self.normalized_matrix[rows], built_at=self.built_at,
+                             watermark=self.watermark)
+
+    def __repr__(self) -> str:
+        return (f"ModelSnapshot(version={self.version}, users={len(self.users)}, "
+                f"products={len(self.products)})")
@@ -0,0 +1,570 @@
+import os
+import time
+import threading
+import logging
+import numpy as np
+from typing import Callable, List, Optional
+from sqlalchemy.orm import Session
+
+from ..core.config import settings
+from ..models.db import SessionLocal
+from ..data.data_loader import DataLoader
+from .model_snapshot import ModelSnapshot
+from .recommender_logic import Recommender, ItemBasedRecommender, ALSRecommender
+from .item_similarity import ItemSimilarityIndex
+from .popularity import PopularityIndex
+from .eligibility import FallbackProductSets, ProductCatalog
+from .als import ALSModel
+from .ann import RandomProjectionLSH
+from .artifacts import ModelArtifactStore
+from .sharding import shard_of_user
+
+logger = logging.getLogger(__name__)
+
+# 計分只需要目標用戶自己那一列（加上完整的商品端資料）的模式才能依用戶分片；預設的 user_based 不在其中
+SHARDABLE_MODES = ("item_based", "als")
+# 分片時商品端資料只能離線建立一次，再由各分片以 memory mapping 載入：各模式需要的離線檔案與產生方式
+SHARDED_OFFLINE_MODELS = {
+    "item_based": ("ITEM_INDEX_DIR", ModelArtifactStore.ITEM_INDEX_DIR,
+                   "python -m app.cli build-item-index, or export-model --with-item-index"),
+    "als": ("ALS_MODEL_DIR", ModelArtifactStore.ALS_DIR, "python -m app.cli train-als, or export-model --with-als"),
+}
+
+
+class ModelStore:
+    """
+    進程內共享的模型快照容器。
+
+    - 第一次取用時建立快照，之後所有請求共用同一份，不再於每次快取未命中時掃描整張表。
+    - 背景執行緒定期重建新版本，建好後以單一參照賦值的方式原子替換，
+      正在使用舊快照的請求不受影響。
+    - 兩次完整重建之間，每隔 incremental_interval_seconds 只讀取水位之後的新互動做增量更新，
+      並通知監聽者哪些用戶的資料有變動（例如讓其推薦快取失效）。
+    - 提供 artifact_store 時，快照改由離線發佈的版本化模型檔以 memory mapping 載入，不再掃描資料庫；
+      CURRENT 指向新版本時才重新載入，之間的新互動仍由增量更新補上。
+      注意增量更新會產生進程私有的矩陣副本，需要完全共享 page cache 時可停用增量更新。
+      指定 artifact_version 時固定載入該版本，不跟隨 CURRENT（例如批次工作需要在整次執行中使用同一份模型）。
+    - num_shards > 1 時本進程是第 shard_index 個 scoring 分片：由資料庫建立時只載入雜湊到本分片的用戶列，
+      由模型檔載入時只從 memory map 切出這些列，增量更新也只套用這些用戶的互動；ALS 的用戶因子同樣只保留本分片的用戶。
+      item-item 鄰居表與 ALS 商品因子需要全體用戶的互動，分片時不在進程內建立，必須離線產生一次
+      （ITEM_INDEX_DIR / ALS_MODEL_DIR，或隨模型檔發佈），各分片以 memory mapping 共用。
+      預設的 user_based 模式的鄰居橫跨所有用戶，切分後記憶體與建置時間都不會下降，因此不允許分片，建立時即拋出 ValueError。
+    """
+
+    def __init__(self, session_factory: Callable[[], Session] = SessionLocal,
+                 refresh_interval_seconds: int = settings.MODEL_REFRESH_INTERVAL_SECONDS,
+                 incremental_interval_seconds: int = settings.MODEL_INCREMENTAL_INTERVAL_SECONDS,
+                 artifact_store: Optional[ModelArtifactStore] = None,
+                 artifact_version: Optional[str] = None,
+                 num_shards: int = settings.NUM_SHARDS, shard_index: int = settings.SHARD_INDEX):
+        if num_shards > 1 and not 0 <= shard_index < num_shards:
+            raise ValueError(f"SHARD_INDEX must be between 0 and {num_shards - 1}, got {shard_index}.")
+        if num_shards > 1 and settings.RECOMMENDER_MODE not in SHARDABLE_MODES:
+            raise ValueError(f"NUM_SHARDS={num_shards} requires RECOMMENDER_MODE to be one of "
+                             f"{', '.join(SHARDABLE_MODES)}, got {settings.RECOMMENDER_MODE}. The default user_based mode "
+                             f"scores against neighbours from every user and cannot be sharded.")
+        if num_shards > 1 and artifact_store is None:
+            setting, _, hint = SHARDED_OFFLINE_MODELS[settings.RECOMMENDER_MODE]
+            if not os.path.isdir(getattr(settings, setting)):
+                raise ValueError(f"Sharded {settings.RECOMMENDER_MODE} workers load the item-side model built offline "
+                                 f"from all users, but {setting}={getattr(settings, setting)} does not exist; "
+                                 f"build it once with {hint}.")
+        self._session_factory = session_factory
+        self._num_shards = num_shards
+        self._shard_index = shard_index
+        self._artifact_store = artifact_store
+        self._artifact_version = artifact_version
+        self._artifact_name: Optional[str] = None
+        self._refresh_interval_seconds = refresh_interval_seconds
+        self._incremental_interval_seconds = incremental_interval_seconds
+        self._update_listeners: List[Callable[[List[int]], None]] = []
+        self._snapshot: Optional[ModelSnapshot] = None
+        self._item_index: Optional[ItemSimilarityIndex] = None
+        self._popularity: Optional[PopularityIndex] = None
+        self._catalog: Optional[ProductCatalog] = None
+        # catalog 從未載入成功時，各請求共用的備援篩選資料
+        self._fallback_sets = FallbackProductSets(ttl_seconds=settings.CATALOG_FALLBACK_TTL_SECONDS)
+        self._als_model: Optional[ALSModel] = None
+        self._item_ann_index: Optional[RandomProjectionLSH] = None
+        # 沒有離線檔案時由快照即時建立的鄰居表 / ALS 因子，需隨每次完整重建一併重建
+        self._item_index_in_memory = False
+        self._als_model_in_memory = False
+        self._ann_lock = threading.Lock()
+        self._version = 0
+        # 確保同一時間只有一個建置在跑，避免並發的快取未命中各自觸發全表掃描
+        self._build_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._refresh_thread: Optional[threading.Thread] = None
+
+    @property
+    def is_sharded(self) -> bool:
+        return self._num_shards > 1
+
+    @property
+    def num_shards(self) -> int:
+        return self._num_shards
+
+    @property
+    def shard_index(self) -> int:
+        return self._shard_index
+
+    def owns_user(self, user_id: int) -> bool:
+        """用戶是否雜湊到本分片；未分片時永遠為 True。"""
+        return not self.is_sharded or shard_of_user(user_id, self._num_shards) == self._shard_index
+
+    @property
+    def snapshot(self) -> Optional[ModelSnapshot]:
+        return self._snapshot
+
+    @property
+    def artifact_store(self) -> Optional[ModelArtifactStore]:
+        return self._artifact_store
+
+    @property
+    def artifact_name(self) -> Optional[str]:
+        """目前快照載入自哪個已發佈的模型檔版本；由資料庫建立時為 None。"""
+        return self._artifact_name
+
+    @property
+    def popularity(self) -> Optional[PopularityIndex]:
+        return self._popularity
+
+    @property
+    def catalog(self) -> Optional[ProductCatalog]:
+        return self._catalog
+
+    def get_snapshot(self, db: Optional[Session] = None) -> ModelSnapshot:
+        """取得目前的快照；若尚未建立，則由第一個呼叫者建立，其餘呼叫者等待其結果。"""
+        snapshot = self._snapshot
+        if snapshot is not None:
+            return snapshot
+
+        with self._build_lock:
+            if self._snapshot is None:
+                self._snapshot = self._build(db)
+            return self._snapshot
+
+    def get_item_index(self, db: Optional[Session] = None) -> ItemSimilarityIndex:
+        """
+        取得 item-item 鄰居表：優先以 memory mapping 載入離線批次產生的索引，
+        不存在時才由目前快照即時建立一份（僅保存在記憶體中）。
+        """
+        item_index = self._item_index
+        if item_index is not None:
+            return item_index
+
+        with self._build_lock:
+            if self._item_index is None:
+                if os.path.isdir(settings.ITEM_INDEX_DIR):
+                    self._item_index = ItemSimilarityIndex.load(settings.ITEM_INDEX_DIR)
+                else:
+                    if self._snapshot is None:
+                        self._snapshot = self._build(db)
+                    # _build 已建立，或由模型檔一併載入
+                    if self._item_index is None:
+                        self._check_offline_model()
+                        logger.warning(f"Item index not found at {settings.ITEM_INDEX_DIR}, building it in memory.")
+                        self._item_index = self._build_item_index(self._snapshot)
+                        self._item_index_in_memory = True
+            return self._item_index
+
+    def get_popularity(self, db: Optional[Session] = None) -> Optional[PopularityIndex]:
+        """取得預先計算的熱門排行；尚未建立時由第一個呼叫者建立。建立失敗時回傳 None，改由資料庫查詢備援。"""
+        popularity = self._popularity
+        if popularity is not None:
+            return popularity
+
+        with self._build_lock:
+            if self._popularity is None:
+                try:
+                    self._popularity = self._build_popularity(db)
+                except Exception as e:
+                    logger.error(f"Popularity index build failed: {e}")
+            return self._popularity
+
+    def get_catalog(self, db: Optional[Session] = None) -> Optional[ProductCatalog]:
+        """取得商品庫存與分類遮罩的來源；尚未載入時由第一個呼叫者載入。載入失敗時回傳 None，不做篩選。"""
+        catalog = self._catalog
+        if catalog is not None:
+            return catalog
+
+        with self._build_lock:
+            if self._catalog is None:
+                try:
+                    self._catalog = self._build_catalog(db)
+                except Exception as e:
+                    logger.error(f"Product catalog build failed: {e}")
+            return self._catalog
+
+    def reload_item_index(self) -> None:
+        """捨棄目前的 item-item 鄰居表，下次取用時重新載入（例如批次工作產生新索引後）。"""
+        self._item_index = None
+        self._item_index_in_memory = False
+
+    def get_als_model(self, db: Optional[Session] = None) -> ALSModel:
+        """
+        取得 ALS 模型：優先以 memory mapping 載入離線訓練的因子，
+        不存在時才由目前快照即時訓練一份（僅保存在記憶體中）。
+        """
+        als_model = self._als_model
+        if als_model is not None:
+            return als_model
+
+        with self._build_lock:
+            if self._als_model is None:
+                if os.path.isdir(settings.ALS_MODEL_DIR):
+                    self._als_model = self._shard_als_model(ALSModel.load(settings.ALS_MODEL_DIR))
+                else:
+                    if self._snapshot is None:
+                        self._snapshot = self._build(db)
+                    if self._als_model is None:
+                        self._check_offline_model()
+                        logger.warning(f"ALS model not found at {settings.ALS_MODEL_DIR}, training it in memory.")
+                        self._als_model = self._train_als_model(self._snapshot)
+                        self._als_model_in_memory = True
+            return self._als_model
+
+    def reload_als_model(self) -> None:
+        """捨棄目前的 ALS 模型，下次取用時重新載入（例如離線訓練產生新因子後）。"""
+        self._als_model = None
+        self._als_model_in_memory = False
+        self._item_ann_index = None
+
+    @staticmethod
+    def get_user_ann_index(snapshot: ModelSnapshot) -> Optional[RandomProjectionLSH]:
+        """
+        取得快照的用戶 ANN 索引（ANN_ENABLED 時）。索引在建立快照時一併建立（或隨模型檔載入），
+        與快照一起替換，請求路徑只讀取不建立。
+        """
+        if not settings.ANN_ENABLED or snapshot.is_empty:
+            return None
+        return snapshot.user_ann_index
+
+    def get_item_ann_index(self, als_model: ALSModel) -> Optional[RandomProjectionLSH]:
+        """取得建立在 ALS 商品因子上的 ANN 索引（ANN_ENABLED 時），隨模型重新載入而重建。"""
+        if not settings.ANN_ENABLED:
+            return None
+        ann_index = self._item_ann_index
+        if ann_index is not None:
+            return ann_index
+
+        with self._ann_lock:
+            if self._item_ann_index is None:
+                self._item_ann_index = RandomProjectionLSH.build(np.asarray(als_model.item_factors),
+                                                                 num_tables=settings.ANN_NUM_TABLES,
+                                                                 num_bits=settings.ANN_NUM_BITS)
+            return self._item_ann_index
+
+    def create_recommender(self, db: Session) -> Recommender:
+        """依 RECOMMENDER_MODE 建立使用共享快照的推薦器。"""
+        snapshot = self.get_snapshot(db)
+        popularity = self.get_popularity(db)
+        catalog = self.get_catalog(db)
+        if settings.RECOMMENDER_MODE == "item_based":
+            return ItemBasedRecommender(db, snapshot=snapshot, item_index=self.get_item_index(db), popularity=popularity,
+                                        catalog=catalog, fallback_sets=self._fallback_sets)
+        if settings.RECOMMENDER_MODE == "als":
+            als_model = self.get_als_model(db)
+            return ALSRecommender(db, snapshot=snapshot, als_model=als_model, popularity=popularity,
+                                  ann_index=self.get_item_ann_index(als_model), catalog=catalog,
+                                  fallback_sets=self._fallback_sets)
+        return Recommender(db, snapshot=snapshot, popularity=popularity, ann_index=self.get_user_ann_index(snapshot),
+                           catalog=catalog, fallback_sets=self._fallback_sets)
+
+    def refresh(self, db: Optional[Session] = None) -> ModelSnapshot:
+        """重建快照並原子替換目前版本（即時建立的鄰居表 / ALS 因子一併重建）。建置失敗時保留舊快照。"""
+        with self._build_lock:
+            if self._snapshot is not None and self._artifact_name is not None and not self._artifact_changed():
+                # 已載入目前發佈的模型檔版本，之後的資料由增量更新補上
+                return self._snapshot
+            try:
+                self._snapshot = self._build(db)
+            except Exception as e:
+                logger.error(f"Model snapshot refresh failed, keeping version "
+                             f"{self._snapshot.version if self._snapshot else None}: {e}")
+                if self._snapshot is None:
+                    raise
+            return self._snapshot
+
+    def refresh_popularity(self, db: Optional[Session] = None) -> Optional[PopularityIndex]:
+        """重新計算熱門排行並原子替換。失敗時保留舊排行。"""
+        try:
+            popularity = self._build_popularity(db)
+        except Exception as e:
+            logger.error(f"Popularity index refresh failed, keeping previous ranking: {e}")
+            return self._popularity
+        self._popularity = popularity
+        return popularity
+
+    def set_popularity(self, popularity: Optional[PopularityIndex]) -> None:
+        """直接使用外部計算好的熱門排行（例如批次工作的進程由父進程傳入），不再查詢資料庫。"""
+        self._popularity = popularity
+
+    def refresh_catalog(self, db: Optional[Session] = None) -> Optional[ProductCatalog]:
+        """重新載入商品庫存與分類並原子替換；各商品索引的遮罩在下次取用時重新對齊。失敗時保留舊資料。"""
+        try:
+            catalog = self._build_catalog(db)
+        except Exception as e:
+            logger.error(f"Product catalog refresh failed, keeping previous masks: {e}")
+            return self._catalog
+        self._catalog = catalog
+        return catalog
+
+    def set_catalog(self, catalog: Optional[ProductCatalog]) -> None:
+        """直接使用外部載入的商品資料（例如批次工作的進程由父進程傳入），不再查詢資料庫。"""
+        self._catalog = catalog
+
+    def open_session(self) -> Session:
+        """開啟一個新的資料庫 session，供請求結束後仍在執行的背景工作使用，呼叫端負責關閉。"""
+        return self._session_factory()
+
+    def add_update_listener(self, listener: Callable[[List[int]], None]) -> None:
+        """註冊增量更新後的回呼，參數為資料有變動的用戶 ID。"""
+        self._update_listeners.append(listener)
+
+    def refresh_incremental(self, db: Optional[Session] = None) -> List[int]:
+        """
+        只讀取目前快照水位之後（加上水位以下 MODEL_INCREMENTAL_OVERLAP_IDS 個 id）的互動並套用到互動矩陣，
+        回傳分數有變動的用戶 ID。
+        尚未有快照時改做一次完整建置。
+        """
+        if self._snapshot is None:
+            self.get_snapshot(db)
+            return []
+
+        owns_session = db is None
+        if owns_session:
+            db = self._session_factory()
+        try:
+            with self._build_lock:
+                snapshot = self._snapshot
+                data_loader = self._data_loader(db)
+                watermark = data_loader.get_watermark()
+                overlap = settings.MODEL_INCREMENTAL_OVERLAP_IDS
+                if watermark == snapshot.watermark and overlap <= 0:
+                    return []
+
+                # id 在插入時配置，提交順序不一定相同：上次讀取後才提交、id 卻低於水位的資料只靠重讀水位以下的一段 id 補上，
+                # 所以即使最大 id 沒有變動也要重讀。重複讀到的資料經取最大值合併後不會改變矩陣，也不會被當成受影響的用戶
+                since = snapshot.watermark.rewind(overlap)
+                user_ids, product_ids, values = data_loader.load_interaction_triples(since=since, until=watermark)
+                if values.size == 0:
+                    self._snapshot = snapshot.with_watermark(watermark)
+                    return []
+
+                version = self._version + 1
+                self._snapshot, affected_user_ids = snapshot.with_interactions(user_ids, product_ids, values, version, watermark)
+                if not affected_user_ids:
+                    return []
+                self._version = version
+                logger.info(f"Applied {values.size} new interactions to {self._snapshot}, "
+                            f"{len(affected_user_ids)} users affected.")
+        finally:
+            if owns_session:
+                db.close()
+
+        for listener in self._update_listeners:
+            try:
+                listener(affected_user_ids)
+            except Exception as e:
+                logger.error(f"Model update listener failed: {e}")
+        return affected_user_ids
+
+    def _artifact_changed(self) -> bool:
+        if self._artifact_store is None or self._artifact_version is not None:
+            return False
+        current = self._artifact_store.current_version()
+        return current is not None and current != self._artifact_name
+
+    def _load_artifact(self) -> Optional[ModelSnapshot]:
+        if self._artifact_store is None:
+            return None
+        artifact = self._artifact_store.load(self._artifact_version, version=self._version + 1)
+        if artifact is None:
+            return None
+        self._version = artifact.snapshot.version
+        self._artifact_name = artifact.name
+        # 同一版本一併發佈的鄰居表與 ALS 因子優先於各自的獨立目錄
+        if artifact.item_index is not None:
+            self._item_index = artifact.item_index
+            self._item_index_in_memory = False
+        if artifact.als_model is not None:
+            self._als_model = self._shard_als_model(artifact.als_model)
+            self._als_model_in_memory = False
+            self._item_ann_index = None
+        return artifact.snapshot
+
+    def _build(self, db: Optional[Session]) -> ModelSnapshot:
+        snapshot = self._build_full(db)
+        self._build_in_memory_models(snapshot)
+        return snapshot
+
+    def _data_loader(self, db: Session) -> DataLoader:
+        return DataLoader(db, num_shards=self._num_shards, shard_index=self._shard_index)
+
+    def _check_offline_model(self) -> None:
+        """分片只有本分片的用戶，不能由快照建立需要全體用戶互動的鄰居表 / ALS 因子。"""
+        if self.is_sharded:
+            setting, artifact_dir, hint = SHARDED_OFFLINE_MODELS[settings.RECOMMENDER_MODE]
+            raise RuntimeError(f"Sharded {settings.RECOMMENDER_MODE} workers need the item-side model built offline "
+                               f"from all users: none found in {setting} or the model artifact's {artifact_dir}/; "
+                               f"build it once with {hint}.")
+
+    def _build_in_memory_models(self, snapshot: ModelSnapshot) -> None:
+        """
+        沒有離線檔案時，以新的完整快照重建鄰居表 / ALS 因子，避免用戶快照換版後仍搭配第一個版本的鄰居與因子。
+        離線檔案或模型檔一併發佈的版本不在此重建；分片只有本分片的用戶，一律使用離線檔案，缺少時拋出 RuntimeError。
+        全部建立成功後才替換，任一步失敗時由 refresh 保留舊版本。
+        user_based 模式啟用 ANN 時，模型檔未附帶用戶 ANN 索引就在此建立並掛在新快照上，隨快照一起替換。
+        """
+        if self.is_sharded:
+            setting = SHARDED_OFFLINE_MODELS[settings.RECOMMENDER_MODE][0]
+            loaded = self._item_index if settings.RECOMMENDER_MODE == "item_based" else self._als_model
+            if loaded is None and not os.path.isdir(getattr(settings, setting)):
+                self._check_offline_model()
+            return
+
+        if settings.RECOMMENDER_MODE == "user_based" and settings.ANN_ENABLED and not snapshot.is_empty \
+                and snapshot.user_ann_index is None:
+            snapshot.user_ann_index = self._build_user_ann_index(snapshot)
+
+        item_index = als_model = None
+        if settings.RECOMMENDER_MODE == "item_based" and (self._item_index is None or self._item_index_in_memory) \
+                and not os.path.isdir(settings.ITEM_INDEX_DIR):
+            item_index = self._build_item_index(snapshot)
+        if settings.RECOMMENDER_MODE == "als" and (self._als_model is None or self._als_model_in_memory) \
+                and not os.path.isdir(settings.ALS_MODEL_DIR):
+            als_model = self._train_als_model(snapshot)
+
+        if item_index is not None:
+            self._item_index = item_index
+            self._item_index_in_memory = True
+        if als_model is not None:
+            self._als_model = als_model
+            self._als_model_in_memory = True
+            self._item_ann_index = None
+
+    def _shard(self, snapshot: ModelSnapshot) -> ModelSnapshot:
+        # 模型檔包含所有用戶；從 memory map 只切出本分片的列
+        if not self.is_sharded:
+            return snapshot
+        shard_snapshot = snapshot.for_shard(self._shard_index, self._num_shards)
+        logger.info(f"Serving shard {self._shard_index}/{self._num_shards}: {shard_snapshot}.")
+        return shard_snapshot
+
+    def _shard_als_model(self, als_model: ALSModel) -> ALSModel:
+        # 商品因子仍為完整一份；用戶因子只保留本分片的列
+        return als_model.for_shard(self._shard_index, self._num_shards) if self.is_sharded else als_model
+
+    def _build_full(self, db: Optional[Session]) -> ModelSnapshot:
+        try:
+            snapshot = self._load_artifact()
+        except Exception as e:
+            logger.error(f"Loading model artifact failed, building from the database instead: {e}")
+            snapshot = None
+        if snapshot is not None:
+            return self._shard(snapshot)
+
+        owns_session = db is None
+        if owns_session:
+            db = self._session_factory()
+        try:
+            version = self._version + 1
+            # 分片時只載入本分片的用戶，不在記憶體中建立完整的互動矩陣
+            snapshot = Recommender(db, data_loader=self._data_loader(db)).build_snapshot(version)
+            self._version = version
+            logger.info(f"Built {snapshot}" + (f" for shard {self._shard_index}/{self._num_shards}."
+                                              if self.is_sharded else "."))
+            return snapshot
+        finally:
+            if owns_session:
+                db.close()
+
+    @staticmethod
+    def _build_user_ann_index(snapshot: ModelSnapshot) -> RandomProjectionLSH:
+        return RandomProjectionLSH.build(snapshot.normalized_matrix, num_tables=settings.ANN_NUM_TABLES,
+                                         num_bits=settings.ANN_NUM_BITS)
+
+    @staticmethod
+    def _build_item_index(snapshot: ModelSnapshot) -> ItemSimilarityIndex:
+        return ItemSimilarityIndex.build(snapshot.interaction_matrix, snapshot.all_product_ids,
+                                         num_neighbours=settings.ITEM_NEIGHBOURS)
+
+    @staticmethod
+    def _train_als_model(snapshot: ModelSnapshot) -> ALSModel:
+        return ALSModel.train(snapshot.interaction_matrix, snapshot.all_user_ids,
+                              snapshot.all_product_ids, factors=settings.ALS_FACTORS,
+                              regularization=settings.ALS_REGULARIZATION,
+                              alpha=settings.ALS_ALPHA, iterations=settings.ALS_ITERATIONS,
+                              num_threads=settings.ALS_TRAINING_THREADS)
+
+    def _build_catalog(self, db: Optional[Session]) -> ProductCatalog:
+        owns_session = db is None
+        if owns_session:
+            db = self._session_factory()
+        try:
+            return ProductCatalog.build(db)
+        finally:
+            if owns_session:
+                db.close()
+
+    def _build_popularity(self, db: Optional[Session]) -> PopularityIndex:
+        owns_session = db is None
+        if owns_session:
+            db = self._session_factory()
+        try:
+            return PopularityIndex.build(db, half_life_days=settings.POPULARITY_HALF_LIFE_DAYS)
+        finally:
+            if owns_session:
+                db.close()
+
+    def start_background_refresh(self) -> None:
+        if self._refresh_interval_seconds <= 0:
+            logger.info("Background model refresh disabled.")
+            return
+        if self._refresh_thread is not None and self._refresh_thread.is_alive():
+            return
+
+        self._stop_event.clear()
+        self._refresh_thread = threading.Thread(target=self._refresh_loop, name="model-refresher", daemon=True)
+        self._refresh_thread.start()
+        logger.info(f"Background model refresh started (full every {self._refresh_interval_seconds}s, "
+                    f"incremental every {self._incremental_interval_seconds}s).")
+
+    def stop_background_refresh(self) -> None:
+        self._stop_event.set()
+        if self._refresh_thread is not None:
+            self._refresh_thread.join(timeout=5)
+            self._refresh_thread = None
+
+    def _refresh_loop(self) -> None:
+        # 啟動時先建好第一版，讓第一個請求不必等待建置
+        last_full_refresh = 0.0
+        last_incremental_refresh = 0.0
+        last_popularity_refresh = 0.0
+        incremental_enabled = 0 < self._incremental_interval_seconds < self._refresh_interval_seconds
+        wait_seconds = self._incremental_interval_seconds if incremental_enabled else self._refresh_interval_seconds
+        popularity_interval = settings.POPULARITY_REFRESH_INTERVAL_SECONDS
+        if popularity_interval > 0:
+            wait_seconds = min(wait_seconds, popularity_interval)
+        last_catalog_refresh = 0.0
+        catalog_interval = settings.CATALOG_REFRESH_INTERVAL_SECONDS
+        if catalog_interval > 0:
+            wait_seconds = min(wait_seconds, catalog_interval)
+        while not self._stop_event.is_set():
+            try:
+                if time.time() - last_full_refresh >= self._refresh_interval_seconds or self._artifact_changed():
+                    self.refresh()
+                    last_full_refresh = last_incremental_refresh = time.time()
+                elif incremental_enabled and time.time() - last_incremental_refresh >= self._incremental_interval_seconds:
+                    self.refresh_incremental()
+                    last_incremental_refresh = time.time()
+            except Exception as e:
+                logger.error(f"Background model refresh error: {e}")
+            if popularity_interval > 0 and time.time() - last_popularity_refresh >= popularity_interval:
+                self.refresh_popularity()
+                last_popularity_refresh = time.time()
+            if catalog_interval > 0 and time.time() - last_catalog_refresh >= catalog_interval:
+                self.refresh_catalog()
+                last_catalog_refresh = time.time()
+            self._stop_event.wait(wait_seconds)
@@ -0,0 +1,109 @@
+import time
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from typing import Callable, Dict, Iterable, List, Optional
+import logging
+
+from ..models.order import OrderItem
+from ..models.product import Product
+
+logger = logging.getLogger(__name__)
+
+
+class PopularityIndex:
+    """
+    預先計算的熱門商品排行，供冷啟動與協同過濾無結果時的備援使用。
+
+    以每日銷量做時間衰減加總（half_life_days 天前的銷量權重為一半），
+    沒有銷量的商品依 ID 順序排在後面補齊；另外依分類各保留一份排行。
+    線上取用只是陣列切片，不需要掃描 order_items。
+    """
+
+    def __init__(self, ranked_product_ids: np.ndarray, category_rankings: Dict[int, np.ndarray],
+                 built_at: Optional[float] = None):
+        self.ranked_product_ids = ranked_product_ids
+        self.category_rankings = category_rankings
+        self.built_at = built_at if built_at is not None else time.time()
+
+    def __repr__(self) -> str:
+        return (f"PopularityIndex(products={self.ranked_product_ids.size}, "
+                f"categories={len(self.category_rankings)})")
+
+    @property
+    def age_seconds(self) -> float:
+        return time.time() - self.built_at
+
+    @classmethod
+    def build(cls, db: Session, half_life_days: float = 0, now: Optional[pd.Timestamp] = None) -> "PopularityIndex":
+        """
+        從資料庫建立排行：order_items 先在資料庫端依 (商品, 日期) 加總數量，
+        衰減只在這份彙總結果上計算。half_life_days <= 0 表示不衰減（即總銷量）。
+        """
+        sales_rows = db.execute(
+            select(OrderItem.product_id, func.date(OrderItem.created_at), func.sum(OrderItem.quantity))
+            .where(OrderItem.product_id.isnot(None))
+            .group_by(OrderItem.product_id, func.date(OrderItem.created_at))
+        ).all()
+        product_rows = db.execute(select(Product.id, Product.category_id).order_by(Product.id)).all()
+
+        product_ids = np.array([row[0] for row in product_rows], dtype=np.int64)
+        category_ids = np.array([row[1] if row[1] is not None else -1 for row in product_rows], dtype=np.int64)
+        scores = np.zeros(product_ids.size, dtype=np.float64)
+
+        if sales_rows and product_ids.size:
+            sold_product_ids = np.array([row[0] for row in sales_rows], dtype=np.int64)
+            quantities = np.array([row[2] or 0 for row in sales_rows], dtype=np.float64)
+            if half_life_days > 0:
+                sale_dates = pd.to_datetime(pd.Series([row[1] for row in sales_rows]), errors='coerce')
+                now = now if now is not None else pd.Timestamp.now()
+                age_days = ((now - sale_dates).dt.total_seconds() / 86400.0).fillna(0).clip(lower=0).to_numpy()
+                quantities = quantities * np.power(0.5, age_days / half_life_days)
+
+            positions = np.searchsorted(product_ids, sold_product_ids)
+            positions = np.minimum(positions, product_ids.size - 1)
+            known = product_ids[positions] == sold_product_ids
+            np.add.at(scores, positions[known], quantities[known])
+
+        # 分數由高到低；同分（包含沒有銷量的商品）依 ID 由小到大
+        order = np.lexsort((product_ids, -scores))
+        ranked_product_ids = product_ids[order]
+        ranked_category_ids = category_ids[order]
+
+        category_rankings = {
+            int(category_id): ranked_product_ids[ranked_category_ids == category_id]
+            for category_id in np.unique(ranked_category_ids) if category_id >= 0
+        }
+        index = cls(ranked_product_ids, category_rankings)
+        logger.info(f"Built {index} from {len(sales_rows)} daily sales rows.")
+        return index
+
+    def top(self, num_recommendations: int, category_id: Optional[int] = None,
+            exclude: Optional[Iterable[int]] = None,
+            eligible: Optional[Callable[[np.ndarray], np.ndarray]] = None) -> List[int]:
+        """
+        回傳前 num_recommendations 個熱門商品 ID，可限定分類並排除指定商品。
+        eligible 接收一段排行（商品 ID 陣列）並回傳布林遮罩，例如只保留有庫存的商品；
+        依排行順序逐段（每段加倍）檢查，通常只需檢查排行的開頭。
+        """
+        if category_id is None:
+            ranked = self.ranked_product_ids
+        else:
+            ranked = self.category_rankings.get(category_id, self.ranked_product_ids[:0])
+
+        if not exclude and eligible is None:
+            return ranked[:num_recommendations].tolist()
+
+        excluded = np.fromiter(exclude, dtype=np.int64) if exclude else None
+        result: List[int] = []
+        start, chunk_size = 0, max(4 * num_recommendations, 64)
+        while len(result) < num_recommendations and start < ranked.size:
+            chunk = np.asarray(ranked[start:start + chunk_size])
+            keep = eligible(chunk) if eligible is not None else np.ones(chunk.size, dtype=bool)
+            if excluded is not None:
+                keep &= ~np.isin(chunk, excluded)
+            result.extend(chunk[keep].tolist())
+            start += chunk_size
+            chunk_size *= 2
+        return result[:num_recommendations]
@@ -0,0 +1,253 @@
+import os
+import json
+import shutil
+import tempfile
+import time
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from redis import BlockingConnectionPool, Redis
+from sqlalchemy.orm import Session
+from typing import Callable, Dict, List, Optional, Set, Tuple
+import logging
+
+from ..core.config import settings
+from ..core.connections import redis_pool_options
+from ..models.db import SessionLocal
+from ..data.data_loader import InteractionWatermark
+from .artifacts import ModelArtifactStore
+from .model_snapshot import ModelSnapshot
+from .model_store import ModelStore
+from .popularity import PopularityIndex
+from .eligibility import ProductCatalog
+from .recommendation_cache import recommendation_cache_key
+from .sharding import shard_of_users
+
+logger = logging.getLogger(__name__)
+
+
+def create_redis_client() -> Redis:
+    """每個預先計算程序各自建立一個 client，連線池大小、逾時與重試設定與服務共用。"""
+    return Redis(connection_pool=BlockingConnectionPool(**redis_pool_options()))
+
+
+class PrecomputeCheckpoint:
+    """
+    批次預先計算的進度檔，用於中斷後續跑。
+
+    第一行為本次工作的設定（模型版本與資料水位、分片、區塊大小、深度）與建立時間，
+    之後每完成一個區塊附加一行區塊編號。
+    只做附加寫入並 fsync，程序在任何時間點當掉都不會毀損已記錄的進度；
+    續跑時設定不一致（例如發佈了新的模型檔或有新的互動資料），或進度檔已超過 max_age_seconds，
+    則捨棄舊進度重新開始，避免以舊資料的進度略過用戶。
+    """
+
+    def __init__(self, path: Optional[str], signature: Dict,
+                 max_age_seconds: float = settings.PRECOMPUTE_CHECKPOINT_MAX_AGE_SECONDS):
+        self.path = path
+        self.signature = signature
+        self.max_age_seconds = max_age_seconds
+        self.completed: Set[int] = set()
+        self._file = None
+
+    def _is_resumable(self, header: Dict) -> bool:
+        if header.get("signature") != self.signature:
+            return False
+        age = time.time() - header.get("created_at", 0)
+        return self.max_age_seconds <= 0 or age <= self.max_age_seconds
+
+    def open(self) -> Set[int]:
+        """讀取既有進度並開啟附加寫入，回傳已完成的區塊編號。"""
+        if not self.path:
+            return self.completed
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                lines = f.read().splitlines()
+            if lines and self._is_resumable(json.loads(lines[0])):
+                # 最後一行可能在寫入途中被中斷，只採用完整的數字行
+                self.completed = {int(line) for line in lines[1:] if line.strip().isdigit()}
+                logger.info(f"Resuming precompute from {self.path}: {len(self.completed)} blocks already done.")
+            else:
+                logger.warning(f"Checkpoint {self.path} belongs to a different or expired run, starting over.")
+                os.remove(self.path)
+
+        if not os.path.exists(self.path):
+            with open(self.path, "w") as f:
+                f.write(json.dumps({"signature": self.signature, "created_at": time.time()}) + "\n")
+        self._file = open(self.path, "a")
+        return self.completed
+
+    def mark_done(self, block: int) -> None:
+        self.completed.add(block)
+        if self._file is not None:
+            self._file.write(f"{block}\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def finish(self) -> None:
+        """全部區塊完成後刪除進度檔，下一次執行重新計算所有用戶。"""
+        self.close()
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+# 每個工作進程各自持有的模型與 Redis 連線，由 _init_worker 建立
+_worker_model_store: Optional[ModelStore] = None
+_worker_redis: Optional[Redis] = None
+
+
+def _init_worker(artifact_root: str, artifact_name: str, popularity: Optional[PopularityIndex],
+                 catalog: Optional[ProductCatalog], redis_factory: Callable[[], Redis],
+                 session_factory: Optional[Callable[[], Session]] = None) -> None:
+    global _worker_model_store, _worker_redis
+    # 以 memory mapping 開啟同一份模型檔，所有工作進程共用 page cache，不必各自掃描資料庫；
+    # 資料庫只在父進程沒有熱門排行可傳入時，用於冷啟動備援
+    _worker_model_store = ModelStore(session_factory=session_factory or SessionLocal, refresh_interval_seconds=0,
+                                     incremental_interval_seconds=0,
+                                     artifact_store=ModelArtifactStore(artifact_root), artifact_version=artifact_name,
+                                     num_shards=1)
+    _worker_model_store.set_popularity(popularity)
+    _worker_model_store.set_catalog(catalog)
+    _worker_redis = redis_factory()
+
+
+def _score_block(block: int, user_ids: List[int], depth: int, ttl_seconds: int) -> int:
+    """對一個區塊的用戶做一次向量化計分，並以單一 pipeline 寫回 Redis，回傳寫入筆數。"""
+    # 沒有熱門排行時，沒有協同過濾結果的用戶需要查詢資料庫備援；create_recommender 會以這個 session
+    # 建立一次熱門排行，之後的區塊直接使用。沒有 catalog 時庫存條件也改由資料庫查詢
+    needs_db = _worker_model_store.popularity is None or _worker_model_store.catalog is None
+    db = _worker_model_store.open_session() if needs_db else None
+    try:
+        recommendations = _worker_model_store.create_recommender(db).rank_for_users(user_ids, depth)
+    finally:
+        if db is not None:
+            db.close()
+    pipeline = _worker_redis.pipeline(transaction=False)
+    written = 0
+    for user_id, ranked in recommendations.items():
+        if ranked.size:
+            pipeline.set(recommendation_cache_key(user_id), ranked.encode(), ex=ttl_seconds)
+            written += 1
+    pipeline.execute()
+    return written
+
+
+def _published_artifact(model_store: ModelStore, snapshot: ModelSnapshot) -> Optional[Tuple[str, str]]:
+    """
+    快照直接載入自已發佈的模型檔（之後沒有套用增量更新），且該版本包含推薦模式需要的鄰居表 / 因子時，
+    回傳 (模型檔根目錄, 版本名稱)，工作進程直接開啟該版本，不必再發佈一份暫存模型。
+    """
+    artifact_store, name = model_store.artifact_store, model_store.artifact_name
+    if artifact_store is None or name is None or not os.path.isdir(artifact_store.version_path(name)):
+        return None
+    meta = artifact_store.read_meta(name)
+    if InteractionWatermark(*meta.get("watermark", [0, 0])) != snapshot.watermark:
+        return None
+    required = {"item_based": artifact_store.ITEM_INDEX_DIR, "als": artifact_store.ALS_DIR}.get(settings.RECOMMENDER_MODE)
+    if required is not None and not os.path.isdir(os.path.join(artifact_store.version_path(name), required)):
+        return None
+    return artifact_store.root, name
+
+
+def precompute_recommendations(model_store: ModelStore, num_recommendations: int = 5,
+                               block_size: int = 1000, num_workers: int = 0,
+                               shard: int = 0, num_shards: int = 1,
+                               ttl_seconds: int = None, checkpoint_path: Optional[str] = None,
+                               redis_factory: Callable[[], Redis] = create_redis_client,
+                               session_factory: Optional[Callable[[], Session]] = None,
+                               log_interval_seconds: float = 10.0) -> Dict[str, float]:
+    """
+    為模型中所有有互動資料的用戶（或雜湊到第 shard 個分片的子集）預先計算推薦並寫入 Redis。
+    分片方式與線上的路由前端相同（shard_of_users），各分片只預熱自己負責的用戶。
+
+    用戶依 ID 排序後切成固定大小的區塊，每個區塊以批次計分完成；num_workers > 0 時以進程池平行處理，
+    各進程以 memory mapping 開啟同一份模型檔：快照載入自已發佈的版本時直接使用該版本，否則發佈一份暫存模型。
+    完成的區塊記錄在 checkpoint_path，以相同的模型與資料續跑時可略過已完成的區塊。
+    session_factory 只供熱門排行無法建立時的資料庫備援使用，預設為 SessionLocal（num_workers > 0 時需可 pickle）。
+    回傳統計資料（用戶數、寫入數、耗時、每秒用戶數）。
+    """
+    ttl_seconds = ttl_seconds or settings.PRECOMPUTE_CACHE_TTL_SECONDS
+    # 與線上快取相同，寫入的排序推薦至少有 RECOMMENDATION_CACHE_DEPTH 名
+    depth = max(num_recommendations, settings.RECOMMENDATION_CACHE_DEPTH)
+    start_time = time.time()
+    snapshot = model_store.get_snapshot()
+    all_user_ids = np.sort(snapshot.all_user_ids)
+    user_ids = all_user_ids[shard_of_users(all_user_ids, num_shards) == shard].tolist()
+    blocks = [user_ids[start:start + block_size] for start in range(0, len(user_ids), block_size)]
+
+    # 由資料庫建立的快照版本固定為 1、沒有模型檔名稱，需以資料水位區分不同資料的執行；
+    # 中斷期間有新互動時水位前進，舊進度作廢，避免已完成的區塊以舊資料略過
+    checkpoint = PrecomputeCheckpoint(checkpoint_path, {
+        "artifact": model_store.artifact_name,
+        "model_version": snapshot.version,
+        "watermark": list(snapshot.watermark),
+        "shard": shard,
+        "num_shards": num_shards,
+        "block_size": block_size,
+        "depth": depth,
+    })
+    completed = checkpoint.open()
+    pending = [block for block in range(len(blocks)) if block not in completed]
+    logger.info(f"Precomputing recommendations for {len(user_ids)} users (shard {shard}/{num_shards}) in "
+                f"{len(blocks)} blocks, {len(pending)} pending, {num_workers or 'no'} worker processes.")
+
+    published = _published_artifact(model_store, snapshot)
+    temp_root = None
+    stats = {"users": 0, "written": 0}
+    last_log = time.time()
+    try:
+        if published is not None:
+            artifact_root, artifact_name = published
+            logger.info(f"Workers will load the published model artifact {artifact_name}.")
+        else:
+            # 工作進程所需的模型：目前快照與推薦模式需要的鄰居表 / 因子，發佈到只供本次使用的暫存目錄
+            artifact_root = temp_root = tempfile.mkdtemp(prefix="precompute-")
+            item_index = model_store.get_item_index() if settings.RECOMMENDER_MODE == "item_based" else None
+            als_model = model_store.get_als_model() if settings.RECOMMENDER_MODE == "als" else None
+            artifact_name = ModelArtifactStore(artifact_root).publish(snapshot, item_index=item_index,
+                                                                      als_model=als_model)
+        popularity = model_store.get_popularity()
+        catalog = model_store.get_catalog()
+
+        def record(block: int, written: int) -> None:
+            nonlocal last_log
+            checkpoint.mark_done(block)
+            stats["users"] += len(blocks[block])
+            stats["written"] += written
+            if time.time() - last_log >= log_interval_seconds:
+                last_log = time.time()
+                elapsed = last_log - start_time
+                logger.info(f"Precompute progress: {len(checkpoint.completed)}/{len(blocks)} blocks, "
+                            f"{stats['users']} users, {stats['users'] / max(elapsed, 1e-9):.0f} users/s.")
+
+        if num_workers <= 0:
+            _init_worker(artifact_root, artifact_name, popularity, catalog, redis_factory, session_factory)
+            for block in pending:
+                record(block, _score_block(block, blocks[block], depth, ttl_seconds))
+        else:
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=num_workers, mp_context=context, initializer=_init_worker,
+                                     initargs=(artifact_root, artifact_name, popularity, catalog, redis_factory,
+                                               session_factory)) as executor:
+                futures = {
+                    executor.submit(_score_block, block, blocks[block], depth, ttl_seconds): block
+                    for block in pending
+                }
+                for future in as_completed(futures):
+                    record(futures[future], future.result())
+        checkpoint.finish()
+    finally:
+        checkpoint.close()
+        if temp_root is not None:
+            shutil.rmtree(temp_root, ignore_errors=True)
+
+    elapsed = time.time() - start_time
+    stats.update({"seconds": elapsed, "users_per_second": stats["users"] / max(elapsed, 1e-9)})
+    logger.info(f"Precomputed {stats['users']} users ({stats['written']} cached) in {elapsed:.2f} seconds, "
+                f"{stats['users_per_second']:.0f} users/s.")
+    return stats
@@ -0,0 +1,120 @@
+import collections
+import os
+import sys
+import threading
+import time
+from typing import Callable, Deque, List, Optional, Tuple
+import logging
+
+from .metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+SLOW_REQUESTS = REGISTRY.counter(
+    "http_slow_requests_total",
+    "Requests slower than the profiling threshold, by route.",
+    ["route"]
+)
+
+# 閒置中的執行緒（等待工作、等待 I/O）停在這些檔案裡，取樣時略過
+_IDLE_FILES = ("threading.py", "selectors.py", "queue.py", os.path.join("concurrent", "futures", "thread.py"))
+
+SlowRequestListener = Callable[[str, float, List[Tuple[str, int]]], None]
+
+
+class SlowRequestProfiler:
+    """
+    慢請求的取樣式 profiler。
+
+    有請求在處理時，背景執行緒每 interval_seconds 以 sys._current_frames() 擷取所有執行緒的呼叫堆疊，
+    存入固定大小的環狀緩衝；請求超過 threshold_seconds 時，彙總其處理期間的樣本，
+    將最常出現的堆疊交給 listener（預設寫入 warning log）。
+    取樣涵蓋整個進程，因此包含 event loop、計分執行緒池與同時段其他請求的堆疊，
+    可用來區分時間花在資料庫、NumPy 計分或 Redis 上。沒有請求時取樣執行緒會停下等待。
+    """
+
+    def __init__(self, threshold_seconds: float, interval_seconds: float = 0.005,
+                 max_samples: int = 20000, top_stacks: int = 5, max_depth: int = 40):
+        self.threshold_seconds = threshold_seconds
+        self.interval_seconds = interval_seconds
+        self.top_stacks = top_stacks
+        self.max_depth = max_depth
+        self._samples: Deque[Tuple[float, Tuple[str, ...]]] = collections.deque(maxlen=max_samples)
+        self._listeners: List[SlowRequestListener] = [self._log_report]
+        self._active = 0
+        self._lock = threading.Lock()
+        self._has_active = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add_listener(self, listener: SlowRequestListener) -> None:
+        """註冊慢請求的 callback：listener(name, duration_seconds, [(collapsed stack, samples), ...])。"""
+        self._listeners.append(listener)
+
+    def start(self) -> float:
+        """請求開始時呼叫，回傳開始時間，結束時交給 finish()。"""
+        with self._lock:
+            self._active += 1
+            self._has_active.set()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="slow-request-profiler", daemon=True)
+                self._thread.start()
+        return time.monotonic()
+
+    def finish(self, started_at: float, name: str) -> Optional[List[Tuple[str, int]]]:
+        """請求結束時呼叫；超過門檻時回傳取樣報告（並通知 listener），否則回傳 None。"""
+        finished_at = time.monotonic()
+        with self._lock:
+            self._active -= 1
+            if self._active <= 0:
+                self._active = 0
+                self._has_active.clear()
+
+        duration = finished_at - started_at
+        if duration < self.threshold_seconds:
+            return None
+        SLOW_REQUESTS.inc(route=name)
+        report = self.report(started_at, finished_at)
+        for listener in self._listeners:
+            try:
+                listener(name, duration, report)
+            except Exception as e:
+                logger.error(f"Slow request listener failed: {e}")
+        return report
+
+    def report(self, start: float, end: float) -> List[Tuple[str, int]]:
+        counts = collections.Counter(stack for sampled_at, stack in list(self._samples) if start <= sampled_at <= end)
+        return [(";".join(stack), count) for stack, count in counts.most_common(self.top_stacks)]
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self._has_active.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def _run(self) -> None:
+        own_thread_id = threading.get_ident()
+        while not self._stop_event.is_set():
+            self._has_active.wait()
+            if self._stop_event.is_set():
+                break
+            self.sample(skip_thread_id=own_thread_id)
+            time.sleep(self.interval_seconds)
+
+    def sample(self, skip_thread_id: Optional[int] = None) -> None:
+        sampled_at = time.monotonic()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == skip_thread_id or frame.f_code.co_filename.endswith(_IDLE_FILES):
+                continue
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            # 由外而內，與 flame graph 的 collapsed stack 格式相同
+            self._samples.append((sampled_at, tuple(reversed(stack))))
+
+    def _log_report(self, name: str, duration: float, report: List[Tuple[str, int]]) -> None:
+        lines = "\n".join(f"  {count:>5} {stack}" for stack, count in report) or "  (no samples)"
+        logger.warning(f"Slow request {name} took {duration * 1000:.1f} ms. Most sampled stacks:\n{lines}")
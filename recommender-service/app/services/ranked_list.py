@@ -0,0 +1,67 @@
+import struct
+import time
+import numpy as np
+from typing import List, NamedTuple, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 二進位格式（little-endian）：
+#   magic "RL" | 格式版本 uint8 | 保留 1 byte | 模型版本 uint32 | 計算時間 float64（Unix 秒）
+#   | 計算深度 uint32 | 筆數 uint32 | 商品 ID int64 × 筆數 | 分數 float32 × 筆數
+# 商品 ID 對應 Laravel products.id（unsigned bigint），以 int64 存放；格式版本 1 為 int32，讀取時視為未命中
+# Laravel 的 RecommendationService 以 unpack 讀取同一格式，修改時需同步更新
+_MAGIC = b"RL"
+_FORMAT_VERSION = 2
+_HEADER = struct.Struct("<2sBxIdII")
+
+
+class RankedList(NamedTuple):
+    """
+    單一用戶的完整排序推薦（商品 ID 與分數），快取時以緊湊的二進位格式存放。
+
+    depth 為計算時要求的長度；實際筆數少於 depth 表示已沒有更多候選商品。
+    任何 num_recommendations <= depth 的請求都可直接切片回應，不需每個 N 各存一份。
+    熱門商品備援的項目沒有協同過濾分數，分數為 0。
+    """
+    product_ids: np.ndarray
+    scores: np.ndarray
+    depth: int
+    model_version: int = 0
+    computed_at: float = 0.0
+
+    @classmethod
+    def create(cls, product_ids, scores=None, depth: int = 0, model_version: int = 0,
+               computed_at: Optional[float] = None) -> "RankedList":
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        scores = np.zeros(product_ids.size, dtype=np.float32) if scores is None else np.asarray(scores, dtype=np.float32)
+        return cls(product_ids, scores, max(depth, product_ids.size), model_version,
+                   computed_at if computed_at is not None else time.time())
+
+    @property
+    def size(self) -> int:
+        return int(self.product_ids.size)
+
+    def covers(self, num_recommendations: int) -> bool:
+        return num_recommendations <= self.depth
+
+    def top(self, num_recommendations: int) -> List[int]:
+        return self.product_ids[:max(num_recommendations, 0)].tolist()
+
+    def encode(self) -> bytes:
+        header = _HEADER.pack(_MAGIC, _FORMAT_VERSION, self.model_version, self.computed_at, self.depth, self.size)
+        return header + self.product_ids.astype("<i8").tobytes() + self.scores.astype("<f4").tobytes()
+
+    @classmethod
+    def decode(cls, data: bytes) -> Optional["RankedList"]:
+        """解析快取值；格式不符（例如升級前寫入的 JSON）時回傳 None，視為未命中。"""
+        if not isinstance(data, (bytes, bytearray)) or len(data) < _HEADER.size:
+            return None
+        magic, format_version, model_version, computed_at, depth, count = _HEADER.unpack_from(data)
+        if magic != _MAGIC or format_version != _FORMAT_VERSION or len(data) != _HEADER.size + count * 12:
+            logger.warning("Ignoring cached recommendations in an unknown format.")
+            return None
+        # 直接以唯讀 view 對應原始 bytes，不逐筆轉換
+        product_ids = np.frombuffer(data, dtype="<i8", count=count, offset=_HEADER.size)
+        scores = np.frombuffer(data, dtype="<f4", count=count, offset=_HEADER.size + count * 8)
+        return cls(product_ids, scores, depth, model_version, computed_at)
@@ -0,0 +1,180 @@
+import asyncio
+import time
+from collections import OrderedDict
+from redis.asyncio import Redis
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import logging
+
+from ..core.config import settings
+from .executor import run_in_scoring_executor
+from .model_store import ModelStore
+from .ranked_list import RankedList
+from .recommendation_cache import RecommendationCache
+
+logger = logging.getLogger(__name__)
+
+BatchHandler = Callable[[List[int]], Awaitable[Any]]
+
+
+class RecalculationQueueFull(Exception):
+    """待處理的用戶數已達上限。"""
+
+
+class RecalculationQueue:
+    """
+    進程內、會去重的推薦重算佇列。
+
+    重算端點只把用戶放進佇列並立即回應；背景 worker 每次取出最多 batch_size 個用戶，
+    交給 handler 做一次向量化計分與一次 pipeline 寫回。取出前會等待 batch_window_seconds，
+    讓同一時間窗內的請求併成同一批。用戶已在佇列中時重複的請求直接合併；
+    已被取出、正在計算的用戶再次進來則會重新排入，確保最新的互動會被計算到。
+    """
+
+    def __init__(self, batch_size: int = 100, batch_window_seconds: float = 0.05,
+                 num_workers: int = 1, max_pending: int = 100000):
+        self.batch_size = batch_size
+        self.batch_window_seconds = batch_window_seconds
+        self.num_workers = num_workers
+        self.max_pending = max_pending
+        # user_id → 排入時間（time.monotonic()），依排入順序
+        self._pending: "OrderedDict[int, float]" = OrderedDict()
+        self._handler: Optional[BatchHandler] = None
+        self._workers: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self.in_flight = 0
+        self.enqueued = 0
+        self.deduplicated = 0
+        self.rejected = 0
+        self.processed = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.last_batch_size = 0
+        self.last_batch_seconds = 0.0
+        self.last_lag_seconds = 0.0
+        self.max_lag_seconds = 0.0
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def enqueue(self, user_id: int) -> bool:
+        """排入用戶；已在佇列中時回傳 False。佇列已滿時拋出 RecalculationQueueFull。"""
+        if user_id in self._pending:
+            self.deduplicated += 1
+            return False
+        if len(self._pending) >= self.max_pending:
+            self.rejected += 1
+            raise RecalculationQueueFull(f"Recalculation queue is full ({self.max_pending} users pending).")
+        self._pending[user_id] = time.monotonic()
+        self.enqueued += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return True
+
+    def _take_batch(self) -> List[int]:
+        batch = []
+        now = time.monotonic()
+        while self._pending and len(batch) < self.batch_size:
+            user_id, enqueued_at = self._pending.popitem(last=False)
+            batch.append(user_id)
+            self.last_lag_seconds = now - enqueued_at
+            self.max_lag_seconds = max(self.max_lag_seconds, self.last_lag_seconds)
+        return batch
+
+    async def _process(self, handler: BatchHandler, batch: List[int]) -> None:
+        self.in_flight += len(batch)
+        start_time = time.time()
+        try:
+            await handler(batch)
+            self.processed += len(batch)
+        except Exception as e:
+            self.failed_batches += 1
+            logger.error(f"Recalculation of {len(batch)} users failed: {e}")
+        finally:
+            self.in_flight -= len(batch)
+            self.batches += 1
+            self.last_batch_size = len(batch)
+            self.last_batch_seconds = time.time() - start_time
+
+    async def _worker(self) -> None:
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            if self.batch_window_seconds > 0 and len(self._pending) < self.batch_size:
+                # 等待同一時間窗內的其他請求，一起計分
+                await asyncio.sleep(self.batch_window_seconds)
+            batch = self._take_batch()
+            if batch:
+                await self._process(self._handler, batch)
+
+    def start(self, handler: BatchHandler) -> None:
+        """在目前的 event loop 啟動背景 worker。"""
+        if self._workers:
+            return
+        self._handler = handler
+        self._wakeup = asyncio.Event()
+        if self._pending:
+            self._wakeup.set()
+        self._workers = [asyncio.get_running_loop().create_task(self._worker()) for _ in range(self.num_workers)]
+        logger.info(f"Started {self.num_workers} recalculation workers (batch size {self.batch_size}).")
+
+    async def stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._wakeup = None
+
+    async def drain(self, handler: Optional[BatchHandler] = None) -> int:
+        """在目前的 task 中處理完所有待處理用戶（不等待時間窗），回傳處理的用戶數。"""
+        handler = handler or self._handler
+        drained = 0
+        while self._pending:
+            batch = self._take_batch()
+            await self._process(handler, batch)
+            drained += len(batch)
+        return drained
+
+    def stats(self) -> Dict[str, Any]:
+        oldest = next(iter(self._pending.values()), None)
+        return {
+            "depth": len(self._pending),
+            "in_flight": self.in_flight,
+            "oldest_pending_seconds": time.monotonic() - oldest if oldest is not None else 0.0,
+            "last_lag_seconds": self.last_lag_seconds,
+            "max_lag_seconds": self.max_lag_seconds,
+            "enqueued": self.enqueued,
+            "deduplicated": self.deduplicated,
+            "rejected": self.rejected,
+            "processed": self.processed,
+            "batches": self.batches,
+            "failed_batches": self.failed_batches,
+            "last_batch_size": self.last_batch_size,
+            "last_batch_seconds": self.last_batch_seconds,
+            "workers": len(self._workers),
+        }
+
+
+def _rank_for_users(model_store: ModelStore, user_ids: List[int], depth: int) -> Dict[int, RankedList]:
+    # 背景 worker 沒有請求的 session，需自行開啟
+    db = model_store.open_session()
+    try:
+        return model_store.create_recommender(db).rank_for_users(user_ids, depth)
+    finally:
+        db.close()
+
+
+async def recalculate_recommendations(model_store: ModelStore, redis_client: Optional[Redis],
+                                      cache: RecommendationCache, user_ids: List[int],
+                                      depth: Optional[int] = None) -> Dict[int, RankedList]:
+    """
+    對一批用戶做一次向量化計分（深度預設為 RECOMMENDATION_CACHE_DEPTH），並以一次 pipeline 寫回兩層快取，
+    同時通知其他 worker 刪除這些用戶的本地快取。
+    """
+    start_time = time.time()
+    recommendations = await run_in_scoring_executor(_rank_for_users, model_store, user_ids,
+                                                    depth or settings.RECOMMENDATION_CACHE_DEPTH)
+    await cache.set_many(redis_client, {user_id: ranked for user_id, ranked in recommendations.items() if ranked.size},
+                         notify_peers=True)
+    logger.info(f"Recalculated recommendations for {len(user_ids)} users in {time.time() - start_time:.4f} seconds.")
+    return recommendations
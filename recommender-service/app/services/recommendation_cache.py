@@ -0,0 +1,315 @@
+import asyncio
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+import logging
+
+from .metrics import CACHE_REQUESTS, stage_timer
+from .ranked_list import RankedList
+
+logger = logging.getLogger(__name__)
+
+
+def recommendation_cache_key(user_id: int) -> str:
+    # Laravel 的 RecommendationService 也直接讀取這個 key，key 與值的格式（RankedList）需保持一致
+    return f"user:{user_id}:recommendations"
+
+
+# 重算後通知其他 worker 刪除本地快取的頻道，訊息格式為 "<來源 instance_id>:<user_id>,<user_id>,..."
+LOCAL_INVALIDATION_CHANNEL = "recommendations:local-invalidations"
+
+
+def invalidate_cached_recommendations(redis_client: Redis, user_ids: List[int]) -> None:
+    """刪除指定用戶的推薦快取，下次請求時以最新的模型重新計算。"""
+    if not redis_client or not user_ids:
+        return
+    try:
+        pipeline = redis_client.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipeline.delete(recommendation_cache_key(user_id))
+        pipeline.execute()
+        logger.info(f"Invalidated cached recommendations for {len(user_ids)} users.")
+    except Exception as e:
+        logger.error(f"Error invalidating cached recommendations: {e}")
+
+
+class LocalTTLCache:
+    """
+    進程內、有容量上限的 LRU 快取，每筆資料有 TTL。
+
+    過期後的 stale_ttl_seconds 內資料仍會保留並標記為 stale，
+    讓呼叫端可以先回傳舊值、再於背景更新（stale-while-revalidate）。
+    可從背景執行緒（例如模型增量更新）呼叫 delete，因此以鎖保護。
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, stale_ttl_seconds: float = 0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.stale_ttl_seconds = stale_ttl_seconds
+        self._entries: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Tuple[Optional[Any], bool]:
+        """回傳 (value, is_stale)；沒有資料或已超過 stale 期限時回傳 (None, False)。"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                CACHE_REQUESTS.inc(tier="local", result="miss")
+                return None, False
+
+            value, expires_at = entry
+            if now < expires_at:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                CACHE_REQUESTS.inc(tier="local", result="hit")
+                return value, False
+            if now < expires_at + self.stale_ttl_seconds:
+                self._entries.move_to_end(key)
+                self.stale_hits += 1
+                CACHE_REQUESTS.inc(tier="local", result="stale")
+                return value, True
+
+            del self._entries[key]
+            self.misses += 1
+            CACHE_REQUESTS.inc(tier="local", result="miss")
+            return None, False
+
+    def set(self, key: Hashable, value: Any) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class RecommendationCache:
+    """
+    推薦結果的兩層快取：進程內 LocalTTLCache 在前、Redis 在後，每位用戶存一份 RankedList。
+
+    Redis 中為緊湊的二進位格式，解析只是兩次 np.frombuffer；本地快取直接存放解析後的物件。
+    熱門用戶（員工帳號、爬蟲等）的重複請求大多在本地命中，省下 Redis 往返與解析；
+    本地資料過期但仍在 stale 期限內時直接回傳舊值，並由 schedule_refresh 在背景更新。
+
+    本地快取只存在於各 uvicorn worker 內：set_many(notify_peers=True) 寫入後會在
+    LOCAL_INVALIDATION_CHANNEL 發布用戶 ID，其他 worker 的 listen_for_invalidations 收到後刪除本地資料，
+    下次請求改讀 Redis 中的新結果。訂閱中斷期間錯過的通知，舊資料最多保留到本地 TTL（含 stale 期）結束。
+    """
+
+    def __init__(self, local_cache: LocalTTLCache, ttl_seconds: int):
+        self.local = local_cache
+        self.ttl_seconds = ttl_seconds
+        # 用來略過自己發布的失效通知（本 worker 的本地快取已是新值）
+        self.instance_id = uuid.uuid4().hex
+        self.invalidations_received = 0
+        self.redis_hits = 0
+        self.redis_misses = 0
+        self.redis_errors = 0
+        # 保留背景更新 task 的參照，避免執行中被垃圾回收
+        self._refreshing: Dict[int, asyncio.Task] = {}
+
+    async def get(self, redis_client: Optional[AsyncRedis], user_id: int) -> Tuple[Optional[RankedList], bool]:
+        """回傳 (排序推薦, is_stale)；兩層都沒有時回傳 (None, False)。深度是否足夠由呼叫端以 covers 判斷。"""
+        value, stale = self.local.get(user_id)
+        if value is not None:
+            return value, stale
+
+        value = await self.get_remote(redis_client, user_id)
+        if value is not None:
+            self.local.set(user_id, value)
+        return value, False
+
+    async def get_remote(self, redis_client: Optional[AsyncRedis], user_id: int) -> Optional[RankedList]:
+        if not redis_client:
+            return None
+        try:
+            with stage_timer("redis_get"):
+                cached_value = await redis_client.get(recommendation_cache_key(user_id))
+        except Exception as e:
+            self.redis_errors += 1
+            CACHE_REQUESTS.inc(tier="redis", result="error")
+            logger.error(f"Error accessing Redis for user {user_id}: {e}")
+            return None
+        ranked = RankedList.decode(cached_value) if cached_value else None
+        if ranked is None:
+            self.redis_misses += 1
+            CACHE_REQUESTS.inc(tier="redis", result="miss")
+            return None
+        self.redis_hits += 1
+        CACHE_REQUESTS.inc(tier="redis", result="hit")
+        return ranked
+
+    async def get_many(self, redis_client: Optional[AsyncRedis], user_ids: List[int]) -> Dict[int, RankedList]:
+        """先查本地，剩下的以一次 MGET 向 Redis 查詢。批次請求不回傳 stale 資料。"""
+        results: Dict[int, RankedList] = {}
+        remote_user_ids = []
+        for user_id in user_ids:
+            value, stale = self.local.get(user_id)
+            if value is not None and not stale:
+                results[user_id] = value
+            else:
+                remote_user_ids.append(user_id)
+
+        if redis_client and remote_user_ids:
+            try:
+                with stage_timer("redis_get"):
+                    cached_values = await redis_client.mget([recommendation_cache_key(user_id) for user_id in remote_user_ids])
+            except Exception as e:
+                self.redis_errors += 1
+                CACHE_REQUESTS.inc(tier="redis", result="error")
+                logger.error(f"Error reading batch recommendations from Redis: {e}")
+                return results
+            hits = 0
+            for user_id, cached_value in zip(remote_user_ids, cached_values):
+                ranked = RankedList.decode(cached_value) if cached_value else None
+                if ranked is not None:
+                    hits += 1
+                    results[user_id] = ranked
+                    self.local.set(user_id, ranked)
+            self.redis_hits += hits
+            self.redis_misses += len(remote_user_ids) - hits
+            if hits:
+                CACHE_REQUESTS.inc(hits, tier="redis", result="hit")
+            if len(remote_user_ids) > hits:
+                CACHE_REQUESTS.inc(len(remote_user_ids) - hits, tier="redis", result="miss")
+        return results
+
+    async def set(self, redis_client: Optional[AsyncRedis], user_id: int, value: RankedList) -> bool:
+        """寫入兩層快取，回傳是否成功寫入 Redis。"""
+        self.local.set(user_id, value)
+        if not redis_client:
+            return False
+        try:
+            with stage_timer("redis_set"):
+                await redis_client.setex(recommendation_cache_key(user_id), self.ttl_seconds, value.encode())
+            return True
+        except Exception as e:
+            self.redis_errors += 1
+            CACHE_REQUESTS.inc(tier="redis", result="error")
+            logger.error(f"Error writing recommendations to Redis for user {user_id}: {e}")
+            return False
+
+    async def set_many(self, redis_client: Optional[AsyncRedis], values: Dict[int, RankedList],
+                       notify_peers: bool = False) -> bool:
+        """
+        寫入兩層快取，回傳是否成功寫入 Redis。notify_peers 時在同一個 pipeline 發布失效通知，
+        讓其他 worker 不再使用本地快取中的舊結果（用於重算既有的推薦）。
+        """
+        for user_id, value in values.items():
+            self.local.set(user_id, value)
+        if not redis_client or not values:
+            return False
+        try:
+            pipeline = redis_client.pipeline(transaction=False)
+            for user_id, value in values.items():
+                pipeline.setex(recommendation_cache_key(user_id), self.ttl_seconds, value.encode())
+            if notify_peers:
+                pipeline.publish(LOCAL_INVALIDATION_CHANNEL,
+                                 f"{self.instance_id}:{','.join(str(user_id) for user_id in values)}")
+            with stage_timer("redis_set"):
+                await pipeline.execute()
+            return True
+        except Exception as e:
+            self.redis_errors += 1
+            CACHE_REQUESTS.inc(tier="redis", result="error")
+            logger.error(f"Error writing batch recommendations to Redis: {e}")
+            return False
+
+    def invalidate_local(self, user_ids: List[int]) -> None:
+        for user_id in user_ids:
+            self.local.delete(user_id)
+
+    def handle_invalidation(self, message: Any) -> List[int]:
+        """處理一則失效通知，回傳被刪除本地快取的用戶；自己發布的通知略過。"""
+        if isinstance(message, bytes):
+            message = message.decode()
+        origin, _, user_ids = str(message).partition(":")
+        if origin == self.instance_id or not user_ids:
+            return []
+        invalidated = [int(user_id) for user_id in user_ids.split(",")]
+        self.invalidate_local(invalidated)
+        self.invalidations_received += len(invalidated)
+        return invalidated
+
+    async def listen_for_invalidations(self, redis_client: AsyncRedis, poll_seconds: float = 1.0,
+                                       retry_seconds: float = 1.0) -> None:
+        """
+        訂閱其他 worker 的失效通知直到被取消。以 poll_seconds 為讀取逾時輪詢，
+        閒置時不會觸發連線池的 socket_timeout；連線中斷時等待 retry_seconds 後重新訂閱。
+        """
+        while True:
+            pubsub = redis_client.pubsub()
+            try:
+                await pubsub.subscribe(LOCAL_INVALIDATION_CHANNEL)
+                while True:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=poll_seconds)
+                    if message is not None:
+                        self.handle_invalidation(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Local cache invalidation subscription failed, retrying: {e}")
+                await asyncio.sleep(retry_seconds)
+            finally:
+                await pubsub.reset()
+
+    def schedule_refresh(self, user_id: int, refresh: Callable[[], Awaitable[Any]]) -> bool:
+        """在背景執行 refresh()，同一用戶同時只會有一個背景更新。回傳是否有排入新的更新。"""
+        if user_id in self._refreshing:
+            return False
+
+        async def run():
+            try:
+                await refresh()
+            except Exception as e:
+                logger.error(f"Background refresh of recommendations for user {user_id} failed: {e}")
+            finally:
+                self._refreshing.pop(user_id, None)
+
+        self._refreshing[user_id] = asyncio.get_running_loop().create_task(run())
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "local": self.local.stats(),
+            "redis": {
+                "hits": self.redis_hits,
+                "misses": self.redis_misses,
+                "errors": self.redis_errors,
+            },
+            "refreshing": len(self._refreshing),
+            "invalidations_received": self.invalidations_received,
+        }
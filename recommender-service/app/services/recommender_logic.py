@@ -1,113 +1,266 @@
 from sqlalchemy.orm import Session
 import numpy as np
-from typing import List, Dict, Tuple
+from scipy import sparse
+from typing import List, Dict, Tuple, Optional
 import pandas as pd
 from sklearn.metrics.pairwise import cosine_similarity
-from ..data.data_loader import DataLoader
+from ..data.data_loader import DataLoader, InteractionWatermark
 from ..models.product import Product
 from ..models.order import OrderItem
 from ..models.interaction import UserInteraction
-from sqlalchemy import func
+from .model_snapshot import ModelSnapshot
+from .scoring import NeighbourScorer, normalize_rows
+from .item_similarity import ItemSimilarityIndex
+from .popularity import PopularityIndex
+from .als import ALSModel
+from .ann import RandomProjectionLSH
+from .metrics import FALLBACKS, stage_timer
+from .eligibility import FallbackProductSets, ProductCatalog, ProductFilter
+from .ranked_list import RankedList
+from .id_encoder import IdEncoder
+from ..core.config import settings
+from sqlalchemy import func, or_
 import logging
 
 logger = logging.getLogger(__name__)
 
 class Recommender:
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, snapshot: Optional[ModelSnapshot] = None,
+                 popularity: Optional[PopularityIndex] = None,
+                 ann_index: Optional[RandomProjectionLSH] = None,
+                 catalog: Optional[ProductCatalog] = None,
+                 data_loader: Optional[DataLoader] = None,
+                 fallback_sets: Optional[FallbackProductSets] = None):
         self.db = db
-        self.data_loader = DataLoader(db)
+        # 分片的 scoring worker 傳入只載入本分片用戶的 DataLoader
+        self.data_loader = data_loader or DataLoader(db)
+        # 若有共享的模型快照，直接使用，不再於每次請求時重建矩陣
+        self.snapshot = snapshot
+        # 若有預先計算的熱門排行，備援時直接切片，不再查詢 order_items
+        self.popularity = popularity
+        # 若有近似最近鄰索引，鄰居（或候選商品）只從索引取回的候選中挑選
+        self.ann_index = ann_index
+        # 商品庫存與分類的遮罩來源；有 catalog 時預設只推薦有庫存的商品
+        self.catalog = catalog
+        # 沒有 catalog 時的備援篩選資料，由 ModelStore 跨請求共用；未提供時只在本次請求內共用
+        self.fallback_sets = fallback_sets or FallbackProductSets(ttl_seconds=settings.CATALOG_FALLBACK_TTL_SECONDS)
 
-    def get_interaction_matrix_and_mappings(self) -> Tuple[np.ndarray, List[int], List[int]]:
-        df, user_to_idx, product_to_idx = self.data_loader.load_interaction_data()
+    def get_interaction_matrix_and_mappings(
+        self, until: Optional[InteractionWatermark] = None
+    ) -> Tuple[sparse.csr_matrix, np.ndarray, np.ndarray]:
+        with stage_timer("db_load"):
+            user_ids, product_ids, values = self.data_loader.load_interaction_triples(until=until)
 
-        if df.empty:
+        if values.size == 0:
             logger.info("No interaction data loaded. Returning empty matrix and mappings.")
-            return np.array([]), [], []
+            return sparse.csr_matrix((0, 0), dtype=np.float32), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
 
-        num_users = len(user_to_idx)
-        num_products = len(product_to_idx)
-        
-        interaction_matrix = np.zeros((num_users, num_products))
-        for _, row in df.iterrows():
-            user_idx = user_to_idx[row['user_id']]
-            product_idx = product_to_idx[row['product_id']]
-            interaction_matrix[user_idx, product_idx] = row['value']
+        with stage_timer("matrix_build"):
+            # 以 np.unique 一次完成 ID → 索引的編碼（索引依 ID 排序）
+            unique_user_ids, user_indices = np.unique(user_ids, return_inverse=True)
+            unique_product_ids, product_indices = np.unique(product_ids, return_inverse=True)
+
+            # 直接由 COO 陣列建立 CSR 稀疏矩陣，記憶體只與互動筆數成正比，而非 users × products
+            interaction_matrix = sparse.csr_matrix(
+                (values.astype(np.float32), (user_indices, product_indices)),
+                shape=(unique_user_ids.size, unique_product_ids.size),
+                dtype=np.float32
+            )
 
-        all_user_ids = [user_id for user_id, _ in sorted(user_to_idx.items(), key=lambda item: item[1])]
-        all_product_ids = [product_id for product_id, _ in sorted(product_to_idx.items(), key=lambda item: item[1])]
+        # 排序後的 ID 陣列即為位置 → ID 的映射，直接交給 IdEncoder，不再轉成 Python list / dict
+        return interaction_matrix, unique_user_ids.astype(np.int64), unique_product_ids.astype(np.int64)
 
-        return interaction_matrix, all_user_ids, all_product_ids
+    def build_snapshot(self, version: int = 0) -> ModelSnapshot:
+        # 先記下水位再載入，之後的增量更新從這個水位開始；
+        # 兩者之間新增的資料可能被讀到兩次，但取最大值的合併是冪等的，不影響結果
+        try:
+            watermark = self.data_loader.get_watermark()
+        except Exception as e:
+            logger.error(f"Error reading interaction watermark: {e}")
+            watermark = None
+        interaction_matrix, all_user_ids, all_product_ids = self.get_interaction_matrix_and_mappings(until=watermark)
+        # 只預先計算列正規化矩陣，不再建立完整的 users × users 相似度矩陣
+        with stage_timer("matrix_build"):
+            normalized_matrix = normalize_rows(interaction_matrix)
+        return ModelSnapshot(version, interaction_matrix, all_user_ids, all_product_ids, normalized_matrix,
+                             watermark=watermark or InteractionWatermark())
 
-    def calculate_similarity(self, matrix: np.ndarray) -> np.ndarray:
+    def calculate_similarity(self, matrix: sparse.csr_matrix) -> sparse.csr_matrix:
         # Check if matrix is empty or has only one sample
-        if matrix.shape[0] < 2 or np.all(matrix == 0):
-            logger.info("Matrix too small or all zeros for similarity calculation. Returning empty array.")
-            return np.array([[]])
-        
-        return cosine_similarity(matrix)
+        if matrix.shape[0] < 2 or matrix.nnz == 0:
+            logger.info("Matrix too small or all zeros for similarity calculation. Returning empty matrix.")
+            return sparse.csr_matrix((0, 0))
+
+        # 保持稀疏輸出，避免將相似度矩陣轉為稠密陣列
+        with stage_timer("similarity"):
+            return cosine_similarity(matrix, dense_output=False).tocsr()
+
+    def _scorer(self, snapshot: ModelSnapshot) -> NeighbourScorer:
+        return NeighbourScorer(snapshot.interaction_matrix, snapshot.normalized_matrix,
+                               num_neighbours=settings.NUM_NEIGHBOURS, ann_index=self.ann_index,
+                               ann_num_probes=settings.ANN_NUM_PROBES,
+                               ann_max_candidates=settings.ANN_MAX_CANDIDATES)
+
+    @staticmethod
+    def _product_filter(product_filter: Optional[ProductFilter]) -> ProductFilter:
+        """沒有指定條件時預設只推薦有庫存的商品（RECOMMEND_IN_STOCK_ONLY）。"""
+        if product_filter is None:
+            return ProductFilter(in_stock_only=settings.RECOMMEND_IN_STOCK_ONLY)
+        return product_filter
+
+    def _eligible(self, products: IdEncoder, product_filter: Optional[ProductFilter]) -> Optional[np.ndarray]:
+        """
+        對齊指定商品索引的遮罩，在 top-k 之前套用；None 表示不篩選。
+        catalog 為 None（共享 catalog 從未載入成功；重新載入失敗時會保留上一份）時不在請求路徑上重新載入，
+        改由 _fallback_mask 篩選，各條件（包含庫存）在協同過濾與熱門商品備援中都同樣套用。
+        """
+        product_filter = self._product_filter(product_filter)
+        if not product_filter.is_active:
+            return None
+        if self.catalog is None:
+            return self._fallback_mask(products, product_filter)
+        return self.catalog.masks_for(products).mask(product_filter, products)
+
+    def _fallback_mask(self, products: IdEncoder, product_filter: ProductFilter) -> np.ndarray:
+        """
+        沒有共享 catalog 時的遮罩：排除條件直接在記憶體中套用；分類與庫存條件使用 fallback_sets 中
+        跨請求共用的 ID 集合（分類內符合庫存條件的商品，或缺貨商品，通常遠少於有庫存的商品）。
+        """
+        mask = np.ones(len(products), dtype=bool)
+        if product_filter.category_id is not None:
+            positions = products.encode(self._category_product_ids(product_filter.category_id,
+                                                                   product_filter.in_stock_only))
+            mask[:] = False
+            mask[positions[positions >= 0]] = True
+        elif product_filter.in_stock_only:
+            positions = products.encode(self._out_of_stock_product_ids())
+            mask[positions[positions >= 0]] = False
+        if product_filter.exclude_product_ids:
+            positions = products.encode(np.asarray(product_filter.exclude_product_ids, dtype=np.int64))
+            mask[positions[positions >= 0]] = False
+        return mask
+
+    def _out_of_stock_product_ids(self) -> np.ndarray:
+        def load() -> np.ndarray:
+            query = self.db.query(Product.id).filter(or_(Product.stock.is_(None), Product.stock <= 0))
+            return np.fromiter((row.id for row in query), dtype=np.int64)
+        return self.fallback_sets.get("out_of_stock", load)
+
+    def _category_product_ids(self, category_id: int, in_stock_only: bool) -> np.ndarray:
+        def load() -> np.ndarray:
+            query = self.db.query(Product.id).filter(Product.category_id == category_id)
+            query = self._filter_product_query(query, ProductFilter(in_stock_only=in_stock_only))
+            return np.fromiter((row.id for row in query), dtype=np.int64)
+        return self.fallback_sets.get(("category", category_id, in_stock_only), load)
+
+    def recommend_for_user(self, target_user_id: int, num_recommendations: int = 5,
+                           product_filter: Optional[ProductFilter] = None) -> List[int]:
+        return self.rank_for_user(target_user_id, num_recommendations, product_filter).top(num_recommendations)
+
+    def recommend_for_users(self, target_user_ids: List[int], num_recommendations: int = 5,
+                            product_filter: Optional[ProductFilter] = None) -> Dict[int, List[int]]:
+        ranked_lists = self.rank_for_users(target_user_ids, num_recommendations, product_filter)
+        return {user_id: ranked.top(num_recommendations) for user_id, ranked in ranked_lists.items()}
 
-    def recommend_for_user(self, target_user_id: int, num_recommendations: int = 5) -> List[int]:
-        interaction_matrix, all_user_ids, all_product_ids = self.get_interaction_matrix_and_mappings()
+    def rank_for_user(self, target_user_id: int, depth: int = 5,
+                      product_filter: Optional[ProductFilter] = None) -> RankedList:
+        """前 depth 名的推薦商品與分數；快取以較深的 depth 計算一次，之後各種 num_recommendations 都從中切片。"""
+        snapshot = self.snapshot if self.snapshot is not None else self.build_snapshot()
 
         # Cold start / Fallback if no user data or matrix is empty
-        if not all_user_ids or not all_product_ids or target_user_id not in all_user_ids:
+        target_user_idx = snapshot.users.encode_one(target_user_id)
+        if snapshot.is_empty or target_user_idx is None:
             logger.info(f"User {target_user_id} not in interaction data or no data. Falling back to popular products.")
-            return self.get_popular_products(num_recommendations)
+            return self._fallback(snapshot, "empty_model" if snapshot.is_empty else "unknown_user", depth,
+                                  product_filter)
 
-        try:
-            target_user_idx = all_user_ids.index(target_user_id)
-        except ValueError:
-            logger.warning(f"Target user ID {target_user_id} not found in all_user_ids. This should not happen if previous check passed.")
-            return self.get_popular_products(num_recommendations)
+        candidate_indices, candidate_scores = self._scorer(snapshot).recommend(
+            target_user_idx, depth, eligible=self._eligible(snapshot.products, product_filter))
 
-        user_similarity = self.calculate_similarity(interaction_matrix)
+        if candidate_indices.size == 0:
+            logger.info(f"No recommendations found via collaborative filtering for user {target_user_id}. Falling back to popular products.")
+            return self._fallback(snapshot, "no_results", depth, product_filter)
 
-        if user_similarity.size == 0 or target_user_idx >= user_similarity.shape[0]:
-            logger.info("Similarity matrix is empty or target user index out of bounds. Falling back to popular products.")
-            return self.get_popular_products(num_recommendations)
+        return RankedList.create(snapshot.products.decode(candidate_indices), candidate_scores, depth, snapshot.version)
 
-        # Get indices of similar users, excluding self
-        similar_users_indices = user_similarity[target_user_idx].argsort()[::-1][1:]
-        
-        recommended_scores: Dict[int, float] = {}
-        
-        # Get products already interacted by the target user
-        user_interacted_product_indices = np.where(interaction_matrix[target_user_idx] > 0)[0]
-        user_interacted_product_ids = {all_product_ids[i] for i in user_interacted_product_indices}
+    def rank_for_users(self, target_user_ids: List[int], depth: int = 5,
+                       product_filter: Optional[ProductFilter] = None) -> Dict[int, RankedList]:
+        """批次版本：所有在互動資料中的用戶以一次向量化計分完成，其餘用戶共用同一份熱門商品。"""
+        snapshot = self.snapshot if self.snapshot is not None else self.build_snapshot()
 
-        for sim_user_idx in similar_users_indices:
-            similarity_score = user_similarity[target_user_idx, sim_user_idx]
-            if similarity_score <= 0.0: # Only consider positive similarity
-                continue
+        results: Dict[int, RankedList] = {}
+        # 整批 ID 一次編碼，不在互動資料中的用戶為 -1
+        user_indices = snapshot.users.encode(np.asarray(target_user_ids, dtype=np.int64))
+        known = user_indices >= 0
+        known_user_ids = [user_id for user_id, is_known in zip(target_user_ids, known.tolist()) if is_known]
+        if known_user_ids and not snapshot.is_empty:
+            scorer = self._scorer(snapshot)
+            eligible = self._eligible(snapshot.products, product_filter)
+            batch_results = scorer.recommend_batch(user_indices[known], depth, eligible=eligible)
+            for user_id, (candidate_indices, candidate_scores) in zip(known_user_ids, batch_results):
+                if candidate_indices.size > 0:
+                    results[user_id] = RankedList.create(snapshot.products.decode(candidate_indices), candidate_scores,
+                                                         depth, snapshot.version)
 
-            sim_user_product_indices = np.where(interaction_matrix[sim_user_idx] > 0)[0]
+        return self._fill_with_popular(snapshot, target_user_ids, results, depth, product_filter)
 
-            for product_idx in sim_user_product_indices:
-                product_id = all_product_ids[product_idx]
-                
-                # Skip products already interacted by the target user
-                if product_id in user_interacted_product_ids:
-                    continue
-                
-                if product_id not in recommended_scores:
-                    recommended_scores[product_id] = 0.0
-                recommended_scores[product_id] += interaction_matrix[sim_user_idx, product_idx] * similarity_score
+    def _fallback(self, snapshot: ModelSnapshot, reason: str, depth: int,
+                  product_filter: Optional[ProductFilter] = None) -> RankedList:
+        FALLBACKS.inc(reason=reason)
+        return RankedList.create(self.get_popular_products(depth, product_filter=product_filter),
+                                 depth=depth, model_version=snapshot.version)
 
-        sorted_recommendations = sorted(recommended_scores.items(), key=lambda item: item[1], reverse=True)
-        
-        if not sorted_recommendations:
-            logger.info(f"No recommendations found via collaborative filtering for user {target_user_id}. Falling back to popular products.")
-            return self.get_popular_products(num_recommendations)
-            
-        return [product_id for product_id, score in sorted_recommendations[:num_recommendations]]
+    def _fill_with_popular(self, snapshot: ModelSnapshot, target_user_ids: List[int], results: Dict[int, RankedList],
+                           depth: int, product_filter: Optional[ProductFilter] = None) -> Dict[int, RankedList]:
+        missing_user_ids = [user_id for user_id in target_user_ids if user_id not in results]
+        if missing_user_ids:
+            logger.info(f"{len(missing_user_ids)} users without collaborative filtering results. Falling back to popular products.")
+            if snapshot.is_empty:
+                FALLBACKS.inc(len(missing_user_ids), reason="empty_model")
+            else:
+                unknown = int(np.count_nonzero(snapshot.users.encode(np.asarray(missing_user_ids, dtype=np.int64)) < 0))
+                if unknown:
+                    FALLBACKS.inc(unknown, reason="unknown_user")
+                if len(missing_user_ids) > unknown:
+                    FALLBACKS.inc(len(missing_user_ids) - unknown, reason="no_results")
+            # RankedList 不可變，所有備援用戶共用同一份
+            popular = RankedList.create(self.get_popular_products(depth, product_filter=product_filter),
+                                        depth=depth, model_version=snapshot.version)
+            for user_id in missing_user_ids:
+                results[user_id] = popular
+        return results
+
+    def get_popular_products(self, num_recommendations: int = 5, category_id: Optional[int] = None,
+                             product_filter: Optional[ProductFilter] = None) -> List[int]:
+        with stage_timer("popularity_fallback"):
+            return self._get_popular_products(num_recommendations, category_id, product_filter)
+
+    def _get_popular_products(self, num_recommendations: int, category_id: Optional[int],
+                              product_filter: Optional[ProductFilter]) -> List[int]:
+        product_filter = self._product_filter(product_filter)
+        catalog = self.catalog if product_filter.is_active else None
+        if product_filter.category_id is not None:
+            category_id = product_filter.category_id
+        if self.popularity is not None:
+            if catalog is None:
+                exclude = product_filter.exclude_product_ids
+                if product_filter.in_stock_only:
+                    # 與協同過濾的 _fallback_mask 相同，以缺貨商品清單排除，不因走備援而推薦缺貨商品
+                    exclude = [*exclude, *self._out_of_stock_product_ids().tolist()]
+                return self.popularity.top(num_recommendations, category_id=category_id, exclude=exclude)
+            return self.popularity.top(num_recommendations, category_id=category_id,
+                                       eligible=lambda product_ids: catalog.eligible(product_ids, product_filter))
 
-    def get_popular_products(self, num_recommendations: int = 5) -> List[int]:
         # 嘗試從 OrderItem 中獲取熱門產品
-        popular_products_by_purchase = self.db.query(
+        popular_products_query = self.db.query(
                                 Product.id,
                                 func.sum(OrderItem.quantity).label('total_quantity_sold')
                             ) \
-                            .join(OrderItem, Product.id == OrderItem.product_id) \
+                            .join(OrderItem, Product.id == OrderItem.product_id)
+        if category_id is not None:
+            popular_products_query = popular_products_query.filter(Product.category_id == category_id)
+        popular_products_query = self._filter_product_query(popular_products_query, product_filter)
+        popular_products_by_purchase = popular_products_query \
                             .group_by(Product.id) \
                             .order_by(func.sum(OrderItem.quantity).desc()) \
                             .limit(num_recommendations) \
@@ -119,7 +272,11 @@ class Recommender:
         if len(result_ids) < num_recommendations:
             remaining_needed = num_recommendations - len(result_ids)
             # 獲取所有現有產品 ID
-            all_product_ids_in_db = [p.id for p in self.db.query(Product.id).all()]
+            all_products_query = self.db.query(Product.id)
+            if category_id is not None:
+                all_products_query = all_products_query.filter(Product.category_id == category_id)
+            all_products_query = self._filter_product_query(all_products_query, product_filter)
+            all_product_ids_in_db = [p.id for p in all_products_query.all()]
             
             # 從所有產品中，排除已經在結果中的，並隨機選擇或按 ID 順序選擇補齊
             additional_products = []
@@ -132,3 +289,164 @@ class Recommender:
             result_ids.extend(additional_products)
         
         return result_ids[:num_recommendations] # 確保最終返回的數量不多於 num_recommendations
+
+    @staticmethod
+    def _filter_product_query(query, product_filter: ProductFilter):
+        # 沒有預先計算的熱門排行時，庫存與排除條件直接加在查詢上（不論是否有 catalog）
+        if product_filter.in_stock_only:
+            query = query.filter(Product.stock > 0)
+        if product_filter.exclude_product_ids:
+            query = query.filter(Product.id.notin_(product_filter.exclude_product_ids))
+        return query
+
+
+class ItemBasedRecommender(Recommender):
+    """
+    Item-based 協同過濾：使用離線預先計算的 ItemSimilarityIndex，
+    線上只需合併用戶互動過商品的鄰居列表。
+    """
+
+    def __init__(self, db: Session, snapshot: Optional[ModelSnapshot] = None,
+                 item_index: Optional[ItemSimilarityIndex] = None,
+                 popularity: Optional[PopularityIndex] = None,
+                 catalog: Optional[ProductCatalog] = None,
+                 fallback_sets: Optional[FallbackProductSets] = None):
+        super().__init__(db, snapshot, popularity=popularity, catalog=catalog, fallback_sets=fallback_sets)
+        self.item_index = item_index
+
+    def _get_item_index(self, snapshot: ModelSnapshot) -> ItemSimilarityIndex:
+        if self.item_index is None:
+            self.item_index = ItemSimilarityIndex.build(snapshot.interaction_matrix, snapshot.all_product_ids,
+                                                        num_neighbours=settings.ITEM_NEIGHBOURS)
+        return self.item_index
+
+    def _recommend_from_history(self, snapshot: ModelSnapshot, target_user_idx: int,
+                                depth: int, eligible: Optional[np.ndarray] = None) -> RankedList:
+        matrix = snapshot.interaction_matrix
+        start, end = matrix.indptr[target_user_idx], matrix.indptr[target_user_idx + 1]
+        history_product_ids = snapshot.products.decode(matrix.indices[start:end])
+        item_index = self._get_item_index(snapshot)
+        with stage_timer("scoring"):
+            recommended_ids, scores = item_index.recommend(history_product_ids, matrix.data[start:end], depth,
+                                                           eligible=eligible)
+        return RankedList.create(recommended_ids, scores, depth, snapshot.version)
+
+    def rank_for_user(self, target_user_id: int, depth: int = 5,
+                      product_filter: Optional[ProductFilter] = None) -> RankedList:
+        snapshot = self.snapshot if self.snapshot is not None else self.build_snapshot()
+
+        target_user_idx = snapshot.users.encode_one(target_user_id)
+        if snapshot.is_empty or target_user_idx is None:
+            logger.info(f"User {target_user_id} not in interaction data or no data. Falling back to popular products.")
+            return self._fallback(snapshot, "empty_model" if snapshot.is_empty else "unknown_user", depth,
+                                  product_filter)
+
+        eligible = self._eligible(self._get_item_index(snapshot).products, product_filter)
+        ranked = self._recommend_from_history(snapshot, target_user_idx, depth, eligible)
+        if ranked.size == 0:
+            logger.info(f"No item-based recommendations found for user {target_user_id}. Falling back to popular products.")
+            return self._fallback(snapshot, "no_results", depth, product_filter)
+
+        return ranked
+
+    def rank_for_users(self, target_user_ids: List[int], depth: int = 5,
+                       product_filter: Optional[ProductFilter] = None) -> Dict[int, RankedList]:
+        # 每個用戶的成本只與其歷史長度有關，逐一合併鄰居列表即可
+        snapshot = self.snapshot if self.snapshot is not None else self.build_snapshot()
+
+        results: Dict[int, RankedList] = {}
+        eligible = None if snapshot.is_empty else self._eligible(self._get_item_index(snapshot).products, product_filter)
+        user_indices = snapshot.users.encode(np.asarray(target_user_ids, dtype=np.int64)).tolist()
+        for user_id, target_user_idx in zip(target_user_ids, user_indices):
+            if target_user_idx < 0:
+                continue
+            ranked = self._recommend_from_history(snapshot, target_user_idx, depth, eligible)
+            if ranked.size > 0:
+                results[user_id] = ranked
+
+        return self._fill_with_popular(snapshot, target_user_ids, results, depth, product_filter)
+
+
+class ALSRecommender(Recommender):
+    """
+    矩陣分解（ALS）推薦：用戶因子與 float32 商品因子矩陣做一次內積後以 argpartition 取 top-k。
+    已互動商品取自共享快照，因此離線訓練後的新互動也會被排除；訓練後才出現的用戶以 fold-in 求得因子。
+    """
+
+    def __init__(self, db: Session, snapshot: Optional[ModelSnapshot] = None,
+                 als_model: Optional[ALSModel] = None,
+                 popularity: Optional[PopularityIndex] = None,
+                 ann_index: Optional[RandomProjectionLSH] = None,
+                 catalog: Optional[ProductCatalog] = None,
+                 fallback_sets: Optional[FallbackProductSets] = None):
+        # ann_index 建立在 ALS 商品因子上，以 cosine 近似內積取回候選商品
+        super().__init__(db, snapshot, popularity=popularity, ann_index=ann_index, catalog=catalog,
+                         fallback_sets=fallback_sets)
+        self.als_model = als_model
+
+    def _get_als_model(self, snapshot: ModelSnapshot) -> ALSModel:
+        if self.als_model is None:
+            self.als_model = ALSModel.train(snapshot.interaction_matrix, snapshot.all_user_ids,
+                                            snapshot.all_product_ids, factors=settings.ALS_FACTORS,
+                                            regularization=settings.ALS_REGULARIZATION, alpha=settings.ALS_ALPHA,
+                                            iterations=settings.ALS_ITERATIONS,
+                                            num_threads=settings.ALS_TRAINING_THREADS)
+        return self.als_model
+
+    def _history(self, snapshot: ModelSnapshot, target_user_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        target_user_idx = snapshot.users.encode_one(target_user_id)
+        if target_user_idx is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        matrix = snapshot.interaction_matrix
+        start, end = matrix.indptr[target_user_idx], matrix.indptr[target_user_idx + 1]
+        return snapshot.products.decode(matrix.indices[start:end]), matrix.data[start:end]
+
+    def rank_for_user(self, target_user_id: int, depth: int = 5,
+                      product_filter: Optional[ProductFilter] = None) -> RankedList:
+        snapshot = self.snapshot if self.snapshot is not None else self.build_snapshot()
+        if snapshot.is_empty:
+            logger.info(f"No interaction data. Falling back to popular products for user {target_user_id}.")
+            return self._fallback(snapshot, "empty_model", depth, product_filter)
+
+        als_model = self._get_als_model(snapshot)
+        history_product_ids, history_weights = self._history(snapshot, target_user_id)
+        user_vector = als_model.user_vector(target_user_id, history_product_ids, history_weights)
+        if user_vector is None:
+            logger.info(f"User {target_user_id} not in ALS model or interaction data. Falling back to popular products.")
+            return self._fallback(snapshot, "unknown_user", depth, product_filter)
+
+        with stage_timer("scoring"):
+            recommended_ids, scores = als_model.recommend(user_vector, history_product_ids, depth,
+                                                     ann_index=self.ann_index, ann_num_probes=settings.ANN_NUM_PROBES,
+                                                     ann_max_candidates=settings.ANN_MAX_CANDIDATES,
+                                                     eligible=self._eligible(als_model.products, product_filter))
+        if recommended_ids.size == 0:
+            logger.info(f"No ALS recommendations found for user {target_user_id}. Falling back to popular products.")
+            return self._fallback(snapshot, "no_results", depth, product_filter)
+        return RankedList.create(recommended_ids, scores, depth, snapshot.version)
+
+    def rank_for_users(self, target_user_ids: List[int], depth: int = 5,
+                       product_filter: Optional[ProductFilter] = None) -> Dict[int, RankedList]:
+        """所有有因子的用戶以一次 (batch × factors) · (factors × products) 矩陣乘法計分。"""
+        snapshot = self.snapshot if self.snapshot is not None else self.build_snapshot()
+
+        results: Dict[int, RankedList] = {}
+        if not snapshot.is_empty:
+            als_model = self._get_als_model(snapshot)
+            scored_user_ids, user_vectors, histories = [], [], []
+            for user_id in target_user_ids:
+                history_product_ids, history_weights = self._history(snapshot, user_id)
+                user_vector = als_model.user_vector(user_id, history_product_ids, history_weights)
+                if user_vector is not None:
+                    scored_user_ids.append(user_id)
+                    user_vectors.append(user_vector)
+                    histories.append(history_product_ids)
+
+            with stage_timer("scoring"):
+                batch_results = als_model.recommend_batch(np.asarray(user_vectors), histories, depth,
+                                                          eligible=self._eligible(als_model.products, product_filter))
+            for user_id, (recommended_ids, scores) in zip(scored_user_ids, batch_results):
+                if recommended_ids.size > 0:
+                    results[user_id] = RankedList.create(recommended_ids, scores, depth, snapshot.version)
+
+        return self._fill_with_popular(snapshot, target_user_ids, results, depth, product_filter)
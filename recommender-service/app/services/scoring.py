@@ -0,0 +1,149 @@
+import numpy as np
+from scipy import sparse
+from typing import List, Optional, Tuple
+import logging
+
+from .metrics import stage_timer
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_rows(matrix: sparse.csr_matrix) -> sparse.csr_matrix:
+    """將每一列做 L2 正規化，之後兩列的內積即為 cosine similarity。"""
+    matrix = sparse.csr_matrix(matrix, dtype=np.float32)
+    row_norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    row_norms[row_norms == 0] = 1.0
+    return sparse.diags((1.0 / row_norms).astype(np.float32)) @ matrix
+
+
+def top_k(indices: np.ndarray, scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """以 argpartition 取出分數最高的 k 筆，只對這 k 筆排序。"""
+    if k <= 0 or scores.size == 0:
+        return indices[:0], scores[:0]
+    if scores.size > k:
+        part = np.argpartition(-scores, k - 1)[:k]
+        indices, scores = indices[part], scores[part]
+    order = np.argsort(-scores, kind='stable')
+    return indices[order], scores[order]
+
+
+class NeighbourScorer:
+    """
+    User-based 協同過濾的單一用戶計分引擎。
+
+    只計算目標用戶那一列的相似度（稀疏矩陣 × 稀疏向量），保留前 k 個鄰居，
+    再以一次稀疏矩陣-向量乘法彙總鄰居的互動分數，並遮蔽目標用戶已互動過的商品。
+    每次請求的成本與目標用戶的共同互動量有關，而不是 users × users。
+    提供 ann_index（近似最近鄰索引）時，只對索引取回的候選用戶計算相似度，成本與用戶總數無關。
+    """
+
+    def __init__(self, interaction_matrix: sparse.csr_matrix, normalized_matrix: sparse.csr_matrix,
+                 num_neighbours: int = 50, ann_index=None, ann_num_probes: int = 0,
+                 ann_max_candidates: Optional[int] = None):
+        self.interaction_matrix = interaction_matrix
+        self.normalized_matrix = normalized_matrix
+        self.num_neighbours = num_neighbours
+        self.ann_index = ann_index
+        self.ann_num_probes = ann_num_probes
+        self.ann_max_candidates = ann_max_candidates
+
+    def neighbours(self, user_idx: int) -> Tuple[np.ndarray, np.ndarray]:
+        """回傳目標用戶前 k 個正相似度鄰居的 (indices, similarities)。"""
+        target_row = self.normalized_matrix[user_idx]
+        if self.ann_index is not None:
+            neighbour_indices, neighbour_scores = self.ann_index.query(
+                target_row, self.normalized_matrix, self.num_neighbours + 1,
+                num_probes=self.ann_num_probes, max_candidates=self.ann_max_candidates
+            )
+            keep = (neighbour_indices != user_idx) & (neighbour_scores > 0.0)
+            return neighbour_indices[keep][:self.num_neighbours], neighbour_scores[keep][:self.num_neighbours]
+
+        similarities = (self.normalized_matrix @ target_row.T).tocoo()
+
+        neighbour_indices = similarities.row
+        neighbour_scores = similarities.data
+        keep = (neighbour_indices != user_idx) & (neighbour_scores > 0.0)
+        return top_k(neighbour_indices[keep], neighbour_scores[keep], self.num_neighbours)
+
+    def score(self, user_idx: int, eligible: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        回傳目標用戶所有候選商品的 (product indices, scores)，已排除已互動商品，未排序。
+        eligible 為商品位置的布林遮罩（例如有庫存、指定分類），只保留遮罩為 True 的候選。
+        """
+        with stage_timer("similarity"):
+            neighbour_indices, neighbour_scores = self.neighbours(user_idx)
+        if neighbour_indices.size == 0:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+
+        with stage_timer("scoring"):
+            num_users = self.interaction_matrix.shape[0]
+            weights = sparse.csr_matrix(
+                (neighbour_scores, (np.zeros_like(neighbour_indices), neighbour_indices)),
+                shape=(1, num_users)
+            )
+            scores = (weights @ self.interaction_matrix).tocsr()
+            scores.eliminate_zeros()
+
+            start, end = self.interaction_matrix.indptr[user_idx], self.interaction_matrix.indptr[user_idx + 1]
+            seen = self.interaction_matrix.indices[start:end]
+            keep = ~np.isin(scores.indices, seen, assume_unique=True)
+            if eligible is not None:
+                keep &= eligible[scores.indices]
+            return scores.indices[keep], scores.data[keep]
+
+    def recommend(self, user_idx: int, num_recommendations: int,
+                  eligible: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """回傳分數最高的 num_recommendations 個商品 (indices, scores)，由高到低排序。"""
+        candidate_indices, candidate_scores = self.score(user_idx, eligible)
+        return top_k(candidate_indices, candidate_scores, num_recommendations)
+
+    def recommend_batch(self, user_indices: np.ndarray, num_recommendations: int,
+                        eligible: Optional[np.ndarray] = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        一次為多個用戶計分：鄰居相似度與分數彙總各是一次稀疏矩陣乘法，
+        只有最後的 top-k 選取需要逐列處理。回傳順序與 user_indices 相同。
+        """
+        user_indices = np.asarray(user_indices, dtype=np.int64)
+        num_users = self.interaction_matrix.shape[0]
+        batch_size = user_indices.size
+        if batch_size == 0:
+            return []
+
+        with stage_timer("similarity"):
+            # (batch × users) 的相似度，每列只保留前 k 個正相似度鄰居；有 ANN 索引時逐列查詢候選
+            if self.ann_index is None:
+                similarities = (self.normalized_matrix[user_indices] @ self.normalized_matrix.T).tocsr()
+            weight_rows, weight_cols, weight_data = [], [], []
+            for row, user_idx in enumerate(user_indices):
+                if self.ann_index is not None:
+                    top_indices, top_scores = self.neighbours(int(user_idx))
+                else:
+                    start, end = similarities.indptr[row], similarities.indptr[row + 1]
+                    neighbour_indices = similarities.indices[start:end]
+                    neighbour_scores = similarities.data[start:end]
+                    keep = (neighbour_indices != user_idx) & (neighbour_scores > 0.0)
+                    top_indices, top_scores = top_k(neighbour_indices[keep], neighbour_scores[keep], self.num_neighbours)
+                weight_rows.append(np.full(top_indices.size, row, dtype=np.int64))
+                weight_cols.append(top_indices)
+                weight_data.append(top_scores)
+
+        with stage_timer("scoring"):
+            weights = sparse.csr_matrix(
+                (np.concatenate(weight_data), (np.concatenate(weight_rows), np.concatenate(weight_cols))),
+                shape=(batch_size, num_users)
+            )
+            scores = (weights @ self.interaction_matrix).tocsr()
+
+            # 以已互動商品的 0/1 遮罩扣除已看過的商品
+            seen_mask = self.interaction_matrix[user_indices].astype(bool).astype(np.float32)
+            scores = (scores - scores.multiply(seen_mask)).tocsr()
+            if eligible is not None:
+                # 不符合條件的商品整欄歸零，與已互動商品一起在 top-k 前移除
+                scores.data[~eligible[scores.indices]] = 0.0
+            scores.eliminate_zeros()
+
+            results = []
+            for row in range(batch_size):
+                start, end = scores.indptr[row], scores.indptr[row + 1]
+                results.append(top_k(scores.indices[start:end], scores.data[start:end], num_recommendations))
+        return results
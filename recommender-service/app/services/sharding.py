@@ -0,0 +1,173 @@
+import asyncio
+import time
+import httpx
+import numpy as np
+from typing import Any, Dict, List, Optional, Sequence
+import logging
+
+from ..core.config import settings
+from .health import HealthCheck
+from .metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+SHARD_REQUEST_DURATION = REGISTRY.histogram(
+    "shard_request_duration_seconds",
+    "Latency of requests forwarded from the router to scoring shards.",
+    ["shard", "status"]
+)
+
+_MIX_1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX_2 = np.uint64(0x94D049BB133111EB)
+
+
+def mix64(values: np.ndarray) -> np.ndarray:
+    """splitmix64 的混合函式（向量化），將 uint64 打散為均勻分布的 64 位元雜湊值。"""
+    with np.errstate(over='ignore'):
+        mixed = (values ^ (values >> np.uint64(30))) * _MIX_1
+        mixed = (mixed ^ (mixed >> np.uint64(27))) * _MIX_2
+        return mixed ^ (mixed >> np.uint64(31))
+
+
+def shard_urls() -> List[str]:
+    """SHARD_URLS 解析後的分片 base URL，依分片編號排序；空列表表示本進程不是路由前端。"""
+    return [url.strip().rstrip("/") for url in settings.SHARD_URLS.split(",") if url.strip()]
+
+
+def is_router() -> bool:
+    return bool(shard_urls())
+
+
+def shard_of_users(user_ids: Sequence[int], num_shards: int) -> np.ndarray:
+    """
+    各用戶所屬的分片編號（向量化）。
+    以 splitmix64 的混合函式打散 ID 後取餘數，連號或有規律的 ID 也能平均分散；
+    結果只取決於 ID 與分片數，路由前端與各分片各自計算都會一致。
+    """
+    user_ids = np.asarray(user_ids, dtype=np.int64)
+    if num_shards <= 1:
+        return np.zeros(user_ids.size, dtype=np.int64)
+    return (mix64(user_ids.astype(np.uint64)) % np.uint64(num_shards)).astype(np.int64)
+
+
+def shard_of_user(user_id: int, num_shards: int) -> int:
+    return int(shard_of_users([user_id], num_shards)[0])
+
+
+class ShardUnavailable(Exception):
+    """分片無法連線或逾時。"""
+
+    def __init__(self, shard: int, reason: str):
+        super().__init__(f"Shard {shard} unavailable: {reason}")
+        self.shard = shard
+
+
+class ShardMisconfigured(ValueError):
+    """分片回報的分片數或分片編號與路由前端的 SHARD_URLS 不一致。"""
+
+
+class ShardRouter:
+    """
+    路由前端：依 user_id 雜湊將請求轉發給持有該用戶的 scoring worker（分片），
+    批次請求依分片拆開、並行送出後合併結果。分片之間不共享進程記憶體，增加分片即可擴充容量。
+    所有分片共用一個 httpx.AsyncClient 連線池（keep-alive），轉發不必每次重新建立連線。
+    """
+
+    def __init__(self, shard_urls: List[str], timeout_seconds: float = 5.0, max_connections: int = 100,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        if not shard_urls:
+            raise ValueError("ShardRouter needs at least one shard URL.")
+        self.shard_urls = shard_urls
+        self._client = httpx.AsyncClient(
+            timeout=timeout_seconds,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            transport=transport
+        )
+
+    @property
+    def num_shards(self) -> int:
+        return len(self.shard_urls)
+
+    def shard_for(self, user_id: int) -> int:
+        return shard_of_user(user_id, self.num_shards)
+
+    async def request(self, shard: int, method: str, path: str, **kwargs) -> httpx.Response:
+        start_time = time.perf_counter()
+        status = "error"
+        try:
+            response = await self._client.request(method, self.shard_urls[shard] + path, **kwargs)
+            status = str(response.status_code)
+            return response
+        except httpx.HTTPError as e:
+            logger.error(f"Request to shard {shard} ({self.shard_urls[shard]}) failed: {e!r}")
+            raise ShardUnavailable(shard, str(e) or type(e).__name__)
+        finally:
+            SHARD_REQUEST_DURATION.observe(time.perf_counter() - start_time, shard=str(shard), status=status)
+
+    async def forward(self, user_id: int, method: str, path: str, **kwargs) -> httpx.Response:
+        """將單一用戶的請求原樣轉發到其所屬分片。"""
+        return await self.request(self.shard_for(user_id), method, path, **kwargs)
+
+    def partition(self, user_ids: List[int]) -> Dict[int, List[int]]:
+        """依分片拆開一批用戶，各分片內保持原本的順序。"""
+        shards = shard_of_users(user_ids, self.num_shards).tolist()
+        partitions: Dict[int, List[int]] = {}
+        for user_id, shard in zip(user_ids, shards):
+            partitions.setdefault(shard, []).append(user_id)
+        return partitions
+
+    async def fan_out(self, requests: Dict[int, Dict[str, Any]], method: str, path: str) -> Dict[int, httpx.Response]:
+        """對多個分片並行送出請求（requests 為 分片 → request kwargs），任一分片失敗時拋出 ShardUnavailable。"""
+        shards = list(requests)
+        responses = await asyncio.gather(*(self.request(shard, method, path, **requests[shard]) for shard in shards))
+        return dict(zip(shards, responses))
+
+    def check_topology(self, shard: int, health: Dict[str, Any]) -> None:
+        """
+        確認分片 /health 回報的 NUM_SHARDS / SHARD_INDEX 與 SHARD_URLS 中的位置一致。
+        不一致時路由前端與分片對用戶歸屬的雜湊結果不同，請求會被轉發到沒有該用戶資料的分片。
+        """
+        expected = (self.num_shards, shard)
+        reported = (health.get("num_shards"), health.get("shard_index"))
+        if reported != expected:
+            raise ShardMisconfigured(
+                f"Shard {shard} ({self.shard_urls[shard]}) reports num_shards={reported[0]}, "
+                f"shard_index={reported[1]}, expected num_shards={expected[0]}, shard_index={expected[1]}."
+            )
+
+    async def validate_shards(self, timeout_seconds: float = 60.0, poll_interval_seconds: float = 1.0) -> None:
+        """
+        啟動時輪詢各分片的 /health 並檢查分片設定，任一分片設定不一致即拋出 ShardMisconfigured。
+        分片可能比路由前端晚啟動：逾時仍無法確認的分片只記錄錯誤，之後由定期健康檢查繼續驗證。
+        """
+        pending = set(range(self.num_shards))
+        deadline = time.monotonic() + timeout_seconds
+        while True:
+            for shard in sorted(pending):
+                try:
+                    response = await self.request(shard, "GET", "/health")
+                except ShardUnavailable:
+                    continue
+                if response.status_code == 200:
+                    self.check_topology(shard, response.json())
+                    pending.discard(shard)
+            if not pending:
+                logger.info(f"All {self.num_shards} shards report a matching shard configuration.")
+                return
+            if time.monotonic() >= deadline:
+                logger.error(f"Could not verify the shard configuration of shards {sorted(pending)} "
+                             f"within {timeout_seconds} seconds.")
+                return
+            await asyncio.sleep(poll_interval_seconds)
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+
+def shard_health_check(router: ShardRouter, shard: int) -> HealthCheck:
+    async def check():
+        response = await router.request(shard, "GET", "/health")
+        if response.status_code != 200:
+            raise RuntimeError(f"HTTP {response.status_code}")
+        router.check_topology(shard, response.json())
+    return check
@@ -0,0 +1,102 @@
+import asyncio
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional
+from redis.asyncio import Redis
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 只在鎖仍屬於自己時才刪除，避免鎖過期後誤刪其他 worker 取得的新鎖
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class SingleFlight:
+    """
+    合併同一個 key 的並發計算（single-flight）。
+
+    - 進程內：同一 key 同時只會有一個計算在跑，其他呼叫者等待同一個 Future 的結果。
+    - 跨 worker：計算前以 Redis `SET NX PX` 取得短期鎖；沒搶到鎖的 worker 不重算，
+      而是輪詢快取等待持鎖者寫回，逾時才自行計算，確保不會因持鎖者當掉而卡住。
+    """
+
+    def __init__(self, lock_ttl_ms: int = 10000, wait_timeout_seconds: float = 5.0,
+                 poll_interval_seconds: float = 0.05):
+        self.lock_ttl_ms = lock_ttl_ms
+        self.wait_timeout_seconds = wait_timeout_seconds
+        self.poll_interval_seconds = poll_interval_seconds
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    @property
+    def inflight_count(self) -> int:
+        return len(self._inflight)
+
+    async def do(self, key: str, compute: Callable[[], Awaitable[Any]],
+                 redis_client: Optional[Redis] = None,
+                 read_cached: Optional[Callable[[], Awaitable[Any]]] = None) -> Any:
+        """
+        執行 compute() 並回傳結果；同一 key 的並發呼叫共用同一次計算。
+        read_cached 用於跨 worker 等待時讀取其他 worker 寫回的結果（回傳 None 表示尚未寫回）。
+        """
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            logger.info(f"Joining in-flight computation for {key}.")
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await self._run_with_distributed_lock(key, compute, redis_client, read_cached)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            # 標記例外已被取用，沒有其他等待者時不會出現 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def _run_with_distributed_lock(self, key: str, compute: Callable[[], Awaitable[Any]],
+                                         redis_client: Optional[Redis],
+                                         read_cached: Optional[Callable[[], Awaitable[Any]]]) -> Any:
+        if redis_client is None:
+            return await compute()
+
+        lock_key = f"lock:{key}"
+        token = uuid.uuid4().hex
+        try:
+            acquired = await redis_client.set(lock_key, token, nx=True, px=self.lock_ttl_ms)
+        except Exception as e:
+            logger.error(f"Error acquiring Redis lock {lock_key}: {e}")
+            return await compute()
+
+        if acquired:
+            try:
+                return await compute()
+            finally:
+                try:
+                    await redis_client.eval(_RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+                except Exception as e:
+                    logger.error(f"Error releasing Redis lock {lock_key}: {e}")
+
+        # 其他 worker 正在計算：等待它寫回快取
+        if read_cached is not None:
+            deadline = time.monotonic() + self.wait_timeout_seconds
+            while time.monotonic() < deadline:
+                await asyncio.sleep(self.poll_interval_seconds)
+                try:
+                    cached = await read_cached()
+                except Exception as e:
+                    logger.error(f"Error polling cache for {key}: {e}")
+                    break
+                if cached is not None:
+                    logger.info(f"Received result for {key} computed by another worker.")
+                    return cached
+            logger.warning(f"Timed out waiting for another worker to compute {key}. Computing locally.")
+        return await compute()
@@ -0,0 +1,74 @@
+"""
+資料載入、矩陣建立、相似度與推薦計分的效能測試。
+"""
+import itertools
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from typing import Dict
+import logging
+
+from app.data.data_loader import DataLoader
+from app.services.recommender_logic import Recommender
+from app.services.popularity import PopularityIndex
+
+from .harness import measure
+
+logger = logging.getLogger(__name__)
+
+# 相似度矩陣的成本為用戶數平方，只對固定數量的用戶抽樣計算，各規模之間才可比較
+SIMILARITY_SAMPLE_USERS = 2000
+# 單一用戶延遲量測時輪流使用的用戶數
+SAMPLE_USERS = 200
+
+
+def run(database_url: str, scale_name: str, repeat: int = 20) -> Dict[str, Dict[str, float]]:
+    engine = create_engine(database_url)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    db = session_factory()
+    results = {}
+
+    def record(name: str, metrics: Dict[str, float]) -> None:
+        results[f"{scale_name}/{name}"] = metrics
+        logger.info(f"{scale_name}/{name}: p50 {metrics['p50_ms']:.2f} ms, p95 {metrics['p95_ms']:.2f} ms.")
+
+    try:
+        loader = DataLoader(db)
+        # 整批載入的成本遠高於單次請求（1m 規模每次數秒），減少重複次數且不暖機
+        load_repeat = max(3, repeat // 5)
+        record("data_loader.load_interaction_data",
+               measure(loader.load_interaction_data, repeat=load_repeat, warmup=0))
+        record("data_loader.load_interaction_data_streaming",
+               measure(loader.load_interaction_data_streaming, repeat=load_repeat, warmup=0))
+        record("data_loader.load_interaction_data_aggregated",
+               measure(loader.load_interaction_data_aggregated, repeat=load_repeat, warmup=0))
+
+        recommender = Recommender(db)
+        record("recommender.get_interaction_matrix_and_mappings",
+               measure(recommender.get_interaction_matrix_and_mappings, repeat=load_repeat, warmup=0))
+        snapshot = recommender.build_snapshot()
+
+        sample = snapshot.interaction_matrix[:SIMILARITY_SAMPLE_USERS]
+        record("recommender.calculate_similarity", measure(lambda: recommender.calculate_similarity(sample),
+                                                            repeat=load_repeat))
+
+        rng = np.random.default_rng(0)
+        user_ids = rng.choice(snapshot.all_user_ids, size=min(SAMPLE_USERS, len(snapshot.users)), replace=False).tolist()
+        next_user = itertools.cycle(user_ids).__next__
+        snapshot_recommender = Recommender(db, snapshot=snapshot)
+        record("recommender.recommend_for_user",
+               measure(lambda: snapshot_recommender.recommend_for_user(next_user(), 10), repeat=repeat * 5))
+        record("recommender.recommend_for_users[100]",
+               measure(lambda: snapshot_recommender.recommend_for_users(user_ids[:100], 10), repeat=repeat,
+                       ops_per_call=100))
+
+        record("recommender.get_popular_products[query]",
+               measure(lambda: Recommender(db).get_popular_products(10), repeat=repeat))
+        popularity = PopularityIndex.build(db)
+        record("popularity.build", measure(lambda: PopularityIndex.build(db), repeat=load_repeat))
+        record("recommender.get_popular_products[index]",
+               measure(lambda: Recommender(db, popularity=popularity).get_popular_products(10), repeat=repeat * 5))
+    finally:
+        db.close()
+        engine.dispose()
+    return results
@@ -0,0 +1,97 @@
+"""
+HTTP 端點的效能測試：以 TestClient 呼叫 FastAPI app，資料庫為合成資料的 SQLite 檔。
+
+不連線 Redis：快取未命中的路徑關閉進程內快取，每次請求都經過用戶檢查與計分；
+快取命中的路徑開啟進程內快取，量測的是路由本身與序列化的開銷。
+"""
+import itertools
+import numpy as np
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+from typing import Dict
+import logging
+
+from app.main import app
+from app.models.db import get_async_database_url
+from app.dependencies import (get_db, get_async_db, get_async_redis_client, get_model_store,
+                              get_recommendation_cache)
+from app.services.model_store import ModelStore
+from app.services.recommendation_cache import LocalTTLCache, RecommendationCache
+
+from .harness import measure
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_USERS = 200
+BATCH_SIZE = 100
+
+
+def run(database_url: str, scale_name: str, repeat: int = 20) -> Dict[str, Dict[str, float]]:
+    engine = create_engine(database_url, connect_args={"check_same_thread": False})
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    async_engine = create_async_engine(get_async_database_url(database_url), poolclass=NullPool)
+    async_session_factory = async_sessionmaker(bind=async_engine, class_=AsyncSession, expire_on_commit=False)
+
+    model_store = ModelStore(session_factory=session_factory, refresh_interval_seconds=0)
+    snapshot = model_store.get_snapshot()
+    model_store.get_popularity()
+    rng = np.random.default_rng(0)
+    user_ids = rng.choice(snapshot.all_user_ids, size=min(SAMPLE_USERS, len(snapshot.users)), replace=False).tolist()
+    next_user = itertools.cycle(user_ids).__next__
+
+    def override_get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    async def override_get_async_db():
+        async with async_session_factory() as async_db:
+            yield async_db
+
+    cache = RecommendationCache(LocalTTLCache(max_entries=0, ttl_seconds=0), ttl_seconds=3600)
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    app.dependency_overrides[get_async_redis_client] = lambda: None
+    app.dependency_overrides[get_model_store] = lambda: model_store
+    app.dependency_overrides[get_recommendation_cache] = lambda: cache
+
+    results = {}
+
+    def record(name: str, metrics: Dict[str, float]) -> None:
+        results[f"{scale_name}/{name}"] = metrics
+        logger.info(f"{scale_name}/{name}: p50 {metrics['p50_ms']:.2f} ms, p95 {metrics['p95_ms']:.2f} ms.")
+
+    def get(path: str):
+        response = client.get(path)
+        response.raise_for_status()
+        return response
+
+    def post(path: str, **kwargs):
+        response = client.post(path, **kwargs)
+        response.raise_for_status()
+        return response
+
+    try:
+        client = TestClient(app)
+        record("route.get_recommendations[miss]",
+               measure(lambda: get(f"/api/v1/recommendations/{next_user()}?num_recommendations=10"),
+                       repeat=repeat * 5))
+        record("route.batch_recommendations[miss]",
+               measure(lambda: post("/api/v1/recommendations/batch",
+                                    json={"user_ids": user_ids[:BATCH_SIZE], "num_recommendations": 10}),
+                       repeat=repeat, ops_per_call=BATCH_SIZE))
+
+        cache.local.max_entries = len(user_ids)
+        cache.local.ttl_seconds = 3600
+        record("route.get_recommendations[local_hit]",
+               measure(lambda: get(f"/api/v1/recommendations/{next_user()}?num_recommendations=10"),
+                       repeat=repeat * 5, warmup=len(user_ids)))
+    finally:
+        app.dependency_overrides = {}
+        engine.dispose()
+    return results
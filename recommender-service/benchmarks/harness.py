@@ -0,0 +1,81 @@
+"""
+量測工具：延遲百分位數、吞吐量、峰值記憶體，以及與基準值的比較。
+"""
+import gc
+import time
+import tracemalloc
+import numpy as np
+from typing import Any, Callable, Dict, List, Optional
+
+# 與基準值比較的指標；越小越好
+COMPARED_METRICS = ("p50_ms", "p95_ms", "peak_mb")
+
+
+def measure(func: Callable[[], Any], repeat: int = 20, warmup: int = 1, ops_per_call: int = 1) -> Dict[str, float]:
+    """
+    執行 func() warmup + repeat 次，回傳延遲百分位數（毫秒）、吞吐量（每秒 ops）與峰值記憶體（MB）。
+    tracemalloc 會拖慢純 Python 的程式碼，因此延遲量測不開啟追蹤，之後再額外執行一次量測峰值記憶體；
+    峰值涵蓋 Python 物件與 NumPy / SciPy 的陣列配置，只計入該次呼叫期間的新配置。
+    """
+    for _ in range(warmup):
+        func()
+    gc.collect()
+
+    latencies = np.empty(repeat, dtype=np.float64)
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        latencies[i] = time.perf_counter() - start
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        baseline, _ = tracemalloc.get_traced_memory()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    total_seconds = float(latencies.sum())
+    return {
+        "repeat": repeat,
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p95_ms": float(np.percentile(latencies, 95) * 1000),
+        "p99_ms": float(np.percentile(latencies, 99) * 1000),
+        "max_ms": float(latencies.max() * 1000),
+        "ops_per_second": repeat * ops_per_call / total_seconds if total_seconds > 0 else float("inf"),
+        "peak_mb": max(peak - baseline, 0) / (1024 * 1024),
+    }
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+            tolerance: float = 0.3, min_delta_ms: float = 1.0, min_delta_mb: float = 1.0) -> List[str]:
+    """
+    回傳相對基準值的退步項目。指標超過基準值 × (1 + tolerance)，且絕對差距大於 min_delta_*
+    （避免次毫秒級量測的雜訊）時視為退步；基準值中沒有的項目不比較。
+    """
+    regressions = []
+    for name, metrics in sorted(results.items()):
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        for metric in COMPARED_METRICS:
+            if metric not in metrics or metric not in expected:
+                continue
+            current, reference = metrics[metric], expected[metric]
+            min_delta = min_delta_mb if metric.endswith("_mb") else min_delta_ms
+            if current > reference * (1 + tolerance) and current - reference > min_delta:
+                regressions.append(f"{name} {metric}: {current:.2f} > baseline {reference:.2f} "
+                                   f"(+{(current / reference - 1) * 100 if reference else float('inf'):.0f}%)")
+    return regressions
+
+
+def format_table(results: Dict[str, Dict[str, float]], baseline: Optional[Dict[str, Dict[str, float]]] = None) -> str:
+    lines = [f"{'benchmark':<56} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'ops/s':>12} {'peak MB':>9} {'vs p50':>8}"]
+    for name, metrics in sorted(results.items()):
+        change = ""
+        if baseline and name in baseline and baseline[name].get("p50_ms"):
+            change = f"{(metrics['p50_ms'] / baseline[name]['p50_ms'] - 1) * 100:+.0f}%"
+        lines.append(f"{name:<56} {metrics['p50_ms']:>10.2f} {metrics['p95_ms']:>10.2f} {metrics['p99_ms']:>10.2f} "
+                     f"{metrics['ops_per_second']:>12.1f} {metrics['peak_mb']:>9.1f} {change:>8}")
+    return "\n".join(lines)
@@ -0,0 +1,118 @@
+"""
+效能測試入口：產生（或沿用）各規模的合成資料，執行各項量測，並與基準值比較。
+
+用法（在 recommender-service 目錄下）：
+    python -m benchmarks.run [--scales 10k,100k] [--suites recommender,routes] [--repeat N]
+    python -m benchmarks.run --scales 1m          # 1M 筆互動，整批載入每次數秒，完整執行約需十餘分鐘
+    python -m benchmarks.run --update-baseline
+
+任一項指標（p50 / p95 延遲、峰值記憶體）比基準值慢超過 --tolerance 時以結束碼 1 結束，可直接放在 CI。
+基準值與機器有關，更換 CI 機器或有預期中的效能變化時以 --update-baseline 重新記錄。
+"""
+import os
+
+# app 在匯入時即依 DATABASE_URL 建立 engine；效能測試各自連線合成資料，避免連線正式資料庫
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import argparse
+import json
+import logging
+import platform
+import sys
+import time
+
+from .harness import compare, format_table
+from .synthetic_data import SCALES, generate
+from . import bench_recommender, bench_routes
+
+logger = logging.getLogger(__name__)
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, "baseline.json")
+DEFAULT_DATA_DIR = os.path.join(BENCHMARK_DIR, ".data")
+SUITES = {
+    "recommender": bench_recommender.run,
+    "routes": bench_routes.run,
+}
+
+
+def _dataset(data_dir: str, scale_name: str, seed: int, regenerate: bool) -> str:
+    path = os.path.join(data_dir, f"{scale_name}-seed{seed}.sqlite3")
+    if regenerate or not os.path.exists(path):
+        return generate(path, SCALES[scale_name], seed=seed)
+    logger.info(f"Reusing {scale_name} dataset at {path}.")
+    return f"sqlite:///{path}"
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Recommender service benchmarks.")
+    parser.add_argument("--scales", default="10k,100k", help=f"Comma-separated scales: {', '.join(SCALES)}.")
+    parser.add_argument("--suites", default=",".join(SUITES), help=f"Comma-separated suites: {', '.join(SUITES)}.")
+    parser.add_argument("--repeat", type=int, default=20, help="Base number of timed calls per benchmark.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="Where generated SQLite datasets are kept.")
+    parser.add_argument("--regenerate", action="store_true", help="Regenerate datasets even if they exist.")
+    parser.add_argument("--output", help="Write the results as JSON to this path.")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="Merge the results into the baseline file instead of comparing.")
+    parser.add_argument("--tolerance", type=float, default=0.3,
+                        help="Allowed slowdown relative to the baseline (0.3 = 30%%).")
+    parser.add_argument("--verbose", action="store_true", help="Keep the service's INFO logs.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if not args.verbose:
+        for name in ("app", "httpx"):
+            logging.getLogger(name).setLevel(logging.WARNING)
+
+    scales = [scale for scale in args.scales.split(",") if scale]
+    suites = [suite for suite in args.suites.split(",") if suite]
+    unknown = [name for name in scales if name not in SCALES] + [name for name in suites if name not in SUITES]
+    if unknown:
+        logger.error(f"Unknown scale or suite: {', '.join(unknown)}.")
+        return 2
+
+    results = {}
+    for scale_name in scales:
+        database_url = _dataset(args.data_dir, scale_name, args.seed, args.regenerate)
+        for suite in suites:
+            start_time = time.time()
+            results.update(SUITES[suite](database_url, scale_name, repeat=args.repeat))
+            logger.info(f"Finished {suite} benchmarks at {scale_name} in {time.time() - start_time:.1f} seconds.")
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f).get("results", {})
+    print(format_table(results, baseline))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"results": results}, f, indent=2, sort_keys=True)
+
+    if args.update_baseline:
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump({
+                "machine": {"platform": platform.platform(), "python": platform.python_version(),
+                            "cpus": os.cpu_count()},
+                "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "results": baseline,
+            }, f, indent=2, sort_keys=True)
+            f.write("\n")
+        logger.info(f"Baseline updated with {len(results)} benchmarks: {args.baseline}")
+        return 0
+
+    regressions = compare(results, baseline, tolerance=args.tolerance)
+    if regressions:
+        print("\nRegressions against baseline:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    print(f"\nNo regressions against baseline ({len(baseline)} recorded benchmarks, tolerance {args.tolerance:.0%}).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
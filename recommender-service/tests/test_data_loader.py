@@ -0,0 +1,158 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, update
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.data.data_loader import DataLoader
+from app.models.db import Base
+from app.models.user import User
+from app.models.product import Product
+from app.models.order import Order, OrderItem
+from app.models.interaction import UserInteraction
+from app.services.sharding import shard_of_user
+
+engine = create_engine("sqlite:///:memory:", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+@pytest.fixture(name="session")
+def session_fixture():
+    Base.metadata.create_all(bind=engine)
+    db = TestingSessionLocal()
+    try:
+        users = [User(name=f"User {i}", email=f"user{i}@example.com", password="hashed") for i in range(3)]
+        products = [Product(name=f"Product {i}", price=10.0, stock=5) for i in range(4)]
+        db.add_all(users + products)
+        db.commit()
+
+        order = Order(user_id=users[0].id, order_number="ORD-1", total_amount=10.0, status="completed")
+        db.add(order)
+        db.commit()
+        db.add(OrderItem(order_id=order.id, product_id=products[0].id, quantity=1, price=10.0))
+
+        interactions = [
+            (0, 0, "view"), (0, 0, "click"), (0, 1, "view"), (0, 1, "favorite"),
+            (1, 1, "add_to_cart"), (1, 2, "view"), (1, 2, "view"), (2, 3, "unknown"),
+        ]
+        for user_pos, product_pos, interaction_type in interactions:
+            db.add(UserInteraction(user_id=users[user_pos].id, product_id=products[product_pos].id,
+                                   interaction_type=interaction_type))
+        db.commit()
+        yield db
+    finally:
+        db.close()
+        Base.metadata.drop_all(bind=engine)
+
+
+def _as_dict(triples):
+    user_ids, product_ids, values = triples
+    return {(int(u), int(p)): float(v) for u, p, v in zip(user_ids, product_ids, values)}
+
+
+def test_streaming_loader_matches_orm_loader(session):
+    loader = DataLoader(session)
+    df, _, _ = loader.load_interaction_data()
+    expected = {(int(row.user_id), int(row.product_id)): float(row.value) for row in df.itertuples()}
+
+    # chunk_size 小於資料列數，確保跨批次的最大值合併正確
+    streamed = _as_dict(loader.load_interaction_data_streaming(chunk_size=2))
+    assert streamed == expected
+    assert streamed[(1, 1)] == 5.0  # 購買優先於 click
+    assert streamed[(3, 4)] == 1.0  # 未知的互動類型以預設分數計
+
+
+def test_streaming_loader_returns_sorted_unique_pairs(session):
+    user_ids, product_ids, _ = DataLoader(session).load_interaction_data_streaming(chunk_size=3)
+    keys = user_ids * 1000 + product_ids
+    assert np.all(np.diff(keys) > 0)
+
+
+def test_sql_aggregated_loader_matches_streaming_loader(session):
+    loader = DataLoader(session)
+    streamed = loader.load_interaction_data_streaming(chunk_size=2)
+    aggregated = loader.load_interaction_data_aggregated(chunk_size=2)
+    for expected, actual in zip(streamed, aggregated):
+        assert actual.dtype == expected.dtype
+        np.testing.assert_array_equal(actual, expected)
+
+
+def test_sharded_loaders_keep_only_owned_users(session):
+    full = _as_dict(DataLoader(session).load_interaction_data_streaming(chunk_size=2))
+    for shard in range(2):
+        expected = {key: value for key, value in full.items() if shard_of_user(key[0], 2) == shard}
+        loader = DataLoader(session, num_shards=2, shard_index=shard)
+        assert _as_dict(loader.load_interaction_data_streaming(chunk_size=2)) == expected
+        assert _as_dict(loader.load_interaction_data_aggregated(chunk_size=2)) == expected
+    assert {user_id for user_id, _ in full} == {1, 2, 3}
+
+
+def test_sql_aggregated_loader_respects_watermark(session):
+    loader = DataLoader(session)
+    watermark = loader.get_watermark()
+    since = watermark._replace(interaction_id=watermark.interaction_id - 2)
+
+    user_ids, product_ids, values = loader.load_interaction_data_aggregated(since=since, until=watermark)
+    # 只剩最後兩筆互動：(1, 2) view 與 (2, 3) unknown，皆以預設分數計
+    assert _as_dict((user_ids, product_ids, values)) == {(2, 3): 1.0, (3, 4): 1.0}
+
+
+def test_time_decay_and_cutoff_match_across_loaders(session):
+    now = pd.Timestamp.now()
+    user_id, product_ids = 1, [1, 2, 3]
+    session.add_all([
+        # 90 天前的 favorite 衰減為 2，比今天的 view 高；400 天前的互動超過期限不載入
+        UserInteraction(user_id=user_id, product_id=product_ids[2], interaction_type="favorite",
+                        timestamp=(now - pd.Timedelta(days=90)).to_pydatetime()),
+        UserInteraction(user_id=user_id, product_id=product_ids[2], interaction_type="view"),
+        UserInteraction(user_id=3, product_id=product_ids[0], interaction_type="favorite",
+                        timestamp=(now - pd.Timedelta(days=400)).to_pydatetime()),
+        # 沒有時間的互動視為當天：不衰減、不受期限限制，即使同一組 (user, product, 分數) 另有較舊的互動
+        UserInteraction(user_id=2, product_id=product_ids[2], interaction_type="favorite",
+                        timestamp=(now - pd.Timedelta(days=90)).to_pydatetime()),
+    ])
+    undated = [UserInteraction(user_id=2, product_id=product_ids[2], interaction_type="favorite"),
+               UserInteraction(user_id=2, product_id=product_ids[1], interaction_type="click")]
+    session.add_all(undated)
+    session.commit()
+    # 寫入時會套用欄位預設值，事後再清成 NULL
+    session.execute(update(UserInteraction).where(UserInteraction.id.in_([row.id for row in undated]))
+                    .values(timestamp=None))
+    session.commit()
+
+    loader = DataLoader(session, half_life_days=90, max_age_days=365, now=now)
+    df, _, _ = loader.load_interaction_data()
+    expected = {(int(row.user_id), int(row.product_id)): float(row.value) for row in df.itertuples()}
+    assert expected[(1, 3)] == 2.0
+    assert (3, 1) not in expected and expected[(3, 4)] == 1.0
+    assert expected[(2, 3)] == 4.0 and expected[(2, 2)] == 3.0
+
+    assert _as_dict(loader.load_interaction_data_streaming(chunk_size=2)) == expected
+    aggregated = loader.load_interaction_data_aggregated(chunk_size=2)
+    assert _as_dict(aggregated) == expected
+    keys = aggregated[0] * 1000 + aggregated[1]
+    assert np.all(np.diff(keys) > 0)
+
+    # 不衰減、不限期限時與原本的分數相同
+    undecayed = _as_dict(DataLoader(session, half_life_days=0, max_age_days=0).load_interaction_data_streaming())
+    assert undecayed[(1, 3)] == 4.0 and undecayed[(3, 1)] == 4.0
+
+
+def test_loaders_keep_bigint_ids(session):
+    # 超過 32 位元的 ID 不能被截斷或與其他組合混淆
+    big_user, big_product = 2 ** 31 + 5, 2 ** 53 + 7
+    session.add_all([
+        UserInteraction(user_id=big_user, product_id=big_product, interaction_type="favorite"),
+        UserInteraction(user_id=big_user, product_id=big_product, interaction_type="view"),
+        UserInteraction(user_id=1, product_id=2 ** 32 + 1, interaction_type="click"),
+    ])
+    session.commit()
+
+    for loader in (DataLoader(session), DataLoader(session, half_life_days=90)):
+        for triples in (loader.load_interaction_data_streaming(chunk_size=2),
+                        loader.load_interaction_data_aggregated(chunk_size=2)):
+            loaded = _as_dict(triples)
+            assert loaded[(big_user, big_product)] == 4.0
+            assert loaded[(1, 2 ** 32 + 1)] == 2.0
+            assert loaded[(1, 1)] == 5.0
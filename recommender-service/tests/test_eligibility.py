@@ -0,0 +1,149 @@
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from unittest.mock import MagicMock, patch
+
+from app.models.db import Base
+from app.models.product import Product, Category
+
+from app.services.eligibility import FallbackProductSets, ProductCatalog, ProductFilter
+from app.services.id_encoder import IdEncoder
+from app.services.popularity import PopularityIndex
+from app.services.recommender_logic import Recommender, ItemBasedRecommender
+from app.services.item_similarity import ItemSimilarityIndex
+from tests.test_recommender import build_snapshot
+
+# products 100..103：101 缺貨；100、102 屬於分類 1，101、103 屬於分類 2
+CATALOG = ProductCatalog(
+    np.array([100, 101, 102, 103], dtype=np.int64),
+    np.array([True, False, True, True]),
+    np.array([1, 2, 1, 2], dtype=np.int64),
+)
+
+
+def test_masks_align_to_encoder_positions_and_are_cached():
+    encoder = IdEncoder(np.array([103, 999, 100, 101], dtype=np.int64))
+    masks = CATALOG.masks_for(encoder)
+    assert CATALOG.masks_for(encoder) is masks
+
+    assert masks.mask(ProductFilter(), encoder).tolist() == [True, False, True, False]
+    assert masks.mask(ProductFilter(in_stock_only=False), encoder).tolist() == [True, False, True, True]
+    assert masks.mask(ProductFilter(category_id=2, in_stock_only=False), encoder).tolist() == [True, False, False, True]
+    assert masks.mask(ProductFilter(category_id=42), encoder).tolist() == [False] * 4
+    assert masks.mask(ProductFilter(exclude_product_ids=(103, 555)), encoder).tolist() == [False, False, True, False]
+    # 排除條件不可修改共用的遮罩
+    assert masks.in_stock.tolist() == [True, False, True, False]
+
+
+def test_empty_catalog_marks_everything_ineligible():
+    empty = ProductCatalog(np.array([], dtype=np.int64), np.array([], dtype=bool), np.array([], dtype=np.int64))
+    assert empty.eligible([100, 101], ProductFilter(in_stock_only=False)).tolist() == [False, False]
+
+
+POPULARITY = PopularityIndex(np.array([101, 103, 100, 102], dtype=np.int64), {2: np.array([101, 103], dtype=np.int64)})
+
+
+def test_recommend_for_user_applies_filter_before_top_k():
+    recommender = Recommender(MagicMock(), snapshot=build_snapshot(), popularity=POPULARITY, catalog=CATALOG)
+
+    # user 30 的鄰居推薦 100、101；101 缺貨，預設只推薦有庫存的商品
+    assert recommender.recommend_for_user(30, 2) == [100]
+    assert recommender.recommend_for_user(30, 2, ProductFilter(in_stock_only=False)) == [100, 101]
+    # 篩選後沒有結果時，熱門商品備援套用同樣的條件
+    assert recommender.recommend_for_user(10, 2, ProductFilter(category_id=2)) == [103]
+    assert recommender.recommend_for_users([10, 30, 99], 2, ProductFilter(category_id=2)) == {10: [103], 30: [103], 99: [103]}
+
+
+def test_item_based_recommender_uses_masks_aligned_to_its_index():
+    snapshot = build_snapshot()
+    index = ItemSimilarityIndex.build(snapshot.interaction_matrix, snapshot.products.ids, num_neighbours=3)
+    recommender = ItemBasedRecommender(MagicMock(), snapshot=snapshot, item_index=index,
+                                       popularity=POPULARITY, catalog=CATALOG)
+
+    assert recommender.recommend_for_user(30, 4) == [100]
+    assert recommender.recommend_for_user(30, 4, ProductFilter(in_stock_only=False)) == [100, 101]
+    assert recommender.recommend_for_user(10, 4, ProductFilter(exclude_product_ids=(102,))) == [103, 100]
+
+
+def test_popularity_top_skips_ineligible_products():
+    product_filter = ProductFilter(exclude_product_ids=(100,))
+    eligible = lambda product_ids: CATALOG.eligible(product_ids, product_filter)
+
+    assert POPULARITY.top(2, eligible=eligible) == [103, 102]
+    assert POPULARITY.top(5, category_id=2, eligible=eligible) == [103]
+
+
+def build_database():
+    # 與 CATALOG 相同的商品：101 缺貨；100、102 屬於分類 1，101、103 屬於分類 2
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    db.add_all([Category(id=1, name="Electronics"), Category(id=2, name="Books")])
+    db.flush()
+    db.add_all([Product(id=product_id, name=f"Product {product_id}", description="", price=1.0, stock=stock,
+                        category_id=category_id)
+                for product_id, stock, category_id in ((100, 5, 1), (101, 0, 2), (102, 5, 1), (103, 5, 2))])
+    db.commit()
+    return db
+
+
+def test_database_fallback_applies_stock_and_exclude_filters():
+    db = build_database()
+    # 沒有熱門排行也沒有 catalog 時改查資料庫，庫存與排除條件仍須套用
+    recommender = Recommender(db, snapshot=build_snapshot())
+    assert recommender.get_popular_products(4) == [100, 102, 103]
+    assert recommender.get_popular_products(4, product_filter=ProductFilter(exclude_product_ids=(102,))) == [100, 103]
+    db.close()
+
+
+def test_missing_catalog_filters_without_rebuilding_it_per_request():
+    db = build_database()
+    recommender = Recommender(db, snapshot=build_snapshot(), popularity=POPULARITY)
+
+    with patch.object(ProductCatalog, "build", side_effect=AssertionError("catalog rebuilt on the request path")):
+        # user 30 的鄰居推薦 100、101：分類以單一查詢篩選（含庫存），排除條件在記憶體中套用
+        assert recommender.recommend_for_user(30, 2, ProductFilter(category_id=1)) == [100]
+        assert recommender.recommend_for_user(30, 2, ProductFilter(exclude_product_ids=(100,), in_stock_only=False)) == [101]
+    db.close()
+
+
+def test_missing_catalog_still_applies_stock_filter_on_every_path():
+    db = build_database()
+    recommender = Recommender(db, snapshot=build_snapshot(), popularity=POPULARITY)
+
+    with patch.object(ProductCatalog, "build", side_effect=AssertionError("catalog rebuilt on the request path")):
+        # 協同過濾：user 30 的鄰居推薦 100、101，101 缺貨
+        assert recommender.recommend_for_user(30, 2) == [100]
+        assert recommender.recommend_for_user(30, 2, ProductFilter(in_stock_only=False)) == [100, 101]
+        # 只有排除條件時仍套用庫存條件：排除 100 後只剩缺貨的 101，改由熱門商品備援
+        assert recommender.recommend_for_user(30, 2, ProductFilter(exclude_product_ids=(100,))) == [103, 102]
+        # 熱門商品備援：排行第一的 101 缺貨，與協同過濾同樣略過
+        assert recommender.recommend_for_user(99, 2) == [103, 100]
+        assert recommender.get_popular_products(2, product_filter=ProductFilter(exclude_product_ids=(103,))) == [100, 102]
+        assert recommender.get_popular_products(1, product_filter=ProductFilter(in_stock_only=False)) == [101]
+    db.close()
+
+
+def test_missing_catalog_fallback_sets_are_shared_across_requests():
+    db = build_database()
+    fallback_sets = FallbackProductSets(ttl_seconds=60)
+    Recommender(db, snapshot=build_snapshot(), popularity=POPULARITY, fallback_sets=fallback_sets) \
+        .recommend_for_user(30, 2, ProductFilter(category_id=1))
+    Recommender(db, snapshot=build_snapshot(), popularity=POPULARITY, fallback_sets=fallback_sets) \
+        .recommend_for_user(30, 2)
+
+    # 之後的請求（預設的庫存條件與分類請求）都直接使用共用的 ID 集合，不再查詢資料庫
+    recommender = Recommender(MagicMock(), snapshot=build_snapshot(), popularity=POPULARITY, fallback_sets=fallback_sets)
+    recommender.db.query.side_effect = AssertionError("queried the database")
+    assert recommender.recommend_for_user(30, 2) == [100]
+    assert recommender.recommend_for_user(30, 2, ProductFilter(category_id=1)) == [100]
+    assert recommender.recommend_for_user(99, 2) == [103, 100]
+
+    # 過期後重新查詢
+    expired = FallbackProductSets(ttl_seconds=0)
+    load = MagicMock(return_value=np.array([101], dtype=np.int64))
+    expired.get("out_of_stock", load)
+    expired.get("out_of_stock", load)
+    assert load.call_count == 2
+    db.close()
@@ -0,0 +1,67 @@
+import time
+import pytest
+
+from app.services.metrics import MetricsRegistry, _Metric
+from app.services.profiler import SlowRequestProfiler
+
+
+def test_render_counters_and_histograms():
+    registry = MetricsRegistry()
+    requests = registry.counter("cache_requests_total", "Cache lookups.", ["tier", "result"])
+    requests.inc(tier="local", result="hit")
+    requests.inc(2, tier="redis", result="miss")
+    latency = registry.histogram("stage_seconds", "Stage latency.", ["stage"], buckets=(0.01, 0.1))
+    latency.observe(0.005, stage="scoring")
+    latency.observe(0.05, stage="scoring")
+    latency.observe(1.0, stage="scoring")
+
+    lines = registry.render().splitlines()
+    assert "# TYPE cache_requests_total counter" in lines
+    assert 'cache_requests_total{tier="local",result="hit"} 1' in lines
+    assert 'cache_requests_total{tier="redis",result="miss"} 2' in lines
+    # 分桶為累積計數，+Inf 等於總次數
+    assert 'stage_seconds_bucket{stage="scoring",le="0.01"} 1' in lines
+    assert 'stage_seconds_bucket{stage="scoring",le="0.1"} 2' in lines
+    assert 'stage_seconds_bucket{stage="scoring",le="+Inf"} 3' in lines
+    assert 'stage_seconds_count{stage="scoring"} 3' in lines
+    assert latency.count(stage="scoring") == 3
+
+
+def test_registering_twice_returns_the_same_metric():
+    registry = MetricsRegistry()
+    counter = registry.counter("fallbacks_total", "Fallbacks.", ["reason"])
+    assert registry.counter("fallbacks_total", "Fallbacks.", ["reason"]) is counter
+    counter.inc(reason="unknown_user")
+    assert counter.value(reason="unknown_user") == 1
+
+
+def test_metric_types_must_implement_render():
+    with pytest.raises(TypeError):
+        _Metric("incomplete", "No render implementation.")
+
+
+def test_callback_gauge_is_read_at_render_time():
+    registry = MetricsRegistry()
+    state = {"depth": None}
+    registry.gauge("queue_depth", "Queue depth.", callback=lambda: state["depth"])
+    assert not [line for line in registry.render().splitlines() if line.startswith("queue_depth")]
+    state["depth"] = 7
+    assert "queue_depth 7" in registry.render().splitlines()
+
+
+def test_slow_request_profiler_reports_sampled_stacks():
+    profiler = SlowRequestProfiler(threshold_seconds=0.02, interval_seconds=0.001)
+    reports = []
+    profiler.add_listener(lambda name, duration, report: reports.append((name, report)))
+    try:
+        started_at = profiler.start()
+        deadline = time.monotonic() + 0.05
+        while time.monotonic() < deadline:
+            sum(range(1000))
+        assert profiler.finish(started_at, "GET /slow")
+        assert profiler.finish(profiler.start(), "GET /fast") is None
+    finally:
+        profiler.stop()
+
+    assert [name for name, _ in reports] == ["GET /slow"]
+    assert any("test_slow_request_profiler_reports_sampled_stacks" in stack for stack, _ in reports[0][1])
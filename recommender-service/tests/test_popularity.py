@@ -0,0 +1,77 @@
+import datetime
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.models.db import Base
+from app.models.user import User
+from app.models.product import Product, Category
+from app.models.order import Order, OrderItem
+from app.services.popularity import PopularityIndex
+from app.services.recommender_logic import Recommender
+from app.services.model_store import ModelStore
+
+engine = create_engine("sqlite:///:memory:", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+NOW = pd.Timestamp("2024-06-30")
+
+
+@pytest.fixture(name="session")
+def session_fixture():
+    Base.metadata.create_all(bind=engine)
+    db = TestingSessionLocal()
+    try:
+        books, games = Category(name="Books"), Category(name="Games")
+        db.add_all([books, games])
+        db.commit()
+        user = User(name="Buyer", email="buyer@example.com", password="hashed")
+        products = [Product(name=f"Product {i}", price=10.0, stock=5, category_id=(books.id if i < 2 else games.id))
+                    for i in range(4)]
+        db.add_all([user] + products)
+        db.commit()
+
+        order = Order(user_id=user.id, order_number="ORD-1", total_amount=10.0, status="completed")
+        db.add(order)
+        db.commit()
+        # 商品 1：很久以前賣出 10 件；商品 2：最近賣出 3 件；商品 3：最近賣出 1 件；商品 4 沒有銷量
+        sales = [(0, 10, datetime.datetime(2023, 6, 30)), (1, 3, datetime.datetime(2024, 6, 29)),
+                 (2, 1, datetime.datetime(2024, 6, 29))]
+        for product_pos, quantity, created_at in sales:
+            db.add(OrderItem(order_id=order.id, product_id=products[product_pos].id, quantity=quantity,
+                             price=10.0, created_at=created_at))
+        db.commit()
+        yield db
+    finally:
+        db.close()
+        Base.metadata.drop_all(bind=engine)
+
+
+def test_popularity_without_decay_matches_database_query(session):
+    index = PopularityIndex.build(session, half_life_days=0)
+    expected = Recommender(session).get_popular_products(4)
+    assert index.top(4) == expected == [1, 2, 3, 4]
+
+
+def test_model_store_popularity_reproduces_baseline_ranking_by_default(session):
+    # 預設不衰減：預先計算的排行與原本查詢資料庫的冷啟動排序相同
+    model_store = ModelStore(session_factory=lambda: session, refresh_interval_seconds=0)
+    assert model_store.get_popularity().top(4) == Recommender(session).get_popular_products(4)
+
+
+def test_popularity_decay_favours_recent_sales(session):
+    index = PopularityIndex.build(session, half_life_days=30, now=NOW)
+    assert index.top(4) == [2, 3, 1, 4]
+    assert index.top(2, exclude=[2]) == [3, 1]
+
+
+def test_popularity_per_category(session):
+    index = PopularityIndex.build(session, half_life_days=30, now=NOW)
+    assert index.top(5, category_id=1) == [2, 1]
+    assert index.top(5, category_id=2) == [3, 4]
+    assert index.top(5, category_id=99) == []
+
+    recommender = Recommender(session, popularity=index)
+    assert recommender.get_popular_products(1, category_id=2) == [3]
@@ -0,0 +1,175 @@
+import time
+import numpy as np
+from scipy import sparse
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from unittest.mock import MagicMock, patch
+
+from app.core.config import settings
+from app.data.data_loader import InteractionWatermark
+from app.models.db import Base
+from app.models.user import User
+from app.models.product import Product, Category
+from app.models.order import Order, OrderItem
+from app.services.artifacts import ModelArtifactStore
+from app.services.eligibility import ProductCatalog
+from app.services.model_snapshot import ModelSnapshot
+from app.services.model_store import ModelStore
+from app.services.popularity import PopularityIndex
+from app.services.precompute import PrecomputeCheckpoint, create_redis_client, precompute_recommendations
+from app.services.ranked_list import RankedList
+from app.services.scoring import normalize_rows
+from app.services.sharding import ShardRouter
+
+
+CATALOG = ProductCatalog(np.arange(100, 107), np.ones(7, dtype=bool), np.full(7, -1, dtype=np.int64))
+
+
+def build_model_store():
+    # users 10..60，每個用戶與下一個用戶共享一個商品
+    dense = np.zeros((6, 7), dtype=np.float32)
+    for row in range(6):
+        dense[row, row] = 5
+        dense[row, row + 1] = 2
+    matrix = sparse.csr_matrix(dense)
+    snapshot = ModelSnapshot(1, matrix, [10, 20, 30, 40, 50, 60], list(range(100, 107)), normalize_rows(matrix))
+
+    model_store = ModelStore(session_factory=MagicMock(side_effect=AssertionError("no database")),
+                             refresh_interval_seconds=0, incremental_interval_seconds=0)
+    model_store._snapshot = snapshot
+    model_store.set_popularity(PopularityIndex(np.arange(100, 107), {}))
+    model_store.set_catalog(CATALOG)
+    return model_store
+
+
+def test_precompute_writes_every_user_with_pipelines(tmp_path):
+    redis_client = MagicMock()
+    pipeline = redis_client.pipeline.return_value
+
+    stats = precompute_recommendations(build_model_store(), num_recommendations=2, block_size=4,
+                                       redis_factory=lambda: redis_client,
+                                       checkpoint_path=str(tmp_path / "precompute.ckpt"))
+
+    assert stats["users"] == 6
+    assert pipeline.execute.call_count == 2  # 每個區塊一次 pipeline
+    written = {call.args[0]: RankedList.decode(call.args[1]) for call in pipeline.set.call_args_list}
+    assert set(written) == {f"user:{user_id}:recommendations" for user_id in (10, 20, 30, 40, 50, 60)}
+    # 以快取深度計算，線上請求的任何 num_recommendations（不超過深度）都可直接切片
+    assert all(ranked.depth == settings.RECOMMENDATION_CACHE_DEPTH for ranked in written.values())
+    assert all(call.kwargs["ex"] > 0 for call in pipeline.set.call_args_list)
+    assert not (tmp_path / "precompute.ckpt").exists()  # 成功完成後移除進度檔
+
+
+def _write_checkpoint(path, watermark=(0, 0), max_age_seconds=3600):
+    # shard 1/3 的用戶為 20 與 40；模擬上一次執行完成第 0 個區塊（用戶 20）後中斷
+    checkpoint = PrecomputeCheckpoint(path, {
+        "artifact": None, "model_version": 1, "watermark": list(watermark), "shard": 1, "num_shards": 3,
+        "block_size": 1, "depth": settings.RECOMMENDATION_CACHE_DEPTH,
+    }, max_age_seconds=max_age_seconds)
+    checkpoint.open()
+    checkpoint.mark_done(0)
+    checkpoint.close()
+
+
+def _precompute_shard_1(model_store, checkpoint_path):
+    redis_client = MagicMock()
+    precompute_recommendations(model_store, num_recommendations=2, block_size=1, shard=1, num_shards=3,
+                               redis_factory=lambda: redis_client, checkpoint_path=checkpoint_path)
+    return [call.args[0] for call in redis_client.pipeline.return_value.set.call_args_list]
+
+
+def test_precompute_resumes_from_checkpoint_and_respects_shards(tmp_path):
+    checkpoint_path = str(tmp_path / "precompute.ckpt")
+    _write_checkpoint(checkpoint_path)
+    assert _precompute_shard_1(build_model_store(), checkpoint_path) == ["user:40:recommendations"]
+
+
+def test_precompute_discards_checkpoint_of_other_data_or_expired(tmp_path):
+    checkpoint_path = str(tmp_path / "precompute.ckpt")
+    everyone = ["user:20:recommendations", "user:40:recommendations"]
+
+    # 重新由資料庫建立的快照水位已前進（中斷期間有新互動），舊進度不再適用
+    _write_checkpoint(checkpoint_path)
+    model_store = build_model_store()
+    model_store._snapshot.watermark = InteractionWatermark(order_item_id=7, interaction_id=42)
+    assert _precompute_shard_1(model_store, checkpoint_path) == everyone
+
+    # 相同資料但進度檔已過期
+    _write_checkpoint(checkpoint_path)
+    with patch("app.services.precompute.time.time", return_value=time.time() + 2 * 86400):
+        assert _precompute_shard_1(build_model_store(), checkpoint_path) == everyone
+
+
+def test_precompute_reuses_published_artifact(tmp_path):
+    artifact_store = ModelArtifactStore(str(tmp_path / "artifacts"))
+    artifact_store.publish(build_model_store().snapshot)
+    model_store = ModelStore(session_factory=MagicMock(side_effect=AssertionError("no database")),
+                             refresh_interval_seconds=0, incremental_interval_seconds=0,
+                             artifact_store=artifact_store)
+    model_store.set_popularity(PopularityIndex(np.arange(100, 107), {}))
+    model_store.set_catalog(CATALOG)
+    model_store.get_snapshot()
+
+    redis_client = MagicMock()
+    with patch.object(ModelArtifactStore, "publish", side_effect=AssertionError("should reuse the artifact")):
+        stats = precompute_recommendations(model_store, num_recommendations=2, block_size=4,
+                                           redis_factory=lambda: redis_client)
+    assert stats["users"] == 6
+    assert artifact_store.list_versions() == [model_store.artifact_name]
+
+
+def test_precompute_shards_match_router_owners():
+    # 分片 k 的預先計算只寫入路由前端會轉發到分片 k 的用戶
+    router = ShardRouter([f"http://shard-{shard}" for shard in range(3)])
+    for shard in range(3):
+        redis_client = MagicMock()
+        precompute_recommendations(build_model_store(), num_recommendations=2, block_size=4, shard=shard,
+                                   num_shards=3, redis_factory=lambda: redis_client)
+        written = [call.args[0] for call in redis_client.pipeline.return_value.set.call_args_list]
+        assert written == [f"user:{user_id}:recommendations" for user_id in (10, 20, 30, 40, 50, 60)
+                           if router.shard_for(user_id) == shard]
+
+
+def test_precompute_falls_back_to_database_without_popularity_index():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(bind=engine)
+    with session_factory() as db:
+        category = Category(name="Books")
+        user = User(name="Buyer", email="buyer@example.com", password="hashed_password")
+        db.add_all([category, user])
+        db.flush()
+        products = [Product(name=f"Book {i}", description="", price=10.0, stock=5, category_id=category.id)
+                    for i in range(3)]
+        db.add_all(products)
+        db.flush()
+        order = Order(user_id=user.id, order_number="ORD-0001", total_amount=30.0, status="completed")
+        db.add(order)
+        db.flush()
+        db.add(OrderItem(order_id=order.id, product_id=products[2].id, quantity=3, price=10.0))
+        db.commit()
+        best_seller = products[2].id
+
+    # user 20 沒有任何互動紀錄，只能以熱門商品備援；父進程無法建立熱門排行（不連資料庫）
+    matrix = sparse.csr_matrix(np.array([[5, 0], [0, 0]], dtype=np.float32))
+    model_store = ModelStore(session_factory=MagicMock(side_effect=AssertionError("no database")),
+                             refresh_interval_seconds=0, incremental_interval_seconds=0)
+    model_store._snapshot = ModelSnapshot(1, matrix, [10, 20], [900, 901], normalize_rows(matrix))
+
+    redis_client = MagicMock()
+    precompute_recommendations(model_store, num_recommendations=1, block_size=10,
+                               redis_factory=lambda: redis_client, session_factory=session_factory)
+    written = {call.args[0]: RankedList.decode(call.args[1]) for call in redis_client.pipeline.return_value.set.call_args_list}
+    assert written["user:20:recommendations"].top(1) == [best_seller]
+
+
+def test_worker_redis_client_uses_shared_pool_settings():
+    with patch.object(settings, "REDIS_SOCKET_TIMEOUT_SECONDS", 1.5), patch.object(settings, "REDIS_MAX_CONNECTIONS", 7):
+        client = create_redis_client()
+    pool = client.connection_pool
+    # 與服務相同的連線池、逾時與重試設定，而不是沒有逾時的預設 client
+    assert pool.max_connections == 7
+    assert pool.connection_kwargs["socket_timeout"] == 1.5
+    assert pool.connection_kwargs["retry"] is not None
+    assert pool.connection_kwargs["decode_responses"] is False
@@ -0,0 +1,51 @@
+import asyncio
+import pytest
+
+from app.services.recalculation_queue import RecalculationQueue, RecalculationQueueFull
+
+
+def test_workers_batch_requests_from_the_same_window():
+    batches = []
+
+    async def handler(user_ids):
+        batches.append(list(user_ids))
+
+    async def run():
+        queue = RecalculationQueue(batch_size=100, batch_window_seconds=0.05)
+        queue.start(handler)
+        for user_id in range(50):
+            queue.enqueue(user_id)
+        queue.enqueue(7)  # 已在佇列中，合併
+        await asyncio.sleep(0.2)
+        await queue.stop()
+        return queue.stats()
+
+    stats = asyncio.run(run())
+    assert batches == [list(range(50))]
+    assert stats["depth"] == 0
+    assert stats["processed"] == 50
+    assert stats["batches"] == 1
+    assert stats["deduplicated"] == 1
+    assert stats["last_lag_seconds"] >= 0.05
+
+
+def test_drain_splits_batches_and_survives_handler_errors():
+    batches = []
+
+    async def handler(user_ids):
+        batches.append(list(user_ids))
+        if len(batches) == 1:
+            raise RuntimeError("scoring failed")
+
+    queue = RecalculationQueue(batch_size=2, max_pending=3)
+    for user_id in (1, 2, 3):
+        queue.enqueue(user_id)
+    with pytest.raises(RecalculationQueueFull):
+        queue.enqueue(4)
+
+    assert asyncio.run(queue.drain(handler)) == 3
+    assert batches == [[1, 2], [3]]
+    stats = queue.stats()
+    assert stats["failed_batches"] == 1
+    assert stats["processed"] == 1
+    assert stats["rejected"] == 1
@@ -0,0 +1,144 @@
+import asyncio
+import pytest
+import struct
+import numpy as np
+from unittest.mock import AsyncMock, MagicMock
+
+from app.services.ranked_list import RankedList
+from app.services.recommendation_cache import LOCAL_INVALIDATION_CHANNEL, LocalTTLCache, RecommendationCache
+
+
+def test_local_cache_evicts_least_recently_used():
+    cache = LocalTTLCache(max_entries=2, ttl_seconds=60)
+    cache.set(1, [10])
+    cache.set(2, [20])
+    assert cache.get(1) == ([10], False)  # 1 變為最近使用
+    cache.set(3, [30])
+
+    assert cache.get(2) == (None, False)
+    assert cache.get(1) == ([10], False)
+    assert cache.stats()["evictions"] == 1
+    assert len(cache) == 2
+
+
+def test_local_cache_serves_stale_then_expires():
+    cache = LocalTTLCache(max_entries=10, ttl_seconds=0, stale_ttl_seconds=60)
+    cache.set(1, [10])
+    assert cache.get(1) == ([10], True)
+
+    cache.stale_ttl_seconds = 0
+    assert cache.get(1) == (None, False)
+    assert cache.stats() == {"entries": 0, "max_entries": 10, "hits": 0, "stale_hits": 1, "misses": 1, "evictions": 0}
+
+
+def test_cache_falls_back_to_redis_and_fills_local_tier():
+    redis_client = AsyncMock()
+    redis_client.get.return_value = RankedList.create([7, 8], [0.9, 0.4], depth=10).encode()
+    cache = RecommendationCache(LocalTTLCache(max_entries=10, ttl_seconds=60), ttl_seconds=3600)
+
+    async def main():
+        for _ in range(2):
+            ranked, stale = await cache.get(redis_client, 1)
+            assert not stale and ranked.top(1) == [7] and ranked.top(5) == [7, 8]
+
+    asyncio.run(main())
+    redis_client.get.assert_awaited_once()
+    assert cache.stats()["redis"]["hits"] == 1
+    assert cache.local.hits == 1
+
+
+def test_schedule_refresh_runs_once_per_user():
+    cache = RecommendationCache(LocalTTLCache(max_entries=10, ttl_seconds=60), ttl_seconds=3600)
+    calls = []
+
+    async def refresh():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        cache.local.set(1, [99])
+
+    async def main():
+        assert cache.schedule_refresh(1, refresh)
+        assert not cache.schedule_refresh(1, refresh)  # 同一用戶已有背景更新
+        await asyncio.sleep(0.05)
+
+    asyncio.run(main())
+    assert calls == [1]
+    assert cache.local.get(1) == ([99], False)
+    assert cache.stats()["refreshing"] == 0
+
+
+def test_ranked_list_binary_roundtrip():
+    ranked = RankedList.create([5, 3, 2**40], [0.75, 0.5, 0.25], depth=20, model_version=7, computed_at=1700000000.5)
+    data = ranked.encode()
+    assert len(data) == 24 + 3 * 12
+
+    decoded = RankedList.decode(data)
+    assert decoded.top(2) == [5, 3] and decoded.top(50) == [5, 3, 2**40]
+    np.testing.assert_array_equal(decoded.scores, np.array([0.75, 0.5, 0.25], dtype=np.float32))
+    assert (decoded.depth, decoded.model_version, decoded.computed_at) == (20, 7, 1700000000.5)
+    assert decoded.covers(20) and not decoded.covers(21)
+
+    # 升級前寫入的 JSON 或截斷的資料視為未命中
+    assert RankedList.decode(b"[5, 3, 2]") is None
+    assert RankedList.decode(data[:-4]) is None
+    # 格式版本 1（商品 ID 為 int32）的舊資料同樣視為未命中
+    legacy = struct.pack("<2sBxIdII", b"RL", 1, 7, 1700000000.5, 20, 1) + np.array([5], "<i4").tobytes() \
+        + np.array([0.75], "<f4").tobytes()
+    assert RankedList.decode(legacy) is None
+
+
+
+def test_recalculated_users_are_dropped_from_other_workers_local_tier():
+    # 兩個 worker 各自有本地快取，共用同一個 Redis
+    worker_a = RecommendationCache(LocalTTLCache(max_entries=10, ttl_seconds=60), ttl_seconds=3600)
+    worker_b = RecommendationCache(LocalTTLCache(max_entries=10, ttl_seconds=60), ttl_seconds=3600)
+    old, new = RankedList.create([7], [0.9], depth=10), RankedList.create([8], [0.9], depth=10)
+    worker_b.local.set(1, old)
+    worker_b.local.set(2, old)
+
+    redis_client = MagicMock()
+    pipeline = redis_client.pipeline.return_value
+    pipeline.execute = AsyncMock()
+    assert asyncio.run(worker_a.set_many(redis_client, {1: new}, notify_peers=True))
+    channel, message = pipeline.publish.call_args.args
+    assert channel == LOCAL_INVALIDATION_CHANNEL
+
+    # 發布者自己的本地快取已是新值，不需刪除；其他 worker 只刪除被重算的用戶
+    assert worker_a.handle_invalidation(message.encode()) == []
+    assert worker_a.local.get(1) == (new, False)
+    assert worker_b.handle_invalidation(message.encode()) == [1]
+    assert worker_b.local.get(1) == (None, False)
+    assert worker_b.local.get(2) == (old, False)
+    assert worker_b.stats()["invalidations_received"] == 1
+
+    # 一般的批次寫入（未命中時補上快取）不發布通知
+    pipeline.publish.reset_mock()
+    asyncio.run(worker_a.set_many(redis_client, {2: new}))
+    pipeline.publish.assert_not_called()
+
+
+def test_invalidation_listener_applies_messages_until_cancelled():
+    cache = RecommendationCache(LocalTTLCache(max_entries=10, ttl_seconds=60), ttl_seconds=3600)
+    cache.local.set(3, [30])
+    pubsub = MagicMock()
+    pubsub.subscribe = AsyncMock()
+    pubsub.reset = AsyncMock()
+    pubsub.get_message = AsyncMock(side_effect=[None, {"data": b"other-worker:3"}, ConnectionError("down"),
+                                                {"data": b"other-worker:4"}, None, None, None])
+    redis_client = MagicMock()
+    redis_client.pubsub.return_value = pubsub
+
+    async def main():
+        task = asyncio.get_running_loop().create_task(
+            cache.listen_for_invalidations(redis_client, poll_seconds=0, retry_seconds=0))
+        while cache.invalidations_received < 2:
+            await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert cache.local.get(3) == (None, False)
+    # 連線中斷後重新訂閱
+    assert pubsub.subscribe.await_count == 2
+    assert pubsub.reset.await_count == 2
@@ -0,0 +1,350 @@
+import os
+import json
+import numpy as np
+import pytest
+from scipy import sparse
+from unittest.mock import MagicMock, patch
+
+from app.core.config import settings
+from app.services.model_snapshot import ModelSnapshot
+from app.services.recommender_logic import Recommender, ItemBasedRecommender, ALSRecommender
+from app.services.item_similarity import ItemSimilarityIndex
+from app.services.als import ALSModel
+from app.services.ann import RandomProjectionLSH
+from app.services.artifacts import ModelArtifactStore
+from app.services.atomic_directory import atomic_directory, resolve
+from app.services.id_encoder import IdEncoder
+from app.services.model_store import ModelStore
+from app.services.scoring import NeighbourScorer, normalize_rows
+
+# users 10, 20, 30; products 100..103
+USER_IDS = [10, 20, 30]
+PRODUCT_IDS = [100, 101, 102, 103]
+DENSE = np.array([
+    [5, 3, 0, 0],
+    [5, 3, 4, 0],
+    [0, 0, 2, 5],
+], dtype=np.float32)
+
+
+def build_snapshot():
+    matrix = sparse.csr_matrix(DENSE)
+    return ModelSnapshot(1, matrix, USER_IDS, PRODUCT_IDS, normalize_rows(matrix))
+
+
+def test_id_encoder_encodes_columns_and_keeps_positions_when_extended():
+    encoder = IdEncoder(np.array([3, 10, 42], dtype=np.int64))
+    assert encoder.encode([42, 5, 3]).tolist() == [2, -1, 0]
+    assert encoder.encode_one(10) == 1 and encoder.encode_one(11) is None
+    assert encoder.decode([2, 0]).tolist() == [42, 3]
+
+    # 新 ID 附加在尾端，既有位置不變；尾端 ID 較小時改以排序索引查找
+    extended = encoder.extend([7, 42, 100])
+    assert extended.tolist() == [3, 10, 42, 7, 100]
+    assert extended.encode([7, 100, 3, 8]).tolist() == [3, 4, 0, -1]
+    assert 7 in extended and 7 not in encoder
+    assert encoder.extend([3]) is encoder
+
+
+def test_incremental_interactions_only_touch_changed_rows():
+    rng = np.random.default_rng(0)
+    dense = (rng.random((50, 30)) < 0.2) * rng.integers(1, 6, size=(50, 30))
+    matrix = sparse.csr_matrix(dense.astype(np.float32))
+    snapshot = ModelSnapshot(1, matrix, np.arange(50) * 10, np.arange(30) + 100, normalize_rows(matrix))
+
+    # 既有用戶的新互動（含比既有分數低的一筆）、新用戶，以及新商品
+    user_ids = np.array([0, 0, 130, 490, 9999, 9999])
+    product_ids = np.array([100, 129, 105, 500, 100, 500])
+    values = np.array([5, 5, 0.5, 2, 3, 1], dtype=np.float32)
+    updated, affected = snapshot.with_interactions(user_ids, product_ids, values, 2, snapshot.watermark)
+
+    expected = np.zeros((51, 31), dtype=np.float32)
+    expected[:50, :30] = dense
+    for user_id, product_id, value in zip(user_ids, product_ids, values):
+        row, column = updated.users.encode_one(user_id), updated.products.encode_one(product_id)
+        expected[row, column] = max(expected[row, column], value)
+    assert np.array_equal(updated.interaction_matrix.toarray(), expected)
+    assert np.allclose(updated.normalized_matrix.toarray(), normalize_rows(sparse.csr_matrix(expected)).toarray())
+    original = np.zeros_like(expected)
+    original[:50, :30] = dense
+    changed = updated.users.decode(np.flatnonzero((expected != original).any(axis=1))).tolist()
+    assert affected == changed and 9999 in affected and 130 not in affected  # 分數較低的互動不改變該列
+    assert np.array_equal(snapshot.interaction_matrix.toarray(), dense)  # 原快照不變
+
+    # 再次套用相同的資料沒有任何變動：不產生新版本，只推進水位
+    again, affected = updated.with_interactions(user_ids, product_ids, values, 3, updated.watermark._replace(interaction_id=9))
+    assert affected == [] and again.version == 2 and again.watermark.interaction_id == 9
+    assert again.interaction_matrix is updated.interaction_matrix
+
+
+def test_similarity_stays_sparse():
+    matrix = sparse.csr_matrix(DENSE)
+    user_similarity = Recommender(MagicMock()).calculate_similarity(matrix)
+    assert sparse.issparse(user_similarity)
+    assert user_similarity.shape == (3, 3)
+
+
+def test_neighbour_scorer_matches_full_cosine_row():
+    snapshot = build_snapshot()
+    full = Recommender(MagicMock()).calculate_similarity(snapshot.interaction_matrix).toarray()
+    scorer = NeighbourScorer(snapshot.interaction_matrix, snapshot.normalized_matrix, num_neighbours=1)
+
+    neighbour_indices, neighbour_scores = scorer.neighbours(1)
+    assert neighbour_indices.tolist() == [0]
+    assert np.isclose(neighbour_scores[0], full[1, 0])
+
+
+def test_recommend_for_user_excludes_seen_products():
+    recommender = Recommender(MagicMock(), snapshot=build_snapshot())
+
+    # user 10 與 user 20 最相似，應推薦 user 20 互動過但 user 10 未看過的 102
+    assert recommender.recommend_for_user(10, 2) == [102]
+    assert recommender.recommend_for_user(20, 2) == [103]
+
+
+def test_item_index_roundtrip_and_recommend(tmp_path):
+    snapshot = build_snapshot()
+    item_index = ItemSimilarityIndex.build(snapshot.interaction_matrix, PRODUCT_IDS, num_neighbours=2)
+    item_index.save(str(tmp_path / "item_index"))
+
+    loaded = ItemSimilarityIndex.load(str(tmp_path / "item_index"))
+    assert isinstance(loaded.neighbours, np.memmap)
+    assert np.array_equal(loaded.neighbours, item_index.neighbours)
+
+    recommender = ItemBasedRecommender(MagicMock(), snapshot=snapshot, item_index=loaded)
+    # user 10 看過 100、101，兩者都與 102 有共同用戶
+    assert recommender.recommend_for_user(10, 2) == [102]
+
+
+def test_recommend_batch_matches_single_user_scoring():
+    snapshot = build_snapshot()
+    scorer = NeighbourScorer(snapshot.interaction_matrix, snapshot.normalized_matrix, num_neighbours=2)
+
+    batch = scorer.recommend_batch(np.array([0, 1, 2]), 3)
+    for user_idx, (indices, scores) in enumerate(batch):
+        single_indices, single_scores = scorer.recommend(user_idx, 3)
+        assert indices.tolist() == single_indices.tolist()
+        assert np.allclose(scores, single_scores)
+
+
+def test_atomic_directory_keeps_previous_version_when_writing_fails(tmp_path):
+    directory = str(tmp_path / "index")
+    with atomic_directory(directory) as version_directory:
+        with open(os.path.join(version_directory, "data.txt"), "w") as f:
+            f.write("v1")
+    first_version = os.path.realpath(directory)
+
+    with pytest.raises(RuntimeError):
+        with atomic_directory(directory) as version_directory:
+            with open(os.path.join(version_directory, "data.txt"), "w") as f:
+                f.write("v2")
+            raise RuntimeError("disk full")
+    assert (tmp_path / "index" / "data.txt").read_text() == "v1"
+    assert os.listdir(str(tmp_path / "index.versions")) == [os.path.basename(first_version)]
+
+
+def test_atomic_directory_switches_versions_through_a_symlink(tmp_path):
+    directory = str(tmp_path / "index")
+    # 舊版以實體目錄存放的資料在第一次寫入時移入版本目錄
+    os.makedirs(directory)
+    (tmp_path / "index" / "data.txt").write_text("v0")
+
+    with patch("app.services.atomic_directory.os.rename", wraps=os.rename) as rename:
+        for version in ("v1", "v2", "v3"):
+            with atomic_directory(directory, keep_versions=2) as version_directory:
+                with open(os.path.join(version_directory, "data.txt"), "w") as f:
+                    f.write(version)
+            # 之後的切換只替換 symbolic link，directory 不會有不存在的時間點
+            assert os.path.islink(directory) and (tmp_path / "index" / "data.txt").read_text() == version
+    assert rename.call_count == 1
+
+    versions = sorted(os.listdir(str(tmp_path / "index.versions")))
+    assert len(versions) == 2 and os.path.realpath(directory).endswith(versions[-1])
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["index", "index.versions"]
+
+
+def test_als_roundtrip_and_recommend(tmp_path):
+    snapshot = build_snapshot()
+    als_model = ALSModel.train(snapshot.interaction_matrix, USER_IDS, PRODUCT_IDS, factors=2, regularization=0.01,
+                               iterations=10, num_threads=2)
+    als_model.save(str(tmp_path / "als"))
+
+    loaded = ALSModel.load(str(tmp_path / "als"))
+    assert isinstance(loaded.item_factors, np.memmap)
+    assert loaded.item_factors.dtype == np.float32 and loaded.item_factors.flags['C_CONTIGUOUS']
+
+    recommender = ALSRecommender(MagicMock(), snapshot=snapshot, als_model=loaded)
+    # user 10 與 user 20 的口味相近，未看過的商品中 102 應排在 103 之前
+    assert recommender.recommend_for_user(10, 2) == [102, 103]
+    assert recommender.recommend_for_users([10, 20], 2) == {10: [102, 103], 20: [103]}
+
+
+def test_als_fold_in_for_users_missing_from_model():
+    snapshot = build_snapshot()
+    als_model = ALSModel.train(snapshot.interaction_matrix, USER_IDS, PRODUCT_IDS, factors=2, regularization=0.01,
+                               iterations=10, num_threads=1)
+    folded = als_model.user_vector(99, [100, 101], np.array([5, 3], dtype=np.float32))
+
+    # 與直接求解 (YᵀCY + λI) x = YᵀCp 的結果一致
+    item_factors = als_model.item_factors.astype(np.float64)
+    confidence = 1 + 40.0 * DENSE[0]
+    preference = (DENSE[0] > 0).astype(np.float64)
+    expected = np.linalg.solve(item_factors.T @ (item_factors * confidence[:, None]) + 0.01 * np.eye(2),
+                               item_factors.T @ (confidence * preference))
+    assert np.allclose(folded, expected, atol=1e-4)
+    assert als_model.user_vector(99) is None
+    # YᵀY 在建立模型時已算好，fold-in 直接使用
+    assert np.allclose(als_model.item_gram, item_factors.T @ item_factors)
+
+
+def test_ann_index_roundtrip_and_recall(tmp_path):
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((20, 16))
+    vectors = (centers[rng.integers(0, 20, 2000)] + 0.2 * rng.standard_normal((2000, 16))).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    ann_index = RandomProjectionLSH.build(vectors, num_tables=6, num_bits=10)
+    ann_index.save(str(tmp_path / "ann"))
+    loaded = RandomProjectionLSH.load(str(tmp_path / "ann"))
+    assert isinstance(loaded.codes, np.memmap)
+
+    hits = 0
+    for query_idx in range(50):
+        positions, _ = loaded.query(vectors[query_idx], vectors, 10, num_probes=2)
+        exact = np.argsort(-(vectors @ vectors[query_idx]))[:10]
+        hits += len(set(positions.tolist()) & set(exact.tolist()))
+    assert hits / 500 >= 0.9
+
+
+def test_ann_index_on_wide_sparse_vectors_does_not_materialize_hyperplanes(tmp_path):
+    # 維度為商品數的用戶互動列：稠密超平面需 128 × 5,000,000 × 4 bytes，改以雜湊符號只處理用到的欄位
+    rng = np.random.default_rng(0)
+    dim = 5_000_000
+    columns = rng.integers(0, dim, 50)
+    rows = np.repeat(np.arange(200), 5)
+    vectors = sparse.csr_matrix((np.ones(rows.size, dtype=np.float32),
+                                 (rows, columns[rng.integers(0, 50, rows.size)])), shape=(200, dim))
+
+    ann_index = RandomProjectionLSH.build(vectors, num_tables=8, num_bits=16)
+    assert not hasattr(ann_index, "hyperplanes")
+    ann_index.save(str(tmp_path / "ann"))
+    loaded = RandomProjectionLSH.load(str(tmp_path / "ann"))
+    # 載入後由種子重現相同的超平面：每個向量都落在自己的桶中，並以自己為最相似的結果
+    normalized = normalize_rows(vectors)
+    for row in range(0, 200, 20):
+        positions, scores = loaded.query(vectors[row], normalized, 1)
+        assert scores[0] == pytest.approx(np.sqrt(vectors[row].multiply(vectors[row]).sum()))
+
+    # 以稠密超平面建立的舊格式索引無法重現，需重新建立
+    meta_path = os.path.join(resolve(str(tmp_path / "ann")), RandomProjectionLSH.META_FILE)
+    with open(meta_path, "w") as f:
+        json.dump({"dim": 16, "num_bits": 10}, f)
+    with pytest.raises(ValueError):
+        RandomProjectionLSH.load(str(tmp_path / "ann"))
+
+
+def test_neighbour_scorer_with_ann_index_matches_exact_scoring():
+    snapshot = build_snapshot()
+    # 位元數少、探查所有位元時每個用戶都會成為候選，結果應與精確計分一致
+    ann_index = RandomProjectionLSH.build(snapshot.normalized_matrix, num_tables=2, num_bits=2)
+    exact = NeighbourScorer(snapshot.interaction_matrix, snapshot.normalized_matrix, num_neighbours=2)
+    approximate = NeighbourScorer(snapshot.interaction_matrix, snapshot.normalized_matrix, num_neighbours=2,
+                                  ann_index=ann_index, ann_num_probes=2)
+
+    for user_idx in range(len(USER_IDS)):
+        assert approximate.recommend(user_idx, 3)[0].tolist() == exact.recommend(user_idx, 3)[0].tolist()
+    batch = approximate.recommend_batch(np.array([0, 1, 2]), 3)
+    assert [indices.tolist() for indices, _ in batch] == [exact.recommend(i, 3)[0].tolist() for i in range(3)]
+
+
+def test_model_artifact_publish_and_mmap_load(tmp_path):
+    snapshot = build_snapshot()
+    item_index = ItemSimilarityIndex.build(snapshot.interaction_matrix, PRODUCT_IDS, num_neighbours=2)
+    artifact_store = ModelArtifactStore(str(tmp_path / "artifacts"), keep_versions=2)
+    first = artifact_store.publish(snapshot, item_index=item_index)
+    assert artifact_store.current_version() == first
+
+    artifact = artifact_store.load(version=7)
+    assert artifact.snapshot.version == 7
+    assert artifact.snapshot.all_user_ids.tolist() == USER_IDS
+    assert not artifact.snapshot.interaction_matrix.data.flags.writeable  # 直接參照唯讀的 memory map，未複製
+    assert np.array_equal(artifact.snapshot.interaction_matrix.toarray(), DENSE)
+    assert np.allclose(artifact.snapshot.normalized_matrix.toarray(), snapshot.normalized_matrix.toarray())
+    assert np.array_equal(artifact.item_index.neighbours, item_index.neighbours)
+
+    # 舊版本依 keep_versions 清除，CURRENT 指向最新版本
+    names = [artifact_store.publish(snapshot) for _ in range(2)]
+    assert artifact_store.list_versions() == names
+    assert artifact_store.current_version() == names[-1]
+
+
+def test_model_store_loads_published_artifact_without_database(tmp_path):
+    artifact_store = ModelArtifactStore(str(tmp_path / "artifacts"))
+    artifact_store.publish(build_snapshot())
+    session_factory = MagicMock(side_effect=AssertionError("database should not be used"))
+    model_store = ModelStore(session_factory=session_factory, refresh_interval_seconds=0,
+                             artifact_store=artifact_store)
+
+    first = model_store.get_snapshot()
+    assert first.all_product_ids.tolist() == PRODUCT_IDS
+    assert model_store.refresh() is first  # CURRENT 未變更時沿用已載入的版本
+
+    artifact_store.publish(build_snapshot())
+    assert model_store.refresh() is not first
+
+
+def test_model_store_rebuilds_in_memory_item_models_on_full_refresh(tmp_path):
+    artifact_store = ModelArtifactStore(str(tmp_path / "artifacts"))
+    artifact_store.publish(build_snapshot())
+    session_factory = MagicMock(side_effect=AssertionError("database should not be used"))
+
+    with patch.object(settings, "ITEM_INDEX_DIR", str(tmp_path / "missing-index")), \
+            patch.object(settings, "ALS_MODEL_DIR", str(tmp_path / "missing-als")):
+        for mode in ("item_based", "als"):
+            with patch.object(settings, "RECOMMENDER_MODE", mode):
+                model_store = ModelStore(session_factory=session_factory, refresh_interval_seconds=0,
+                                         artifact_store=artifact_store)
+                model_store.get_snapshot()
+                first_index, first_als = model_store.get_item_index(), model_store.get_als_model()
+                assert model_store.refresh() is model_store.get_snapshot()  # 版本未變更時不重建
+                assert model_store.get_item_index() is first_index and model_store.get_als_model() is first_als
+
+                # 新版本多了 user 40，商品 100 與 103 開始有共同互動
+                matrix = sparse.csr_matrix(np.vstack([DENSE, [[4, 0, 0, 5]]]))
+                artifact_store.publish(ModelSnapshot(1, matrix, USER_IDS + [40], PRODUCT_IDS, normalize_rows(matrix)))
+                model_store.refresh()
+
+                if mode == "item_based":
+                    item_index = model_store.get_item_index()
+                    assert 3 not in first_index.neighbours[0] and 3 in item_index.neighbours[0]
+                else:
+                    als_model = model_store.get_als_model()
+                    assert als_model is not first_als
+                    assert 40 in als_model.user_ids.tolist()
+
+
+def test_user_ann_index_is_built_with_the_snapshot_and_published(tmp_path):
+    artifact_store = ModelArtifactStore(str(tmp_path / "artifacts"))
+    artifact_store.publish(build_snapshot())
+    session_factory = MagicMock(side_effect=AssertionError("database should not be used"))
+
+    with patch.object(settings, "ANN_ENABLED", True), patch.object(settings, "RECOMMENDER_MODE", "user_based"):
+        model_store = ModelStore(session_factory=session_factory, refresh_interval_seconds=0,
+                                 artifact_store=artifact_store)
+        snapshot = model_store.get_snapshot()
+        # 建立快照時已一併建立，請求路徑只讀取
+        assert snapshot.user_ann_index is not None
+        assert model_store.get_user_ann_index(snapshot) is snapshot.user_ann_index
+        with patch.object(RandomProjectionLSH, "build", side_effect=AssertionError("built on the request path")):
+            model_store.create_recommender(MagicMock())
+
+        # 隨快照發佈後，載入端直接以 memory mapping 讀取，不再重建
+        artifact_store.publish(snapshot)
+        with patch.object(RandomProjectionLSH, "build", side_effect=AssertionError("should be loaded")):
+            reloaded = model_store.refresh()
+        assert reloaded is not snapshot
+        assert np.array_equal(reloaded.user_ann_index.codes, snapshot.user_ann_index.codes)
+
+        # 增量更新只在尾端附加用戶，沿用同一份索引
+        updated, _ = reloaded.with_interactions(np.array([40]), np.array([100]), np.array([5.0]), 3, reloaded.watermark)
+        assert updated.user_ann_index is reloaded.user_ann_index
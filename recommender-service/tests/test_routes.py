@@ -1,29 +1,45 @@
+import os
+import tempfile
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import StaticPool
-from redis import Redis
-from unittest.mock import MagicMock
+from sqlalchemy.pool import NullPool
+from unittest.mock import AsyncMock, MagicMock, patch
 
 from app.main import app
 from app.models.db import Base
 from app.models.user import User
 from app.models.product import Product, Category
-from app.models.order import OrderItem
+from app.models.order import Order, OrderItem
 from app.models.interaction import UserInteraction
-from app.dependencies import get_db, get_redis_client
+import asyncio
+from app.dependencies import (get_db, get_async_db, get_async_redis_client, get_model_store, get_recommendation_cache,
+                              get_recalculation_queue, get_health_monitor)
+from app.services.model_store import ModelStore
+from app.services.recommendation_cache import LocalTTLCache, RecommendationCache
+from app.services.recalculation_queue import RecalculationQueue, recalculate_recommendations
+from app.services.health import HealthMonitor, database_check, redis_check
+from app.services.ranked_list import RankedList
+from app.services.sharding import shard_of_user
+from app.core.config import settings
 
 # --- Test Database Setup ---
-SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
+# 同步（背景建置、計分）與非同步（請求路徑）兩個 engine 需看到同一份資料，因此使用暫存檔而非 :memory:
+TEST_DB_PATH = os.path.join(tempfile.mkdtemp(), "test_recommender.db")
+SQLALCHEMY_DATABASE_URL = f"sqlite:///{TEST_DB_PATH}"
+ASYNC_SQLALCHEMY_DATABASE_URL = f"sqlite+aiosqlite:///{TEST_DB_PATH}"
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
     connect_args={"check_same_thread": False},
-    poolclass=StaticPool,
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(bind=async_engine, class_=AsyncSession, expire_on_commit=False)
+
 @pytest.fixture(name="session")
 def session_fixture():
     Base.metadata.create_all(bind=engine)
@@ -38,14 +54,43 @@ def session_fixture():
 def client_fixture(session):
     def override_get_db():
         yield session
-    
-    mock_redis = MagicMock(spec=Redis)
+
+    async def override_get_async_db():
+        async with TestingAsyncSessionLocal() as async_session:
+            yield async_session
+
+    # redis.asyncio 的指令方法並非 coroutine function，spec 無法推斷為 AsyncMock，因此不設 spec
+    mock_redis = AsyncMock()
     mock_redis.ping.return_value = True
+    mock_redis.pipeline = MagicMock()
+    mock_redis.pipeline.return_value.execute = AsyncMock()
     def override_get_redis_client():
         return mock_redis
 
+    # 每個測試使用獨立的模型快照，避免沿用前一個測試的資料
+    model_store = ModelStore(session_factory=TestingSessionLocal, refresh_interval_seconds=0)
+    def override_get_model_store():
+        return model_store
+
+    # 進程內快取同樣每個測試獨立
+    cache = RecommendationCache(LocalTTLCache(max_entries=100, ttl_seconds=60, stale_ttl_seconds=60), ttl_seconds=3600)
+    def override_get_recommendation_cache():
+        return cache
+
     app.dependency_overrides[get_db] = override_get_db
-    app.dependency_overrides[get_redis_client] = override_get_redis_client
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    app.dependency_overrides[get_async_redis_client] = override_get_redis_client
+    app.dependency_overrides[get_model_store] = override_get_model_store
+    app.dependency_overrides[get_recommendation_cache] = override_get_recommendation_cache
+
+    # 重算佇列不啟動背景 worker，由測試自行 drain
+    queue = RecalculationQueue(batch_size=10, batch_window_seconds=0)
+    app.dependency_overrides[get_recalculation_queue] = lambda: queue
+
+    # 健康檢查不啟動背景 task，第一次探測時檢查並快取結果
+    health_monitor = HealthMonitor({"database": database_check(TestingAsyncSessionLocal),
+                                    "redis": redis_check(override_get_redis_client)})
+    app.dependency_overrides[get_health_monitor] = lambda: health_monitor
     
     yield TestClient(app)
     
@@ -68,7 +113,12 @@ def populate_db(session):
     session.commit()
     session.refresh(product1)
 
-    session.add(OrderItem(user_id=user1.id, product_id=product1.id, quantity=1, price=product1.price))
+    order1 = Order(user_id=user1.id, order_number="ORD-0001", total_amount=product1.price, status="completed")
+    session.add(order1)
+    session.commit()
+    session.refresh(order1)
+
+    session.add(OrderItem(order_id=order1.id, product_id=product1.id, quantity=1, price=product1.price))
     session.add(UserInteraction(user_id=user1.id, product_id=product1.id, interaction_type="view"))
     session.commit()
     
@@ -78,28 +128,92 @@ def populate_db(session):
 
 def test_get_recommendations_calculate_and_cache(client, populate_db):
     user1_id = populate_db["user1"].id
-    mock_redis = app.dependency_overrides[get_redis_client]()
+    mock_redis = app.dependency_overrides[get_async_redis_client]()
     mock_redis.get.return_value = None
     
     response = client.get(f"/api/v1/recommendations/{user1_id}")
     assert response.status_code == 200
     assert isinstance(response.json(), list)
-    mock_redis.setex.assert_called_once() # Verify setex was called, meaning caching happened
+    mock_redis.setex.assert_awaited_once() # Verify setex was called, meaning caching happened
+
+def test_get_recommendations_served_from_local_cache(client, populate_db):
+    user1_id = populate_db["user1"].id
+    mock_redis = app.dependency_overrides[get_async_redis_client]()
+    mock_redis.get.return_value = None
+    cache = app.dependency_overrides[get_recommendation_cache]()
+
+    first = client.get(f"/api/v1/recommendations/{user1_id}")
+    mock_redis.get.reset_mock()
+    second = client.get(f"/api/v1/recommendations/{user1_id}")
+    assert second.json() == first.json()
+    mock_redis.get.assert_not_awaited()  # 第二次請求不需要 Redis 往返
+    assert cache.local.hits == 1
+
+    stats = client.get("/api/v1/cache/stats").json()
+    assert stats["local"]["hits"] == 1
+    assert stats["redis"]["misses"] == 1
+
+def test_get_recommendations_serves_stale_and_refreshes(client, populate_db):
+    user1_id = populate_db["user1"].id
+    mock_redis = app.dependency_overrides[get_async_redis_client]()
+    mock_redis.get.return_value = None
+    cache = app.dependency_overrides[get_recommendation_cache]()
+    cache.local.ttl_seconds = 0  # 寫入即過期，但仍在 stale 期限內
+    cache.local.set(user1_id, RankedList.create([12345], depth=50))
+
+    response = client.get(f"/api/v1/recommendations/{user1_id}")
+    assert response.status_code == 200
+    assert response.json() == [12345]
+    assert cache.local.stale_hits == 1
+    mock_redis.get.assert_not_awaited()
 
 def test_health_check_success(client):
     response = client.get("/health")
     assert response.status_code == 200
-    assert response.json() == {"status": "ok", "database": "connected", "redis": "connected"}
+    # scoring worker 一併回報分片設定，供路由前端啟動時核對
+    assert response.json() == {"status": "ok", "database": "connected", "redis": "connected",
+                               "num_shards": 1, "shard_index": 0}
+
+    # 結果已快取，再次探測不會重新連線
+    mock_redis = app.dependency_overrides[get_async_redis_client]()
+    assert client.get("/health").status_code == 200
+    assert mock_redis.ping.await_count == 1
+
+def test_health_check_redis_down(client):
+    app.dependency_overrides[get_async_redis_client]().ping.side_effect = ConnectionError("Connection refused")
+    response = client.get("/health")
+    assert response.status_code == 500
+    assert response.json()["detail"] == "Service unhealthy: redis error: Connection refused"
 
 def test_recalculate_recommendations(client, populate_db):
     user1_id = populate_db["user1"].id
-    mock_redis = app.dependency_overrides[get_redis_client]()
-    mock_redis.get.return_value = None # Ensure cache miss for recalculate scenario
+    mock_redis = app.dependency_overrides[get_async_redis_client]()
+    queue = app.dependency_overrides[get_recalculation_queue]()
 
     response = client.post(f"/api/v1/recommendations/recalculate/{user1_id}")
-    assert response.status_code == 200
-    assert response.json()["message"] == f"Recommendations for user {user1_id} re-calculated and cached."
-    mock_redis.setex.assert_called_once() # Verify setex was called after recalculation
+    assert response.status_code == 202
+    assert response.json()["message"] == f"Recalculation for user {user1_id} queued."
+    assert response.json()["queued"] is True
+    # 重算在背景執行，端點回應前不會寫入 Redis
+    mock_redis.pipeline.return_value.execute.assert_not_awaited()
+
+    # 同一用戶已在佇列中，不會重複排入
+    response = client.post(f"/api/v1/recommendations/recalculate/{user1_id}")
+    assert response.status_code == 202
+    assert response.json()["queued"] is False
+    assert client.get("/api/v1/recalculation/stats").json()["depth"] == 1
+
+    model_store = app.dependency_overrides[get_model_store]()
+    cache = app.dependency_overrides[get_recommendation_cache]()
+    drained = asyncio.run(queue.drain(
+        lambda user_ids: recalculate_recommendations(model_store, mock_redis, cache, user_ids)))
+    assert drained == 1
+    mock_redis.pipeline.return_value.execute.assert_awaited_once()
+
+    stats = client.get("/api/v1/recalculation/stats").json()
+    assert stats["depth"] == 0
+    assert stats["processed"] == 1
+    assert stats["deduplicated"] == 1
 
 def test_get_recommendations_user_not_found(client, session):
     non_existent_user_id = 999
@@ -112,3 +226,147 @@ def test_recalculate_recommendations_user_not_found(client, session):
     response = client.post(f"/api/v1/recommendations/recalculate/{non_existent_user_id}")
     assert response.status_code == 404
     assert "User with ID 999 not found." in response.json()["detail"]
+
+def test_model_snapshot_is_shared_between_requests(session, populate_db):
+    model_store = ModelStore(session_factory=TestingSessionLocal, refresh_interval_seconds=0)
+
+    first = model_store.get_snapshot(session)
+    second = model_store.get_snapshot(session)
+    assert first is second
+    assert populate_db["user1"].id in first.users
+
+    refreshed = model_store.refresh(session)
+    assert refreshed is not first
+    assert refreshed.version == first.version + 1
+    assert model_store.get_snapshot() is refreshed
+
+def test_batch_recommendations(client, populate_db):
+    user1_id = populate_db["user1"].id
+    mock_redis = app.dependency_overrides[get_async_redis_client]()
+    mock_redis.mget.return_value = [None]
+
+    response = client.post("/api/v1/recommendations/batch", json={"user_ids": [user1_id, 999], "num_recommendations": 3})
+    assert response.status_code == 200
+    body = response.json()
+    assert list(body["recommendations"].keys()) == [str(user1_id)]
+    assert body["not_found"] == [999]
+    mock_redis.mget.assert_awaited_once()
+    mock_redis.pipeline.return_value.execute.assert_awaited_once()
+
+def test_incremental_refresh_matches_full_rebuild(session, populate_db):
+    model_store = ModelStore(session_factory=TestingSessionLocal, refresh_interval_seconds=0)
+    first = model_store.get_snapshot(session)
+    assert model_store.refresh_incremental(session) == []
+
+    user2 = User(name="Test User 2", email="test2@example.com", password="hashed_password")
+    product2 = Product(name="Mouse", description="Wireless mouse", price=20.0, stock=5)
+    session.add_all([user2, product2])
+    session.commit()
+    session.add(UserInteraction(user_id=user2.id, product_id=populate_db["product1"].id, interaction_type="click"))
+    session.add(UserInteraction(user_id=user2.id, product_id=product2.id, interaction_type="favorite"))
+    session.commit()
+
+    notified = []
+    model_store.add_update_listener(notified.append)
+    affected = model_store.refresh_incremental(session)
+    assert affected == [user2.id]
+    assert notified == [[user2.id]]
+
+    incremental = model_store.get_snapshot()
+    assert incremental.version == first.version + 1
+    full = model_store.refresh(session)
+    for user_id in full.all_user_ids:
+        for product_id in full.all_product_ids:
+            expected = full.interaction_matrix[full.users.encode_one(user_id), full.products.encode_one(product_id)]
+            actual = incremental.interaction_matrix[incremental.users.encode_one(user_id), incremental.products.encode_one(product_id)]
+            assert expected == actual
+
+def test_incremental_refresh_picks_up_late_commits_below_the_watermark(session, populate_db):
+    model_store = ModelStore(session_factory=TestingSessionLocal, refresh_interval_seconds=0)
+    model_store.get_snapshot(session)
+    user1_id, product1_id = populate_db["user1"].id, populate_db["product1"].id
+    product2 = Product(name="Mouse", description="Wireless mouse", price=20.0, stock=5)
+    session.add(product2)
+    session.commit()
+
+    # id 較大的交易先提交，水位前進到 high_id
+    high_id = model_store.get_snapshot().watermark.interaction_id + 5
+    session.add(UserInteraction(id=high_id, user_id=user1_id, product_id=product1_id, interaction_type="click"))
+    session.commit()
+    assert model_store.refresh_incremental(session) == []  # 購買的分數較高，沒有變動
+    assert model_store.get_snapshot().watermark.interaction_id == high_id
+
+    # 較早配置 id、較晚提交的交易：id 低於水位，仍在重讀範圍內
+    session.add(UserInteraction(id=high_id - 2, user_id=user1_id, product_id=product2.id, interaction_type="favorite"))
+    session.commit()
+    assert model_store.refresh_incremental(session) == [user1_id]
+    snapshot = model_store.get_snapshot()
+    assert snapshot.interaction_matrix[snapshot.users.encode_one(user1_id), snapshot.products.encode_one(product2.id)] == 4
+
+    with patch.object(settings, "MODEL_INCREMENTAL_OVERLAP_IDS", 0):
+        session.add(UserInteraction(id=high_id - 1, user_id=user1_id, product_id=product2.id, interaction_type="purchase"))
+        session.commit()
+        assert model_store.refresh_incremental(session) == []  # 不重讀時會漏掉，直到下次完整重建
+
+def test_metrics_endpoint(client, populate_db):
+    user_id = populate_db["user1"].id
+    client.app.dependency_overrides[get_async_redis_client]().get.return_value = None
+    assert client.get(f"/api/v1/recommendations/{user_id}?num_recommendations=1").status_code == 200
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = response.text
+    # 以路由樣板為標籤，而非實際的用戶 ID
+    assert ('http_request_duration_seconds_count{method="GET",route="/api/v1/recommendations/{user_id}",status="200"}'
+            in body)
+    assert 'recommender_stage_duration_seconds_count{stage="db_load"}' in body
+    assert 'recommendation_cache_requests_total{tier="local",result="miss"}' in body
+
+def test_get_recommendations_with_filters_bypasses_cache(client, populate_db):
+    user1_id = populate_db["user1"].id
+    product1_id = populate_db["product1"].id
+    mock_redis = app.dependency_overrides[get_async_redis_client]()
+
+    response = client.get(f"/api/v1/recommendations/{user1_id}",
+                          params={"category_id": populate_db["product1"].category_id, "exclude": [product1_id]})
+    assert response.status_code == 200
+    assert product1_id not in response.json()
+    mock_redis.get.assert_not_awaited()
+    mock_redis.setex.assert_not_awaited()
+
+    with patch.object(settings, "MAX_EXCLUDED_PRODUCTS", 1):
+        response = client.get(f"/api/v1/recommendations/{user1_id}", params={"exclude": [1, 2]})
+    assert response.status_code == 422
+
+def test_get_recommendations_slices_cached_ranked_list(client, populate_db):
+    user1_id = populate_db["user1"].id
+    mock_redis = app.dependency_overrides[get_async_redis_client]()
+    mock_redis.get.return_value = RankedList.create([7, 8, 9], [0.9, 0.5, 0.1], depth=10).encode()
+
+    # 不同的 num_recommendations 共用同一份快取，各自切片
+    assert client.get(f"/api/v1/recommendations/{user1_id}", params={"num_recommendations": 2}).json() == [7, 8]
+    assert client.get(f"/api/v1/recommendations/{user1_id}", params={"num_recommendations": 10}).json() == [7, 8, 9]
+    mock_redis.get.assert_awaited_once()
+    mock_redis.setex.assert_not_awaited()
+
+    # 要求的數量超過快取深度時重新計算，並以較深的深度寫回
+    response = client.get(f"/api/v1/recommendations/{user1_id}", params={"num_recommendations": 80})
+    assert response.status_code == 200
+    mock_redis.setex.assert_awaited_once()
+    assert RankedList.decode(mock_redis.setex.await_args.args[2]).depth == 80
+
+def test_sharded_worker_rejects_users_of_other_shards(client, populate_db, tmp_path):
+    user1_id = populate_db["user1"].id
+    other_shard = 1 - shard_of_user(user1_id, 2)
+    # 分片需要離線建立的鄰居表；請求在載入前即被拒絕，目錄存在即可
+    with patch.object(settings, "RECOMMENDER_MODE", "item_based"), patch.object(settings, "ITEM_INDEX_DIR", str(tmp_path)):
+        model_store = ModelStore(session_factory=TestingSessionLocal, refresh_interval_seconds=0,
+                                 num_shards=2, shard_index=other_shard)
+    app.dependency_overrides[get_model_store] = lambda: model_store
+
+    assert client.get(f"/api/v1/recommendations/{user1_id}").status_code == 421
+    assert client.post(f"/api/v1/recommendations/recalculate/{user1_id}").status_code == 421
+    response = client.post("/api/v1/recommendations/batch", json={"user_ids": [user1_id]})
+    assert response.status_code == 421
+    app.dependency_overrides[get_async_redis_client]().get.assert_not_awaited()
@@ -0,0 +1,211 @@
+import asyncio
+import httpx
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from scipy import sparse
+from unittest.mock import MagicMock, patch
+
+from app.api.v1.shard_routes import router as shard_routes
+from app.core.config import settings
+from app.dependencies import get_shard_router
+from app.services.als import ALSModel
+from app.services.artifacts import ModelArtifactStore
+from app.services.model_snapshot import ModelSnapshot
+from app.services.model_store import ModelStore
+from app.services.recommender_logic import ItemBasedRecommender
+from app.services.scoring import normalize_rows
+from app.services.sharding import ShardMisconfigured, ShardRouter, shard_of_user, shard_of_users
+
+# users 10, 20, 30; products 100..103（與 test_recommender 相同）；兩個分片時 user 10 在分片 1，20、30 在分片 0
+USER_IDS = [10, 20, 30]
+PRODUCT_IDS = [100, 101, 102, 103]
+DENSE = np.array([
+    [5, 3, 0, 0],
+    [5, 3, 4, 0],
+    [0, 0, 2, 5],
+], dtype=np.float32)
+
+
+def build_snapshot():
+    matrix = sparse.csr_matrix(DENSE)
+    return ModelSnapshot(1, matrix, USER_IDS, PRODUCT_IDS, normalize_rows(matrix))
+
+
+def test_shard_assignment_is_stable_and_balanced():
+    # 路由前端與各分片各自計算分片編號，結果不可隨版本改變
+    assert shard_of_users([1, 2, 3, 10, 20, 30, 40, 12345], 4).tolist() == [1, 2, 0, 1, 2, 2, 1, 1]
+    assert shard_of_user(12345, 4) == 1
+    assert shard_of_users([7, 8], 1).tolist() == [0, 0]
+
+    counts = np.bincount(shard_of_users(np.arange(1, 100001), 4), minlength=4)
+    assert counts.min() > 24000 and counts.max() < 26000
+
+
+def test_snapshot_for_shard_keeps_only_owned_user_rows():
+    snapshot = build_snapshot()
+    shard = snapshot.for_shard(0, 2)
+
+    assert shard.all_user_ids.tolist() == [20, 30]
+    assert shard.all_product_ids.tolist() == PRODUCT_IDS
+    assert np.array_equal(shard.interaction_matrix.toarray(), DENSE[1:])
+    assert np.allclose(shard.normalized_matrix.toarray(), snapshot.normalized_matrix.toarray()[1:])
+    assert snapshot.for_shard(0, 1) is snapshot
+
+
+def test_sharded_model_store_uses_item_index_built_offline_from_all_users(tmp_path):
+    # 鄰居表由離線工作以所有用戶的互動建立一次，隨模型檔發佈，各分片以 memory mapping 載入
+    full_snapshot = build_snapshot()
+    unsharded = ItemBasedRecommender(MagicMock(), snapshot=full_snapshot)
+    artifact_store = ModelArtifactStore(str(tmp_path / "artifacts"))
+    artifact_store.publish(full_snapshot, item_index=unsharded._get_item_index(full_snapshot))
+    session_factory = MagicMock(side_effect=AssertionError("database should not be used"))
+
+    with patch.object(settings, "RECOMMENDER_MODE", "item_based"), \
+            patch.object(settings, "ITEM_INDEX_DIR", str(tmp_path / "missing")):
+        model_store = ModelStore(session_factory=session_factory, refresh_interval_seconds=0,
+                                 artifact_store=artifact_store, num_shards=2, shard_index=1)
+        snapshot = model_store.get_snapshot()
+        item_index = model_store.get_item_index()
+
+    assert snapshot.all_user_ids.tolist() == [10]
+    assert model_store.owns_user(10) and not model_store.owns_user(20)
+    sharded = ItemBasedRecommender(MagicMock(), snapshot=snapshot, item_index=item_index)
+    assert sharded.recommend_for_user(10, 3) == unsharded.recommend_for_user(10, 3)
+
+
+def test_sharded_model_store_requires_offline_item_side_models(tmp_path):
+    # 分片只有本分片的用戶，不能在進程內以完整矩陣重建鄰居表 / ALS 因子
+    artifact_store = ModelArtifactStore(str(tmp_path / "artifacts"))
+    artifact_store.publish(build_snapshot())
+    for mode, setting in (("item_based", "ITEM_INDEX_DIR"), ("als", "ALS_MODEL_DIR")):
+        with patch.object(settings, "RECOMMENDER_MODE", mode), patch.object(settings, setting, str(tmp_path / "missing")):
+            with pytest.raises(ValueError, match=setting):
+                ModelStore(refresh_interval_seconds=0, num_shards=2, shard_index=0)
+            model_store = ModelStore(session_factory=MagicMock(), refresh_interval_seconds=0,
+                                     artifact_store=artifact_store, num_shards=2, shard_index=0)
+            with pytest.raises(RuntimeError, match="built offline"):
+                model_store.get_snapshot()
+
+
+def test_sharded_model_store_keeps_only_owned_als_user_factors(tmp_path):
+    artifact_store = ModelArtifactStore(str(tmp_path / "artifacts"))
+    artifact_store.publish(build_snapshot())
+    full_model = ALSModel.train(sparse.csr_matrix(DENSE), USER_IDS, PRODUCT_IDS, factors=2, iterations=2)
+    full_model.save(str(tmp_path / "als"))
+
+    with patch.object(settings, "RECOMMENDER_MODE", "als"), patch.object(settings, "ALS_MODEL_DIR", str(tmp_path / "als")):
+        model_store = ModelStore(session_factory=MagicMock(side_effect=AssertionError("database should not be used")),
+                                 refresh_interval_seconds=0, artifact_store=artifact_store, num_shards=2, shard_index=0)
+        als_model = model_store.get_als_model()
+
+    # 用戶因子與互動列一樣依分片切分，商品因子仍為完整一份
+    assert als_model.user_ids.tolist() == [20, 30]
+    assert np.array_equal(als_model.user_factors, full_model.user_factors[1:])
+    assert np.array_equal(als_model.item_factors, full_model.item_factors)
+    assert np.array_equal(als_model.user_vector(30), full_model.user_vector(30))
+
+
+def test_user_based_mode_cannot_be_sharded():
+    with patch.object(settings, "RECOMMENDER_MODE", "user_based"):
+        with pytest.raises(ValueError, match="default user_based mode .* cannot be sharded"):
+            ModelStore(refresh_interval_seconds=0, num_shards=2, shard_index=0)
+        assert not ModelStore(refresh_interval_seconds=0, num_shards=1).is_sharded
+
+
+def build_router_client(handler) -> TestClient:
+    shard_router = ShardRouter(["http://shard-0", "http://shard-1"], transport=httpx.MockTransport(handler))
+    app = FastAPI()
+    app.include_router(shard_routes, prefix=settings.API_V1_STR)
+    app.dependency_overrides[get_shard_router] = lambda: shard_router
+    return TestClient(app)
+
+
+def test_router_forwards_to_owning_shard_with_query_params():
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200, json=[102])
+
+    client = build_router_client(handler)
+    response = client.get("/api/v1/recommendations/10", params=[("num_recommendations", 3), ("exclude", 1),
+                                                                ("exclude", 2)])
+
+    assert response.status_code == 200 and response.json() == [102]
+    assert str(requests[0].url) == "http://shard-1/api/v1/recommendations/10?num_recommendations=3&exclude=1&exclude=2"
+
+
+def test_router_fans_out_batch_and_merges_in_request_order():
+    seen = {}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        shard = int(request.url.host.rsplit("-", 1)[1])
+        body = httpx.Response(200, content=request.content).json()
+        seen[shard] = body
+        assert all(shard_of_user(user_id, 2) == shard for user_id in body["user_ids"])
+        found = [user_id for user_id in body["user_ids"] if user_id != 30]
+        return httpx.Response(200, json={"recommendations": {str(user_id): [user_id * 10] for user_id in found},
+                                         "not_found": [user_id for user_id in body["user_ids"] if user_id == 30]})
+
+    client = build_router_client(handler)
+    response = client.post("/api/v1/recommendations/batch",
+                           json={"user_ids": [30, 10, 20, 10], "num_recommendations": 2, "category_id": 4})
+
+    assert response.status_code == 200
+    assert list(response.json()["recommendations"]) == ["10", "20"]
+    assert response.json() == {"recommendations": {"10": [100], "20": [200]}, "not_found": [30]}
+    assert seen[0]["user_ids"] == [30, 20] and seen[1]["user_ids"] == [10]
+    assert seen[0]["category_id"] == 4 and seen[0]["num_recommendations"] == 2
+
+
+def test_router_reports_unreachable_shard_as_bad_gateway():
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.host == "shard-1":
+            raise httpx.ConnectError("Connection refused", request=request)
+        return httpx.Response(200, json={"recommendations": {}, "not_found": []})
+
+    client = build_router_client(handler)
+    assert client.post("/api/v1/recommendations/batch", json={"user_ids": [10, 20]}).status_code == 502
+    assert client.get("/api/v1/recommendations/20").status_code == 200
+    assert client.get("/api/v1/cache/stats").status_code == 502
+
+
+def _topology_handler(reported):
+    def handler(request: httpx.Request) -> httpx.Response:
+        shard = int(request.url.host.rsplit("-", 1)[1])
+        num_shards, shard_index = reported[shard]
+        return httpx.Response(200, json={"status": "ok", "num_shards": num_shards, "shard_index": shard_index})
+    return handler
+
+
+def test_router_validates_shard_configuration_at_startup():
+    urls = ["http://shard-0", "http://shard-1"]
+    asyncio.run(ShardRouter(urls, transport=httpx.MockTransport(_topology_handler({0: (2, 0), 1: (2, 1)})))
+                .validate_shards(timeout_seconds=0))
+
+    # 分片以 NUM_SHARDS=3 啟動，或兩個分片的 SHARD_INDEX 對調，雜湊結果與路由前端不同
+    for reported in ({0: (2, 0), 1: (3, 1)}, {0: (2, 1), 1: (2, 0)}):
+        router = ShardRouter(urls, transport=httpx.MockTransport(_topology_handler(reported)))
+        with pytest.raises(ShardMisconfigured):
+            asyncio.run(router.validate_shards(timeout_seconds=0))
+
+
+def test_router_validation_waits_for_unreachable_shards_until_timeout():
+    attempts = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        attempts.append(request.url.host)
+        if request.url.host == "shard-1" and attempts.count("shard-1") < 2:
+            raise httpx.ConnectError("Connection refused", request=request)
+        return _topology_handler({0: (2, 0), 1: (2, 1)})(request)
+
+    router = ShardRouter(["http://shard-0", "http://shard-1"], transport=httpx.MockTransport(handler))
+    asyncio.run(router.validate_shards(timeout_seconds=5, poll_interval_seconds=0))
+    # 已確認的分片不再重複探測，晚啟動的分片在下一輪確認
+    assert attempts == ["shard-0", "shard-1", "shard-1"]
+
+    never_up = ShardRouter(["http://shard-0"], transport=httpx.MockTransport(
+        lambda request: httpx.Response(500, json={"detail": "starting"})))
+    asyncio.run(never_up.validate_shards(timeout_seconds=0))  # 逾時只記錄錯誤，不中止啟動
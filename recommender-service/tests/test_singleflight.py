@@ -0,0 +1,47 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+from app.services.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_computation():
+    single_flight = SingleFlight()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return [1, 2, 3]
+
+    async def main():
+        return await asyncio.gather(*(single_flight.do("user:1:recommendations", compute) for _ in range(10)))
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert all(result == [1, 2, 3] for result in results)
+    assert single_flight.inflight_count == 0
+
+
+def test_waits_for_other_worker_when_lock_is_held():
+    single_flight = SingleFlight(wait_timeout_seconds=1.0, poll_interval_seconds=0.01)
+    redis_client = AsyncMock()
+    redis_client.set.return_value = None  # 鎖已被其他 worker 持有
+    compute = AsyncMock(return_value=[9])
+    read_cached = AsyncMock(side_effect=[None, [4, 5]])
+
+    result = asyncio.run(single_flight.do("user:1:recommendations", compute,
+                                          redis_client=redis_client, read_cached=read_cached))
+    assert result == [4, 5]
+    compute.assert_not_awaited()
+
+
+def test_computes_locally_after_waiting_times_out():
+    single_flight = SingleFlight(wait_timeout_seconds=0.05, poll_interval_seconds=0.01)
+    redis_client = AsyncMock()
+    redis_client.set.return_value = None
+    compute = AsyncMock(return_value=[9])
+
+    result = asyncio.run(single_flight.do("user:1:recommendations", compute,
+                                          redis_client=redis_client, read_cached=AsyncMock(return_value=None)))
+    assert result == [9]
+    compute.assert_awaited_once()